@@ -0,0 +1,144 @@
+from typing import Optional
+
+import json
+import logging
+import uuid
+from celery.result import AsyncResult
+from datetime import timedelta
+from django.contrib.auth.models import AnonymousUser
+from django.http import JsonResponse, QueryDict
+from django.utils.timezone import now
+from pretix.api.models import OAuthAccessToken, OAuthApplication
+from pretix.base.models import Device, Event, TeamAPIToken, User
+from rest_framework import status
+
+from pretix_fzbackend_utils.models import FzAsyncJob
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+ASYNC_JOB_STATE_PENDING = "pending"
+ASYNC_JOB_STATE_RUNNING = "running"
+ASYNC_JOB_STATE_DONE = "done"
+ASYNC_JOB_STATE_FAILED = "failed"
+# Same as celery's default result_expires: after this the result backend may have forgotten the job
+ASYNC_JOB_TTL = timedelta(days=1)
+
+
+# Minimal stand-in of a DRF request, used to run the endpoints' logic outside of an http request
+class FzTaskRequest:
+    def __init__(self, event: Event, data, user=None, auth=None):
+        self.event = event
+        self.organizer = event.organizer
+        self.data = data
+        self.user = user if user is not None else AnonymousUser()
+        self.auth = auth
+        self.GET = QueryDict()
+        self.query_params = self.GET
+        self.headers = {}
+
+
+def isAsyncRequest(request) -> bool:
+    return request.GET.get("async", "").lower() in ("1", "true")
+
+
+# Like pretix.base.views.tasks.AsyncAction, the job state is read back from the celery result backend
+def jobStatusData(res: AsyncResult, eventId: int) -> Optional[dict]:
+    data = {
+        "jobId": res.id,
+        "state": ASYNC_JOB_STATE_PENDING,
+        "status": None,
+        "result": None,
+    }
+    if res.state == "STARTED":
+        data["state"] = ASYNC_JOB_STATE_RUNNING
+    elif res.ready():
+        if not res.successful() or isinstance(res.info, Exception):
+            data["state"] = ASYNC_JOB_STATE_FAILED
+            data["status"] = status.HTTP_500_INTERNAL_SERVER_ERROR
+            data["result"] = {"error": "Internal server error"}
+        else:
+            # Don't leak results of jobs of other events
+            if res.info["event"] != eventId:
+                return None
+            data["state"] = (
+                ASYNC_JOB_STATE_DONE
+                if res.info["status"] < 400
+                else ASYNC_JOB_STATE_FAILED
+            )
+            data["status"] = res.info["status"]
+            data["result"] = res.info["result"]
+    return data
+
+
+def authToTaskKwargs(request) -> dict:
+    kwargs = {"user": request.user.pk if request.user.is_authenticated else None}
+    auth = request.auth
+    if isinstance(auth, TeamAPIToken):
+        kwargs["api_token"] = auth.pk
+    elif isinstance(auth, Device):
+        kwargs["device"] = auth.pk
+    elif isinstance(auth, OAuthAccessToken):
+        kwargs["oauth_application"] = auth.application_id
+    elif isinstance(auth, OAuthApplication):
+        kwargs["oauth_application"] = auth.pk
+    return kwargs
+
+
+def taskKwargsToAuth(
+    user: int = None,
+    api_token: int = None,
+    device: int = None,
+    oauth_application: int = None,
+):
+    authUser = User.objects.get(pk=user) if user is not None else None
+    auth = None
+    if api_token is not None:
+        auth = TeamAPIToken.objects.get(pk=api_token)
+    elif device is not None:
+        auth = Device.objects.get(pk=device)
+    elif oauth_application is not None:
+        auth = OAuthApplication.objects.get(pk=oauth_application)
+    return authUser, auth
+
+
+# Queues the operation on celery and immediately answers with the id of the job to poll. If celery runs
+# eagerly (no broker configured) the job is already done and its result is returned right away
+def enqueueAsyncOperation(request, operation: str) -> JsonResponse:
+    from pretix_fzbackend_utils.tasks import runAsyncOperation
+
+    # Recorded before queueing, so that the job can be polled as soon as its id is known
+    jobId = uuid.uuid4()
+    FzAsyncJob.objects.create(event=request.event, job_id=jobId, operation=operation)
+    res = runAsyncOperation.apply_async(
+        task_id=str(jobId),
+        kwargs={
+            "event": request.event.pk,
+            "operation": operation,
+            "data": request.data,
+            **authToTaskKwargs(request),
+        },
+    )
+    logger.info(f"Queued async {operation} job {res.id}")
+    return JsonResponse(
+        jobStatusData(res, request.event.pk), status=status.HTTP_202_ACCEPTED
+    )
+
+
+# Returns whether jobId was queued for the event and may still be known by the result backend
+def isKnownAsyncJob(event: Event, jobId) -> bool:
+    return FzAsyncJob.objects.filter(
+        event=event, job_id=jobId, created__gte=now() - ASYNC_JOB_TTL
+    ).exists()
+
+
+def evictExpiredAsyncJobs():
+    deleted, _ = FzAsyncJob.objects.filter(created__lt=now() - ASYNC_JOB_TTL).delete()
+    if deleted:
+        logger.info(f"AsyncJob: Evicted {deleted} expired jobs")
+
+
+def responseToJobResult(response):
+    if response.get("Content-Type", "").startswith("application/json"):
+        return json.loads(response.content)
+    return None
@@ -0,0 +1,141 @@
+from typing import Optional, Tuple
+
+import hashlib
+import json
+import logging
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.utils.timezone import now
+from functools import wraps
+from pretix.base.models import Event
+from rest_framework import status
+
+from pretix_fzbackend_utils.models import FzIdempotencyRecord
+from pretix_fzbackend_utils.utils import verifyToken
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+# Stored responses older than this are ignored and periodically evicted
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+# A key still in progress after this long is considered abandoned and can be reserved again
+IDEMPOTENCY_PENDING_TIMEOUT = timedelta(minutes=15)
+
+
+# Decorator for the post() method of mutating endpoints. If the request carries an Idempotency-Key header, the
+# response is stored and any later request with the same key gets it back without running the endpoint again.
+# The key is reserved before the endpoint runs, so a concurrent retry with the same key gets a 409 instead of running
+# it a second time, and a key reused for a different request is rejected. Server errors are not stored, so that the
+# request can actually be retried
+def idempotent(endpoint: str):
+    def decorator(post):
+        @wraps(post)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+            if not key:
+                return post(self, request, *args, **kwargs)
+            if len(key) > FzIdempotencyRecord._meta.get_field("key").max_length:
+                return JsonResponse(
+                    {"error": f'Invalid header "{IDEMPOTENCY_KEY_HEADER}"'},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            # Stored responses must not be handed out before authenticating the caller
+            verifyToken(request)
+
+            requestHash = idempotencyRequestHash(request.data, request.GET)
+            reserved, record = reserveIdempotencyKey(
+                request.event, endpoint, key, requestHash
+            )
+            if not reserved:
+                if record is not None and record.request_hash != requestHash:
+                    logger.warning(
+                        f"Idempotency [{endpoint}]: Key {key} reused for a different request"
+                    )
+                    return JsonResponse(
+                        {
+                            "error": f'"{IDEMPOTENCY_KEY_HEADER}" already used for a different request'
+                        },
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    )
+                if record is None or record.status_code is None:
+                    logger.warning(
+                        f"Idempotency [{endpoint}]: Key {key} is still in progress"
+                    )
+                    return JsonResponse(
+                        {
+                            "error": f'A request with the same "{IDEMPOTENCY_KEY_HEADER}" is still in progress'
+                        },
+                        status=status.HTTP_409_CONFLICT,
+                    )
+                logger.info(
+                    f"Idempotency [{endpoint}]: Replaying stored response for key {key}"
+                )
+                return HttpResponse(
+                    bytes(record.body),
+                    status=record.status_code,
+                    content_type=record.content_type,
+                )
+
+            records = FzIdempotencyRecord.objects.filter(
+                event=request.event, endpoint=endpoint, key=key
+            )
+            try:
+                response = post(self, request, *args, **kwargs)
+            except BaseException:
+                records.delete()
+                raise
+            if response.status_code < 500:
+                records.update(
+                    status_code=response.status_code,
+                    content_type=response.get("Content-Type", ""),
+                    body=response.content,
+                )
+            else:
+                records.delete()
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+# Digest of what the endpoint receives: the body and the query parameters (e.g. async)
+def idempotencyRequestHash(data, query) -> str:
+    payload = json.dumps(
+        {"data": data, "query": sorted(query.lists())}, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# Inserts the pending record of the key. Returns (True, None) if the key was reserved, otherwise (False, the record
+# that holds the key). The record may be None if the request holding the key released it in the meantime
+def reserveIdempotencyKey(
+    event: Event, endpoint: str, key: str, requestHash: str
+) -> Tuple[bool, Optional[FzIdempotencyRecord]]:
+    records = FzIdempotencyRecord.objects.filter(
+        event=event, endpoint=endpoint, key=key
+    )
+    # Expired records and reservations left behind by a worker that died while running the endpoint don't hold the key
+    records.filter(
+        Q(created__lt=now() - IDEMPOTENCY_KEY_TTL)
+        | Q(status_code__isnull=True, created__lt=now() - IDEMPOTENCY_PENDING_TIMEOUT)
+    ).delete()
+    try:
+        with transaction.atomic():
+            FzIdempotencyRecord.objects.create(
+                event=event, endpoint=endpoint, key=key, request_hash=requestHash
+            )
+        return True, None
+    except IntegrityError:
+        return False, records.first()
+
+
+def evictExpiredIdempotencyRecords():
+    deleted, _ = FzIdempotencyRecord.objects.filter(
+        created__lt=now() - IDEMPOTENCY_KEY_TTL
+    ).delete()
+    if deleted:
+        logger.info(f"Idempotency: Evicted {deleted} expired records")
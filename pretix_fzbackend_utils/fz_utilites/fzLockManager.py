@@ -0,0 +1,181 @@
+from typing import Dict, Iterable, List, Optional
+
+import logging
+from django.db.models.functions import Length
+from django.http import Http404
+from pretix.base.models import (
+    Event,
+    Item,
+    ItemVariation,
+    Order,
+    OrderPayment,
+    OrderPosition,
+    OrderRefund,
+)
+from pretix.helpers import OF_SELF
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# Collects the rows an operation needs and locks them with one SELECT ... FOR UPDATE per table, always in the same
+# global order: orders, positions, payments, refunds, items, variations. Orders are sorted by code length and then by
+# code (see utils.lockOrderKey()), everything else by pk. As long as every endpoint locks through this class, two
+# transactions can never wait on each other's rows in opposite order.
+# Advisory locks (lock_objects()) on quotas and seats always come first: every endpoint works them out from an unlocked
+# read, takes them with a single lock_objects() BEFORE calling lock(), and checks afterwards that the locked rows still
+# match what has been read. Whatever pretix locks on its own later in the transaction (OCM commit, order creation,
+# payment confirm) is already held, so it never waits while holding rows.
+#
+# Usage:
+#   locks = FzLockManager(event).addOrders([code]).addPositions([posId]).addPayments([...states]).lock()
+#   order = locks.order(code)
+#
+# read() runs the same queries without FOR UPDATE, for dry runs and quotes
+class FzLockManager:
+    event: Event
+    orders: Dict[str, Order]
+    positions: Dict[int, OrderPosition]
+    payments: List[OrderPayment]
+    refunds: List[OrderRefund]
+    items: Dict[int, Item]
+    variations: Dict[int, ItemVariation]
+
+    def __init__(self, event: Event):
+        self.event = event
+        self._orderCodes = set()
+        self._positionIds = set()
+        self._paymentStates: Optional[List[str]] = None
+        self._refundStates: Optional[List[str]] = None
+        self._itemIds = set()
+        self._variationIds = set()
+        self.orders = {}
+        self.positions = {}
+        self.payments = []
+        self.refunds = []
+        self.items = {}
+        self.variations = {}
+
+    def addOrders(self, orderCodes: Iterable[str]):
+        self._orderCodes.update(orderCodes)
+        return self
+
+    # Positions of the added orders, canceled ones included. Item, variation, subevent and seat are joined in
+    def addPositions(self, positionIds: Iterable[Optional[int]]):
+        self._positionIds.update(p for p in positionIds if p is not None)
+        return self
+
+    # Payments of the added orders in one of the given states
+    def addPayments(self, states: List[str]):
+        self._paymentStates = list(states)
+        return self
+
+    # Refunds of the added orders in one of the given states
+    def addRefunds(self, states: List[str]):
+        self._refundStates = list(states)
+        return self
+
+    def addItems(self, itemIds: Iterable[Optional[int]]):
+        self._itemIds.update(i for i in itemIds if i is not None)
+        return self
+
+    def addVariations(self, variationIds: Iterable[Optional[int]]):
+        self._variationIds.update(v for v in variationIds if v is not None)
+        return self
+
+    def lock(self):
+        return self._load(forUpdate=True)
+
+    def read(self):
+        return self._load(forUpdate=False)
+
+    def _qs(self, qs, forUpdate: bool):
+        return qs.select_for_update(of=OF_SELF) if forUpdate else qs
+
+    def _load(self, forUpdate: bool):
+        if self._orderCodes:
+            for order in (
+                self._qs(Order.objects, forUpdate)
+                .filter(event=self.event, code__in=self._orderCodes)
+                .order_by(Length("code").desc(), "code")
+            ):
+                # Already loaded, avoids a query every time the order event is used (e.g. inside the OCM)
+                order.event = self.event
+                self.orders[order.code] = order
+        orderPks = {order.pk: order for order in self.orders.values()}
+
+        if self._positionIds and orderPks:
+            for position in (
+                self._qs(OrderPosition.all, forUpdate)
+                .select_related("item", "variation", "subevent", "seat")
+                .filter(pk__in=self._positionIds, order_id__in=orderPks.keys())
+                .order_by("pk")
+            ):
+                position.order = orderPks[position.order_id]
+                self.positions[position.pk] = position
+
+        if self._paymentStates is not None and orderPks:
+            self.payments = list(
+                self._qs(OrderPayment.objects, forUpdate)
+                .filter(order_id__in=orderPks.keys(), state__in=self._paymentStates)
+                .order_by("pk")
+            )
+            for payment in self.payments:
+                payment.order = orderPks[payment.order_id]
+
+        if self._refundStates is not None and orderPks:
+            self.refunds = list(
+                self._qs(OrderRefund.objects, forUpdate)
+                .filter(order_id__in=orderPks.keys(), state__in=self._refundStates)
+                .order_by("pk")
+            )
+            for refund in self.refunds:
+                refund.order = orderPks[refund.order_id]
+
+        if self._itemIds:
+            self.items = {
+                item.pk: item
+                for item in self._qs(Item.objects, forUpdate)
+                .filter(event=self.event, pk__in=self._itemIds)
+                .order_by("pk")
+            }
+
+        if self._variationIds:
+            self.variations = {
+                variation.pk: variation
+                for variation in self._qs(ItemVariation.objects, forUpdate)
+                .filter(item__event=self.event, pk__in=self._variationIds)
+                .order_by("pk")
+            }
+
+        return self
+
+    # Accessors with get_object_or_404() semantics
+
+    def order(self, orderCode: str) -> Order:
+        if orderCode not in self.orders:
+            raise Http404("No Order matches the given query.")
+        return self.orders[orderCode]
+
+    def position(self, positionId: int, order: Order) -> OrderPosition:
+        position = self.positions.get(positionId, None)
+        if position is None or position.order_id != order.pk:
+            raise Http404("No OrderPosition matches the given query.")
+        return position
+
+    def item(self, itemId: int) -> Item:
+        if itemId not in self.items:
+            raise Http404("No Item matches the given query.")
+        return self.items[itemId]
+
+    def variation(self, variationId: int, item: Item) -> ItemVariation:
+        variation = self.variations.get(variationId, None)
+        if variation is None or variation.item_id != item.pk:
+            raise Http404("No ItemVariation matches the given query.")
+        return variation
+
+    def paymentsOf(self, order: Order) -> List[OrderPayment]:
+        return [p for p in self.payments if p.order_id == order.pk]
+
+    def refundsOf(self, order: Order) -> List[OrderRefund]:
+        return [r for r in self.refunds if r.order_id == order.pk]
@@ -8,6 +8,8 @@ from pretix.base.models.tax import TaxedPrice, TaxRule
 from pretix.base.services.orders import OrderChangeManager, OrderError, error_messages
 from pretix.base.services.pricing import get_price
 
+from pretix_fzbackend_utils.fz_utilites.fzOrderSignals import invalidateTicketsOnCommit
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -15,11 +17,18 @@ logger.setLevel(logging.DEBUG)
 class FzOrderChangeManager(OrderChangeManager):
     fz_enable_locking = True
 
-    # If fz_enable_locking is set to False, the caller takes responsability for calling `lock_objects([event])` once per transaction
+    # If fz_enable_locking is set to False, the caller takes responsability for calling `lock_objects()` once per transaction
+    # (either on the whole event or on the involved quotas and seats)
     def _create_locks(self):
         if self.fz_enable_locking:
             super()._create_locks()
 
+    # Deferred to the commit and deduplicated with the other invalidations of the same orders (see fzOrderSignals)
+    def _clear_tickets_cache(self):
+        invalidateTicketsOnCommit(self.event, self.order)
+        if self.split_order:
+            invalidateTicketsOnCommit(self.event, self.split_order)
+
     def recomputeOperation(self):
         self._operations.append(self.ForceRecomputeOperation())
 
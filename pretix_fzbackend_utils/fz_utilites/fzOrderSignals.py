@@ -0,0 +1,72 @@
+from typing import Callable, Hashable
+
+from django.db import transaction
+from pretix.base.i18n import language
+from pretix.base.models import Event, Order
+from pretix.base.services import tickets
+from pretix.base.signals import order_modified, order_paid, order_placed
+
+
+class _OnCommitOnce:
+    def __init__(self, key: Hashable, dispatch: Callable[[], None], pendingKeys: set):
+        self.key = key
+        self.dispatch = dispatch
+        self.pendingKeys = pendingKeys
+
+    def __call__(self):
+        if self.key in self.pendingKeys:
+            self.pendingKeys.discard(self.key)
+            self.dispatch()
+
+
+# Runs dispatch once the current transaction commits, at most once per key no matter how many times it has been
+# requested. Every request registers its own callback (cheap), so a rolled back savepoint cannot drop a dispatch that
+# was also requested outside of it; the first callback that runs dispatches and the others find the key already gone.
+# The pending keys live on the connection, shared by the callbacks of the same transaction. Django drops the callbacks
+# of a rolled back transaction, so when none of ours is queued the keys left there are stale and are reset
+def _onCommitOnce(key: Hashable, dispatch: Callable[[], None]):
+    connection = transaction.get_connection()
+    if not any(
+        isinstance(func, _OnCommitOnce) for _, func, *_ in connection.run_on_commit
+    ):
+        connection.fzPendingOnCommitKeys = set()
+    pendingKeys = connection.fzPendingOnCommitKeys
+    pendingKeys.add(key)
+    transaction.on_commit(_OnCommitOnce(key, dispatch, pendingKeys))
+
+
+# Replaces tickets.invalidate_cache.apply_async(). Besides deduplicating, the task can no longer run before the
+# transaction commits and cache tickets built from the old data
+def invalidateTicketsOnCommit(event: Event, order: Order):
+    eventId, orderId = event.pk, order.pk
+    _onCommitOnce(
+        ("tickets", orderId),
+        lambda: tickets.invalidate_cache.apply_async(
+            kwargs={"event": eventId, "order": orderId}
+        ),
+    )
+
+
+# Replaces order_modified.send()
+def sendOrderModifiedOnCommit(event: Event, order: Order):
+    _onCommitOnce(
+        ("modified", order.pk), lambda: order_modified.send(sender=event, order=order)
+    )
+
+
+# Replace order_placed.send() and order_paid.send() of an order created by the plugin. If the transaction is retried
+# (see atomicWithRetry()) the receivers only see the attempt that committed, in the language of the order
+def sendOrderPlacedOnCommit(event: Event, order: Order):
+    def dispatch():
+        with language(order.locale, event.settings.region):
+            order_placed.send(event, order=order, bulk=False)
+
+    _onCommitOnce(("placed", order.pk), dispatch)
+
+
+def sendOrderPaidOnCommit(event: Event, order: Order):
+    def dispatch():
+        with language(order.locale, event.settings.region):
+            order_paid.send(event, order=order)
+
+    _onCommitOnce(("paid", order.pk), dispatch)
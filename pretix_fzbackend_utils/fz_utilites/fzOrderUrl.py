@@ -0,0 +1,29 @@
+from typing import Optional, Tuple
+
+import re
+from django.urls import Resolver404, get_urlconf, resolve
+from functools import lru_cache
+
+# Shape of pretix's presale "event.order" url (order/<order>/<secret>/), wherever the event is mounted: under
+# /<organizer>/<event>/, under /<event>/ on organizer domains or at the root on event domains
+ORDER_URL_RE = re.compile(r"(?:^|/)order/[^/]+/[A-Za-z0-9]+/$")
+ORDER_URL_CACHE_SIZE = 1024
+
+
+# Returns (order code, secret) if path is the presale order detail page, None otherwise. Only paths with the order url
+# shape go through resolve(), and their result is cached per urlconf since the same order pages are hit repeatedly
+def matchOrderUrl(path: str) -> Optional[Tuple[str, str]]:
+    if not ORDER_URL_RE.search(path):
+        return None
+    return resolveOrderUrl(get_urlconf(), path)
+
+
+@lru_cache(maxsize=ORDER_URL_CACHE_SIZE)
+def resolveOrderUrl(urlconf, path: str) -> Optional[Tuple[str, str]]:
+    try:
+        match = resolve(path, urlconf)
+    except Resolver404:
+        return None
+    if match.url_name != "event.order":
+        return None
+    return match.kwargs["order"], match.kwargs["secret"]
@@ -0,0 +1,65 @@
+from pretix.base.models import OrderPosition, QuestionAnswer
+
+# Attendee fields of OrderPositionInfoPatchSerializer. attendee_name_cached is kept in sync by OrderPosition.save()
+POSITION_INFO_FIELDS = [
+    "attendee_name_parts",
+    "company",
+    "street",
+    "zipcode",
+    "city",
+    "country",
+    "state",
+    "attendee_email",
+]
+
+
+# Copies attendee fields and answers (with their options) from source to dest, without going through the api
+# serializers: one UPDATE for the fields, one bulk INSERT for the answers and one for their options.
+# With moveAnswers the answers are instead reassigned to dest with a single UPDATE and source is left without answers.
+# dest must not have answers yet. Returns the copied data in the format of 'pretix.event.order.modified' log entries
+def clonePositionInfo(
+    source: OrderPosition, dest: OrderPosition, moveAnswers: bool = False
+) -> dict:
+    logData = {}
+    for field in POSITION_INFO_FIELDS:
+        value = getattr(source, field)
+        setattr(dest, field, value)
+        if value:
+            # Countries are stored as their code
+            logData[field] = value if isinstance(value, (str, dict)) else str(value)
+    dest.save(update_fields=POSITION_INFO_FIELDS)
+
+    if moveAnswers:
+        answers = list(source.answers.values_list("pk", "question_id", "answer"))
+        if answers:
+            # Options are attached to the answer rows, so they follow them
+            QuestionAnswer.objects.filter(pk__in=[pk for pk, _, _ in answers]).update(
+                orderposition=dest
+            )
+        for _, questionId, answer in answers:
+            logData[f"question_{questionId}"] = answer
+        return logData
+
+    answers = list(source.answers.prefetch_related("options"))
+    newAnswers = QuestionAnswer.objects.bulk_create(
+        [
+            QuestionAnswer(
+                orderposition=dest,
+                question_id=a.question_id,
+                answer=a.answer,
+                file=a.file,
+            )
+            for a in answers
+        ]
+    )
+    Through = QuestionAnswer.options.through
+    Through.objects.bulk_create(
+        [
+            Through(questionanswer_id=newAnswer.pk, questionoption_id=option.pk)
+            for answer, newAnswer in zip(answers, newAnswers)
+            for option in answer.options.all()
+        ]
+    )
+    for answer in answers:
+        logData[f"question_{answer.question_id}"] = answer.answer
+    return logData
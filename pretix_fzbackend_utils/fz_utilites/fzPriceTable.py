@@ -0,0 +1,45 @@
+from typing import Dict, Optional, Tuple
+
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Sum
+from pretix.base.models import Item, ItemBundle, ItemVariation
+
+from pretix_fzbackend_utils.fz_utilites.fzVersionedCache import FzVersionedCache
+
+PRICE_TABLE_CACHE = FzVersionedCache("pricetable")
+
+
+# (item pk, variation pk or None) -> base price of the item/variation minus the designated prices of its bundles.
+# Price ALWAYS includes taxes
+def itemPriceTable(eventId: int) -> Dict[Tuple[int, Optional[int]], Decimal]:
+    return PRICE_TABLE_CACHE.get(eventId, lambda: buildItemPriceTable(eventId))
+
+
+def buildItemPriceTable(eventId: int) -> Dict[Tuple[int, Optional[int]], Decimal]:
+    bundlePrices = {
+        row["base_item_id"]: row["designatedPrice"]
+        for row in ItemBundle.objects.filter(base_item__event_id=eventId)
+        .values("base_item_id")
+        .annotate(designatedPrice=Sum("designated_price"))
+        .order_by()
+    }
+    table = {}
+    itemPrices = {}
+    for itemId, price in Item.objects.filter(event_id=eventId).values_list(
+        "pk", "default_price"
+    ):
+        itemPrices[itemId] = price
+        table[(itemId, None)] = price - (bundlePrices.get(itemId) or 0)
+    for varId, itemId, price in ItemVariation.objects.filter(
+        item__event_id=eventId
+    ).values_list("pk", "item_id", "default_price"):
+        # Same fallback as ItemVariation.price
+        price = price if price is not None else itemPrices[itemId]
+        table[(itemId, varId)] = price - (bundlePrices.get(itemId) or 0)
+    return table
+
+
+# Deferred to the commit, otherwise a concurrent request could cache the old prices again before we commit
+def invalidateItemPriceTable(eventId: int):
+    transaction.on_commit(lambda: PRICE_TABLE_CACHE.invalidate(eventId))
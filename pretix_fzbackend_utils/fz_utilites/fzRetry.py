@@ -0,0 +1,94 @@
+from typing import Callable, Optional, TypeVar
+
+import logging
+import random
+import time
+from django.db import DatabaseError, connection, transaction
+from pretix.base.metrics import Counter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+T = TypeVar("T")
+
+RETRY_MAX_ATTEMPTS = 4
+# Seconds. The backoff before attempt n+1 is a random value in [0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2^(n-1))]
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 1.0
+
+PGCODE_DEADLOCK_DETECTED = "40P01"
+PGCODE_SERIALIZATION_FAILURE = "40001"
+RETRYABLE_PGCODES = {
+    PGCODE_DEADLOCK_DETECTED: "deadlock",
+    PGCODE_SERIALIZATION_FAILURE: "serialization",
+}
+
+fzbackendutils_transaction_retries = Counter(
+    "pretix_fzbackendutils_transaction_retries_total",
+    "Transactions of fz-backend endpoints retried after a deadlock or serialization failure",
+    ["operation", "reason"],
+)
+fzbackendutils_transaction_retries_exhausted = Counter(
+    "pretix_fzbackendutils_transaction_retries_exhausted_total",
+    "Transactions of fz-backend endpoints that failed even after all the retries",
+    ["operation", "reason"],
+)
+fzbackendutils_transaction_retry_seconds = Counter(
+    "pretix_fzbackendutils_transaction_retry_seconds_total",
+    "Time lost by fz-backend endpoints in failed attempts and backoffs",
+    ["operation"],
+)
+
+
+# "deadlock" or "serialization" if e (or the driver exception wrapped by Django) is worth a retry, None otherwise.
+# psycopg2 exposes the SQLSTATE as pgcode, psycopg 3 as sqlstate
+def retryableReason(e: BaseException) -> Optional[str]:
+    while e is not None:
+        code = getattr(e, "pgcode", None) or getattr(e, "sqlstate", None)
+        if code in RETRYABLE_PGCODES:
+            return RETRYABLE_PGCODES[code]
+        e = e.__cause__
+    return None
+
+
+# Runs fn() inside transaction.atomic(), retrying it with jittered exponential backoff when Postgres aborts the
+# transaction because of a deadlock or a serialization failure. If we are already inside a transaction we cannot
+# retry (the outer transaction is aborted as well), so fn() is just run in a savepoint and errors are propagated.
+# Side effects outside of the database are not rolled back: fn() must defer them with on_commit (see fzOrderSignals).
+# Signals sent synchronously by pretix itself (order_paid from OrderPayment.confirm(), order_changed from the OCM,
+# order_canceled from cancel_order()) cannot be deferred, so their receivers may also see attempts that were retried
+def atomicWithRetry(operation: str, fn: Callable[[], T]) -> T:
+    if connection.in_atomic_block:
+        with transaction.atomic():
+            return fn()
+
+    attempt = 1
+    while True:
+        start = time.monotonic()
+        try:
+            with transaction.atomic():
+                return fn()
+        except DatabaseError as e:
+            reason = retryableReason(e)
+            if reason is None:
+                raise
+            if attempt >= RETRY_MAX_ATTEMPTS:
+                logger.error(
+                    f"{operation}: Giving up after {attempt} attempts: {reason}"
+                )
+                fzbackendutils_transaction_retries_exhausted.inc(
+                    operation=operation, reason=reason
+                )
+                raise
+            delay = random.uniform(
+                0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1))
+            )
+            logger.warning(
+                f"{operation}: Attempt {attempt} failed with {reason}, retrying in {delay:.3f}s"
+            )
+            time.sleep(delay)
+            fzbackendutils_transaction_retries.inc(operation=operation, reason=reason)
+            fzbackendutils_transaction_retry_seconds.inc(
+                time.monotonic() - start, operation=operation
+            )
+            attempt += 1
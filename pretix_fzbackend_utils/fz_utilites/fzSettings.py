@@ -0,0 +1,62 @@
+from typing import Tuple
+
+import hashlib
+import re
+from django.db import transaction
+from pretix.base.models import Event
+from pretix.base.settings import GlobalSettingsObject
+
+from pretix_fzbackend_utils.fz_utilites.fzVersionedCache import FzVersionedCache
+
+# Plugin settings read on hot paths
+EVENT_SETTINGS_KEYS = ["fzbackendutils_redirect_url"]
+GLOBAL_SETTINGS_KEYS = ["fzbackendutils_internal_endpoint_token"]
+GLOBAL_SETTINGS_SCOPE = "global"
+ENDPOINT_TOKENS_SCOPE = "tokens"
+# Changes made by other processes may be seen this many seconds late
+SETTINGS_LOCAL_TTL = 5
+
+SETTINGS_CACHE = FzVersionedCache("settings", localTtl=SETTINGS_LOCAL_TTL)
+
+
+# Plugin settings of the event (including the values inherited from the organizer), as a dict key -> value
+def eventPluginSettings(event: Event) -> dict:
+    return SETTINGS_CACHE.get(
+        event.pk, lambda: {key: event.settings.get(key) for key in EVENT_SETTINGS_KEYS}
+    )
+
+
+def globalPluginSettings() -> dict:
+    def build():
+        settings = GlobalSettingsObject().settings
+        return {key: settings.get(key) for key in GLOBAL_SETTINGS_KEYS}
+
+    return SETTINGS_CACHE.get(GLOBAL_SETTINGS_SCOPE, build)
+
+
+# Sha256 digests of the internal endpoint tokens. The setting may hold several tokens separated by commas or
+# whitespace, all valid at the same time, so that fz-backend can switch to a new one before the old one is removed
+def internalEndpointTokenDigests() -> Tuple[bytes, ...]:
+    return SETTINGS_CACHE.get(ENDPOINT_TOKENS_SCOPE, buildInternalEndpointTokenDigests)
+
+
+def buildInternalEndpointTokenDigests() -> Tuple[bytes, ...]:
+    tokens = globalPluginSettings()["fzbackendutils_internal_endpoint_token"] or ""
+    return tuple(
+        hashlib.sha256(token.encode()).digest()
+        for token in re.split(r"[\s,]+", tokens)
+        if token
+    )
+
+
+# Deferred to the commit, otherwise a concurrent request could cache the old values again before we commit
+def invalidateEventPluginSettings(eventId: int):
+    transaction.on_commit(lambda: SETTINGS_CACHE.invalidate(eventId))
+
+
+def invalidateGlobalPluginSettings():
+    def invalidate():
+        SETTINGS_CACHE.invalidate(GLOBAL_SETTINGS_SCOPE)
+        SETTINGS_CACHE.invalidate(ENDPOINT_TOKENS_SCOPE)
+
+    transaction.on_commit(invalidate)
@@ -0,0 +1,38 @@
+from typing import Dict, List, Optional, Tuple
+
+# Pure data shuffling used by the transfer-order payload builder. No Django imports on purpose, so it can be
+# benchmarked on synthetic data (see tests/test_transfer_benchmark.py)
+
+
+# Renumbers copied positions for OrderCreateSerializer: every base position is followed by its addons, positionids
+# start from 1 and addon_to points to the new positionid of the parent. basePositions and positionIdToAddons are
+# keyed by the original position id (see copySourcePositions()) and are modified in place.
+# Returns the new positions and the new positionid of membershipCardAddonToPositionId (None if not found)
+def renumberTransferPositions(
+    basePositions: List[dict],
+    positionIdToAddons: Dict[int, List[dict]],
+    membershipCardAddonToPositionId: Optional[int] = None,
+) -> Tuple[List[dict], Optional[int]]:
+    membershipCardAddonToNewPositionId = None
+    posId = 1
+    newPositions = []
+    for pos in basePositions:
+        orgPositionId = pos["positionid"]
+        pos["positionid"] = posId
+        if (
+            membershipCardAddonToPositionId is not None
+            and orgPositionId == membershipCardAddonToPositionId
+        ):
+            membershipCardAddonToNewPositionId = posId
+        basePosId = posId
+        posId += 1
+        newPositions.append(pos)
+        addons = positionIdToAddons.get(orgPositionId)
+        if addons:
+            for addonPos in addons:
+                addonPos["addon_to"] = basePosId
+                addonPos["positionid"] = posId
+                posId += 1
+                newPositions.append(addonPos)
+
+    return newPositions, membershipCardAddonToNewPositionId
@@ -0,0 +1,67 @@
+from typing import Any, Callable, Dict, Tuple
+
+import time
+from django.core.cache import cache
+
+
+# Two level cache (in-process dict + Django cache) for small, rarely changing, per-scope tables.
+# Every scope (usually an event pk) has a version stamp stored in the Django cache. Values are stored under a key
+# containing the version, so invalidate() only needs to bump the stamp: every process notices the new version on the
+# next get() and rebuilds (or fetches from the Django cache) the value. A get() with a warm in-process entry costs
+# a single cache read and no database queries. With a localTtl, a warm in-process entry younger than localTtl seconds is
+# returned without even reading the stamp, so invalidations made by other processes are seen up to localTtl late
+class FzVersionedCache:
+    namespace: str
+    timeout: int
+    localTtl: float
+    _local: Dict[Any, Tuple[int, Any, float]]
+
+    def __init__(self, namespace: str, timeout: int = 3600, localTtl: float = 0):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.localTtl = localTtl
+        self._local = {}
+
+    def _versionKey(self, scope) -> str:
+        return f"fzbackendutils:{self.namespace}:{scope}:version"
+
+    def _valueKey(self, scope, version: int) -> str:
+        return f"fzbackendutils:{self.namespace}:{scope}:{version}"
+
+    def version(self, scope) -> int:
+        key = self._versionKey(scope)
+        version = cache.get(key)
+        if version is None:
+            version = time.time_ns()
+            # Another process may have been faster, in which case we use its version
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+        return version
+
+    def get(self, scope, builder: Callable[[], Any]) -> Any:
+        local = self._local.get(scope)
+        checked = time.monotonic()
+        if local is not None and checked - local[2] < self.localTtl:
+            return local[1]
+
+        version = self.version(scope)
+        if local is not None and local[0] == version:
+            self._local[scope] = (version, local[1], checked)
+            return local[1]
+
+        key = self._valueKey(scope, version)
+        value = cache.get(key)
+        if value is None:
+            value = builder()
+            cache.set(key, value, self.timeout)
+        self._local[scope] = (version, value, checked)
+        return value
+
+    def invalidate(self, scope):
+        self._local.pop(scope, None)
+        key = self._versionKey(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Missing version stamp
+            cache.set(key, time.time_ns(), None)
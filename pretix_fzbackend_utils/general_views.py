@@ -1,3 +1,5 @@
+from typing import List, Optional, Tuple
+
 import logging
 import re
 from django import forms
@@ -15,6 +17,7 @@ from pretix.control.views.event import EventSettingsFormView, EventSettingsViewM
 from rest_framework import status
 from rest_framework.views import APIView
 
+from .fz_utilites.fzIdempotency import idempotent
 from .utils import verifyToken
 
 logger = logging.getLogger(__name__)
@@ -51,29 +54,51 @@ class FznackendutilsSettings(EventSettingsViewMixin, EventSettingsFormView):
         )
 
 
+# Returns the error message for an invalid {position, is_bundle} entry, None if it is valid
+def validateItemBundleEntry(entry) -> Optional[str]:
+    if not isinstance(entry, dict) or "position" not in entry or not isinstance(entry["position"], int):
+        return 'Missing or invalid parameter "position"'
+    if "is_bundle" not in entry or not isinstance(entry["is_bundle"], bool):
+        return 'Missing or invalid parameter "is_bundle"'
+    return None
+
+
+# Sets is_bundled for a list of {position, is_bundle} entries of the event: one SELECT to find the existing positions
+# and at most one UPDATE per is_bundle value. Returns the number of updated positions and the missing ids
+def setItemBundles(event: Event, entries: List[dict]) -> Tuple[int, List[int]]:
+    wanted = {entry["position"]: entry["is_bundle"] for entry in entries}
+    existing = set(OrderPosition.objects.filter(order__event=event, id__in=wanted.keys()).values_list("id", flat=True))
+    updated = 0
+    for isBundle in (True, False):
+        ids = [pid for pid, value in wanted.items() if value == isBundle and pid in existing]
+        if ids:
+            updated += OrderPosition.objects.filter(id__in=ids).update(is_bundled=isBundle)
+    return updated, sorted(pid for pid in wanted if pid not in existing)
+
+
 @method_decorator(xframe_options_exempt, "dispatch")
 @method_decorator(csrf_exempt, "dispatch")
 class ApiSetItemBundle(APIView, View):
     permission = "can_change_orders"
 
+    @idempotent("set-item-bundle")
     def post(self, request, organizer, event, *args, **kwargs):
         verifyToken(request)
 
         data = request.data
-        if "position" not in data or not isinstance(data["position"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "position"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "is_bundle" not in data or not isinstance(data["is_bundle"], bool):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "is_bundle"'}, status=status.HTTP_400_BAD_REQUEST
-            )
+        # A list of entries is applied in bulk
+        if isinstance(data, list):
+            return self.postBulk(request, data)
+
+        error = validateItemBundleEntry(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
         logger.info(
             f"FzBackend is trying to set is_bundle for position {data['position']} to {data['is_bundle']}"
         )
 
         position: OrderPosition = get_object_or_404(
-            OrderPosition.objects.filter(id=data["position"])
+            OrderPosition.objects.filter(id=data["position"], order__event=request.event)
         )
 
         position.is_bundled = data["is_bundle"]
@@ -83,3 +108,23 @@ class ApiSetItemBundle(APIView, View):
         )
 
         return HttpResponse("")
+
+    def postBulk(self, request, data: list):
+        if len(data) == 0:
+            return JsonResponse({"error": "Empty list of positions"}, status=status.HTTP_400_BAD_REQUEST)
+        seen = {}
+        for index, entry in enumerate(data):
+            error = validateItemBundleEntry(entry)
+            if error is not None:
+                return JsonResponse({"error": f"{error} at index {index}"}, status=status.HTTP_400_BAD_REQUEST)
+            if seen.setdefault(entry["position"], entry["is_bundle"]) != entry["is_bundle"]:
+                return JsonResponse(
+                    {"error": f"Conflicting values for position {entry['position']} at index {index}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        logger.info(f"FzBackend is trying to set is_bundle for {len(seen)} positions")
+
+        updated, missing = setItemBundles(request.event, data)
+        logger.info(f"FzBackend successfully set is_bundle for {updated} positions, {len(missing)} missing")
+
+        return JsonResponse({"updated": updated, "missing": missing})
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ("pretixbase", "0280_cartposition_max_extend"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FzAsyncJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("job_id", models.UUIDField(unique=True)),
+                ("operation", models.CharField(max_length=190)),
+                ("created", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pretixbase.event",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="FzIdempotencyRecord",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False
+                    ),
+                ),
+                ("endpoint", models.CharField(max_length=190)),
+                ("key", models.CharField(max_length=190)),
+                ("request_hash", models.CharField(default="", max_length=64)),
+                ("status_code", models.PositiveSmallIntegerField(null=True)),
+                ("content_type", models.CharField(default="", max_length=190)),
+                ("body", models.BinaryField(default=b"")),
+                ("created", models.DateTimeField(auto_now_add=True, db_index=True)),
+                (
+                    "event",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="pretixbase.event",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("event", "endpoint", "key")},
+            },
+        ),
+    ]
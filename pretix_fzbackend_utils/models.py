@@ -0,0 +1,37 @@
+from django.db import models
+
+
+class FzIdempotencyRecord(models.Model):
+    """
+    Response of a mutating fz-backend endpoint, stored so that a request retried with the same
+    ``Idempotency-Key`` header gets the same answer without being executed twice. The row is
+    inserted before the endpoint runs, with a null ``status_code`` until its response is stored.
+    """
+
+    event = models.ForeignKey(
+        "pretixbase.Event", on_delete=models.CASCADE, related_name="+"
+    )
+    endpoint = models.CharField(max_length=190)
+    key = models.CharField(max_length=190)
+    request_hash = models.CharField(max_length=64, default="")
+    status_code = models.PositiveSmallIntegerField(null=True)
+    content_type = models.CharField(max_length=190, default="")
+    body = models.BinaryField(default=b"")
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = (("event", "endpoint", "key"),)
+
+
+class FzAsyncJob(models.Model):
+    """
+    Celery job queued by an ``?async=1`` request. Celery reports unknown job ids as pending, so the
+    job status endpoint only answers for the jobs recorded here.
+    """
+
+    event = models.ForeignKey(
+        "pretixbase.Event", on_delete=models.CASCADE, related_name="+"
+    )
+    job_id = models.UUIDField(unique=True)
+    operation = models.CharField(max_length=190)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
@@ -3,15 +3,43 @@ from collections import OrderedDict
 from django import forms
 from django.contrib.messages import constants as messages, get_messages
 from django.core.exceptions import PermissionDenied
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.urls import resolve, reverse
 from django.utils.translation import gettext_lazy as _
-from pretix.base.signals import register_global_settings, register_payment_providers
+from pretix.base.models import (
+    Event,
+    Event_SettingsStore,
+    Item,
+    ItemBundle,
+    ItemVariation,
+    Organizer_SettingsStore,
+)
+from pretix.base.settings import GlobalSettingsObject_SettingsStore
+from pretix.base.signals import (
+    periodic_task,
+    register_global_settings,
+    register_payment_providers,
+)
 from pretix.control.signals import nav_event_settings
 from pretix.helpers.http import redirect_to_url
+from pretix.helpers.periodic import minimum_interval
 from pretix.presale.signals import process_request
 from urllib.parse import urlencode
 
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import evictExpiredAsyncJobs
+from pretix_fzbackend_utils.fz_utilites.fzIdempotency import (
+    evictExpiredIdempotencyRecords,
+)
+from pretix_fzbackend_utils.fz_utilites.fzOrderUrl import matchOrderUrl
+from pretix_fzbackend_utils.fz_utilites.fzPriceTable import invalidateItemPriceTable
+from pretix_fzbackend_utils.fz_utilites.fzSettings import (
+    EVENT_SETTINGS_KEYS,
+    GLOBAL_SETTINGS_KEYS,
+    eventPluginSettings,
+    invalidateEventPluginSettings,
+    invalidateGlobalPluginSettings,
+)
 from pretix_fzbackend_utils.payment import FzbackendManualPaymentProvider
 
 logger = logging.getLogger(__name__)
@@ -20,16 +48,10 @@ logger.setLevel(logging.DEBUG)
 
 @receiver(process_request, dispatch_uid="fzbackendutils_process_request")
 def returnurl_process_request(sender, request, **kwargs):
-    try:
-        r = resolve(request.path_info)
-    except Exception as e:
-        logger.error("Error while resolving path info:", e)
-        return
-
-    if r.url_name == "event.order":
-        urlkwargs = r.kwargs
-
-        if not sender.settings.fzbackendutils_redirect_url:
+    orderUrl = matchOrderUrl(request.path_info)
+    if orderUrl is not None:
+        redirectUrl = eventPluginSettings(sender)["fzbackendutils_redirect_url"]
+        if not redirectUrl:
             raise PermissionDenied("fz-backend-utils: no order redirect url set")
 
         #  Fetch order status messages
@@ -45,12 +67,8 @@ def returnurl_process_request(sender, request, **kwargs):
             if message.level == messages.SUCCESS:
                 query.append(("success", str(message)))
 
-        order = urlkwargs["order"]
-        secret = urlkwargs["secret"]
-        url = (
-            sender.settings.fzbackendutils_redirect_url
-            + f"?c={order}&s={secret}&m={urlencode(query)}"
-        )
+        order, secret = orderUrl
+        url = redirectUrl + f"?c={order}&s={secret}&m={urlencode(query)}"
         logger.info(f"Redirecting to {url}")
         return redirect_to_url(url)
 
@@ -87,7 +105,8 @@ def globalSettings(**kwargs):
                     label=_("[FZBACKEND] Internal endpoint token"),
                     help_text=_(
                         "This plugin exposes some api for extra access to the fz-backend. This token needs to be specified in the "
-                        "<code>fz-backend-api</code> header to access these endpoints."
+                        "<code>fz-backend-api</code> header to access these endpoints. Several tokens separated by commas are all "
+                        "accepted, to rotate the token without downtime."
                     ),
                     required=False,
                 ),
@@ -99,3 +118,109 @@ def globalSettings(**kwargs):
 @receiver(register_payment_providers, dispatch_uid="payment_fzbackend_manual")
 def register_payment_provider(sender, **kwargs):
     return [FzbackendManualPaymentProvider]
+
+
+@receiver(periodic_task, dispatch_uid="fzbackendutils_idempotency_eviction")
+@minimum_interval(minutes_after_success=60)
+def evictIdempotencyRecords(sender, **kwargs):
+    evictExpiredIdempotencyRecords()
+
+
+@receiver(periodic_task, dispatch_uid="fzbackendutils_async_job_eviction")
+@minimum_interval(minutes_after_success=60)
+def evictAsyncJobs(sender, **kwargs):
+    evictExpiredAsyncJobs()
+
+
+# Price table invalidation. Saves and deletes of items, variations and bundles cover the control panel and the api.
+# Queryset updates skip these signals, a table cached before one of them expires with the cache timeout
+@receiver(post_save, sender=Item, dispatch_uid="fzbackendutils_pricetable_item_save")
+@receiver(
+    post_delete, sender=Item, dispatch_uid="fzbackendutils_pricetable_item_delete"
+)
+def invalidatePriceTableItem(sender, instance: Item, **kwargs):
+    invalidateItemPriceTable(instance.event_id)
+
+
+@receiver(
+    post_save,
+    sender=ItemVariation,
+    dispatch_uid="fzbackendutils_pricetable_variation_save",
+)
+@receiver(
+    post_delete,
+    sender=ItemVariation,
+    dispatch_uid="fzbackendutils_pricetable_variation_delete",
+)
+def invalidatePriceTableVariation(sender, instance: ItemVariation, **kwargs):
+    try:
+        invalidateItemPriceTable(instance.item.event_id)
+    except Item.DoesNotExist:
+        pass
+
+
+@receiver(
+    post_save, sender=ItemBundle, dispatch_uid="fzbackendutils_pricetable_bundle_save"
+)
+@receiver(
+    post_delete,
+    sender=ItemBundle,
+    dispatch_uid="fzbackendutils_pricetable_bundle_delete",
+)
+def invalidatePriceTableBundle(sender, instance: ItemBundle, **kwargs):
+    try:
+        invalidateItemPriceTable(instance.base_item.event_id)
+    except Item.DoesNotExist:
+        pass
+
+
+# Plugin settings cache invalidation. Covers the settings forms, the api and any other settings.set()/delete().
+# Organizer settings are inherited by all of its events
+@receiver(
+    post_save,
+    sender=Event_SettingsStore,
+    dispatch_uid="fzbackendutils_settings_event_save",
+)
+@receiver(
+    post_delete,
+    sender=Event_SettingsStore,
+    dispatch_uid="fzbackendutils_settings_event_delete",
+)
+def invalidateSettingsEvent(sender, instance: Event_SettingsStore, **kwargs):
+    if instance.key in EVENT_SETTINGS_KEYS:
+        invalidateEventPluginSettings(instance.object_id)
+
+
+@receiver(
+    post_save,
+    sender=Organizer_SettingsStore,
+    dispatch_uid="fzbackendutils_settings_organizer_save",
+)
+@receiver(
+    post_delete,
+    sender=Organizer_SettingsStore,
+    dispatch_uid="fzbackendutils_settings_organizer_delete",
+)
+def invalidateSettingsOrganizer(sender, instance: Organizer_SettingsStore, **kwargs):
+    if instance.key in EVENT_SETTINGS_KEYS:
+        for eventId in Event.objects.filter(
+            organizer_id=instance.object_id
+        ).values_list("pk", flat=True):
+            invalidateEventPluginSettings(eventId)
+
+
+@receiver(
+    post_save,
+    sender=GlobalSettingsObject_SettingsStore,
+    dispatch_uid="fzbackendutils_settings_global_save",
+)
+@receiver(
+    post_delete,
+    sender=GlobalSettingsObject_SettingsStore,
+    dispatch_uid="fzbackendutils_settings_global_delete",
+)
+def invalidateSettingsGlobal(
+    sender, instance: GlobalSettingsObject_SettingsStore, **kwargs
+):
+    if instance.key in GLOBAL_SETTINGS_KEYS:
+        invalidateGlobalPluginSettings()
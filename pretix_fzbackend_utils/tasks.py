@@ -0,0 +1,64 @@
+import logging
+from pretix.base.models import Event
+from pretix.base.services.tasks import ProfiledEventTask
+from pretix.celery_app import app
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import (
+    FzTaskRequest,
+    responseToJobResult,
+    taskKwargsToAuth,
+)
+from pretix_fzbackend_utils.utils import exceptionToErrorData
+from pretix_fzbackend_utils.views.convert_ticket_only import (
+    ApiConvertTicketOnlyOrder,
+    ApiConvertTicketOnlyOrders,
+)
+from pretix_fzbackend_utils.views.exchange_rooms import (
+    ApiExchangeRooms,
+    ApiExchangeRoomsBatch,
+    ApiExchangeRoomsCycle,
+)
+from pretix_fzbackend_utils.views.transfer_order import ApiTransferOrder
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+ASYNC_OPERATIONS = {
+    "transfer-order": ApiTransferOrder,
+    "exchange-rooms": ApiExchangeRooms,
+    "exchange-rooms-cycle": ApiExchangeRoomsCycle,
+    "exchange-rooms-batch": ApiExchangeRoomsBatch,
+    "convert-ticket-only-order": ApiConvertTicketOnlyOrder,
+    "convert-ticket-only-orders": ApiConvertTicketOnlyOrders,
+}
+
+
+@app.task(base=ProfiledEventTask, bind=True, track_started=True)
+def runAsyncOperation(
+    self,
+    event: Event,
+    operation: str,
+    data: dict,
+    user: int = None,
+    api_token: int = None,
+    device: int = None,
+    oauth_application: int = None,
+):
+    authUser, auth = taskKwargsToAuth(user, api_token, device, oauth_application)
+    request = FzTaskRequest(event, data, user=authUser, auth=auth)
+    try:
+        response = ASYNC_OPERATIONS[operation]().post(
+            request, event.organizer.slug, event.slug
+        )
+        statusCode, result = response.status_code, responseToJobResult(response)
+    except Exception as e:
+        statusCode, result = exceptionToErrorData(e)
+    logger.info(
+        f"Async {operation} job {self.request.id} done with status {statusCode}"
+    )
+    return {
+        "event": event.pk,
+        "operation": operation,
+        "status": statusCode,
+        "result": result,
+    }
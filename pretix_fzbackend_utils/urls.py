@@ -1,9 +1,19 @@
 from django.urls import include, path, re_path
 
 from .general_views import ApiSetItemBundle, FznackendutilsSettings
-from .views.convert_ticket_only import ApiConvertTicketOnlyOrder
-from .views.exchange_rooms import ApiExchangeRooms
-from .views.transfer_order import ApiTransferOrder
+from .views.bulk import ApiBulk
+from .views.convert_ticket_only import (
+    ApiConvertTicketOnlyOrder,
+    ApiConvertTicketOnlyOrders,
+)
+from .views.exchange_rooms import (
+    ApiExchangeRooms,
+    ApiExchangeRoomsBatch,
+    ApiExchangeRoomsCycle,
+    ApiExchangeRoomsQuote,
+)
+from .views.jobs import ApiJobStatus
+from .views.transfer_order import ApiTransferOrder, ApiTransferOrders
 
 urlpatterns = [
     re_path(
@@ -28,16 +38,51 @@ event_patterns = [
                     ApiConvertTicketOnlyOrder.as_view(),
                     name="convert-ticket-only-order",
                 ),
+                path(
+                    "convert-ticket-only-orders/",
+                    ApiConvertTicketOnlyOrders.as_view(),
+                    name="convert-ticket-only-orders",
+                ),
                 path(
                     "transfer-order/",
                     ApiTransferOrder.as_view(),
                     name="transfer-order",
                 ),
+                path(
+                    "transfer-orders/",
+                    ApiTransferOrders.as_view(),
+                    name="transfer-orders",
+                ),
                 path(
                     "exchange-rooms/",
                     ApiExchangeRooms.as_view(),
                     name="exchange-rooms",
                 ),
+                path(
+                    "exchange-rooms/quote/",
+                    ApiExchangeRoomsQuote.as_view(),
+                    name="exchange-rooms-quote",
+                ),
+                path(
+                    "exchange-rooms-cycle/",
+                    ApiExchangeRoomsCycle.as_view(),
+                    name="exchange-rooms-cycle",
+                ),
+                path(
+                    "exchange-rooms-batch/",
+                    ApiExchangeRoomsBatch.as_view(),
+                    name="exchange-rooms-batch",
+                ),
+                path(
+                    "bulk/",
+                    ApiBulk.as_view(),
+                    name="bulk",
+                ),
+                path(
+                    "jobs/<uuid:jobId>/",
+                    ApiJobStatus.as_view(),
+                    name="job-status",
+                ),
             ]
         ),
     ),
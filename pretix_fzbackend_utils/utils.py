@@ -1,16 +1,72 @@
+from typing import Tuple
+
+import hashlib
+import hmac
+import logging
 from django.http import Http404
-from pretix.base.settings import GlobalSettingsObject
+from pretix.base.services.locking import LockTimeoutException
+from pretix.base.services.orders import OrderError
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import FzTaskRequest
+from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzRetry import retryableReason
+from pretix_fzbackend_utils.fz_utilites.fzSettings import internalEndpointTokenDigests
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+TOKEN_HEADER = "fz-backend-api"
 
 STATUS_CODE_POSITION_CANCELED = 461
 STATUS_CODE_PAYMENT_INVALID = 462
 STATUS_CODE_REFUND_INVALID = 463
 
+# How many operations of a batch endpoint share a single transaction
+TRANSFER_BATCH_DEFAULT_CHUNK_SIZE = 10
+EXCHANGE_BATCH_DEFAULT_CHUNK_SIZE = 25
+CONVERT_BATCH_DEFAULT_CHUNK_SIZE = 50
+
 
+# Raises Http404 unless the request carries one of the configured internal endpoint tokens (if any is configured).
+# The token is compared by digest against every configured token, so the time taken does not depend on how much of
+# it matches. Requests built by the plugin itself (async jobs, bulk lines) were already verified when received
 def verifyToken(request):
-    pass
-    #token = request.headers.get("fz-backend-api")
-    #settings = GlobalSettingsObject().settings
-    #if settings.fzbackendutils_internal_endpoint_token and (
-    #    not token or token != settings.fzbackendutils_internal_endpoint_token
-    #):
-    #    return Http404("Token not found (invalid)")
+    if isinstance(request, FzTaskRequest):
+        return
+    digests = internalEndpointTokenDigests()
+    if not digests:
+        return
+    token = request.headers.get(TOKEN_HEADER)
+    digest = hashlib.sha256((token or "").encode()).digest()
+    valid = False
+    for expected in digests:
+        valid |= hmac.compare_digest(digest, expected)
+    if not token or not valid:
+        raise Http404("Token not found (invalid)")
+
+
+# Sort key used to acquire order locks always in the same order. Longer codes first, then alphabetical
+def lockOrderKey(orderCode: str):
+    return (-len(orderCode), orderCode)
+
+
+# Converts an exception raised while processing a single operation of a batch into (status code, error body)
+def exceptionToErrorData(e: Exception) -> Tuple[int, dict]:
+    if isinstance(e, FzException):
+        return (e.code if e.code is not None else status.HTTP_400_BAD_REQUEST), e.extraData
+    if isinstance(e, Http404):
+        return status.HTTP_404_NOT_FOUND, {"error": str(e) or "Not found"}
+    if isinstance(e, ValidationError):
+        return status.HTTP_400_BAD_REQUEST, {"error": e.detail}
+    if isinstance(e, OrderError):
+        return status.HTTP_400_BAD_REQUEST, {"error": str(e)}
+    # Nothing was changed: the operation can be sent again once the contention is over
+    if isinstance(e, LockTimeoutException):
+        return status.HTTP_409_CONFLICT, {"error": "Could not acquire the locks in time"}
+    reason = retryableReason(e)
+    if reason is not None:
+        return status.HTTP_409_CONFLICT, {"error": f"Transaction failed after all the retries: {reason}"}
+    logger.exception("Unexpected error while processing a batch operation", exc_info=e)
+    return status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": "Internal server error"}
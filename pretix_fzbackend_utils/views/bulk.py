@@ -0,0 +1,161 @@
+from typing import Iterator, Optional, Tuple
+
+import json
+import logging
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.clickjacking import xframe_options_exempt
+from django.views.decorators.csrf import csrf_exempt
+from django_scopes import scope
+from rest_framework import status
+from rest_framework.views import APIView
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import (
+    FzTaskRequest,
+    responseToJobResult,
+)
+from pretix_fzbackend_utils.fz_utilites.fzIdempotency import IDEMPOTENCY_KEY_HEADER
+from pretix_fzbackend_utils.general_views import ApiSetItemBundle
+from pretix_fzbackend_utils.views.convert_ticket_only import (
+    ApiConvertTicketOnlyOrder,
+    ApiConvertTicketOnlyOrders,
+)
+from pretix_fzbackend_utils.views.exchange_rooms import (
+    ApiExchangeRooms,
+    ApiExchangeRoomsBatch,
+    ApiExchangeRoomsCycle,
+)
+from pretix_fzbackend_utils.views.transfer_order import (
+    ApiTransferOrder,
+    ApiTransferOrders,
+)
+
+from ..utils import exceptionToErrorData, verifyToken
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+BULK_OPERATIONS = {
+    "set-item-bundle": ApiSetItemBundle,
+    "convert-ticket-only-order": ApiConvertTicketOnlyOrder,
+    "convert-ticket-only-orders": ApiConvertTicketOnlyOrders,
+    "transfer-order": ApiTransferOrder,
+    "transfer-orders": ApiTransferOrders,
+    "exchange-rooms": ApiExchangeRooms,
+    "exchange-rooms-cycle": ApiExchangeRoomsCycle,
+    "exchange-rooms-batch": ApiExchangeRoomsBatch,
+}
+# Longest accepted request line. The body is read one line at a time, so this bounds the memory used by a request
+BULK_MAX_LINE_BYTES = 1024 * 1024
+STATUS_CODE_LINE_TOO_LONG = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+
+
+# Endpoint that runs a newline-delimited json stream of operations over a single connection. Each line is
+# {"op": "<operation>", "data": {<body of the operation's endpoint>}, "id": <optional client reference>,
+# "idempotencyKey": <optional Idempotency-Key of the operation>}. The lines are processed in order, each one in its
+# own transactions exactly like a request to the operation's endpoint, and a result line
+# {"line", "id", "op", "status", "result"} is streamed back as soon as each operation finishes
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiBulk(APIView, View):
+    permission = "can_change_orders"
+
+    def post(self, request, organizer, event, *args, **kwargs):
+        verifyToken(request)
+        logger.info("ApiBulk: Starting bulk stream")
+        # request.data is never touched, otherwise the whole body would be parsed in memory
+        response = StreamingHttpResponse(
+            runBulkStream(request, readLines(request.stream)),
+            content_type="application/x-ndjson",
+        )
+        # Streamed results must not be buffered by proxies
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+# Yields the lines of the stream one by one. Lines longer than BULK_MAX_LINE_BYTES are skipped and yielded as None
+def readLines(stream) -> Iterator[Optional[bytes]]:
+    if stream is None:
+        return
+    while True:
+        line = stream.readline(BULK_MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        if len(line) > BULK_MAX_LINE_BYTES and not line.endswith(b"\n"):
+            # Drop the rest of the line without keeping it
+            while True:
+                rest = stream.readline(BULK_MAX_LINE_BYTES)
+                if not rest or rest.endswith(b"\n"):
+                    break
+            yield None
+            continue
+        yield line
+
+
+# The generator runs after the view has returned, so outside of the organizer scope set by the api middleware
+def runBulkStream(request, lines: Iterator[Optional[bytes]]) -> Iterator[bytes]:
+    done = 0
+    for lineNo, line in enumerate(lines, start=1):
+        if line is not None and not line.strip():
+            continue
+        with scope(organizer=request.organizer):
+            result = runBulkLine(request, lineNo, line)
+        done += 1
+        yield json.dumps(result).encode() + b"\n"
+    logger.info(f"ApiBulk: Bulk stream done, {done} operations processed")
+
+
+def runBulkLine(request, lineNo: int, line: Optional[bytes]) -> dict:
+    result = {"line": lineNo, "id": None, "op": None, "status": None, "result": None}
+    if line is None:
+        result["status"] = STATUS_CODE_LINE_TOO_LONG
+        result["result"] = {"error": f"Line longer than {BULK_MAX_LINE_BYTES} bytes"}
+        return result
+
+    try:
+        spec = json.loads(line)
+    except ValueError:
+        spec = None
+    if not isinstance(spec, dict):
+        result["status"] = status.HTTP_400_BAD_REQUEST
+        result["result"] = {"error": "Invalid json object"}
+        return result
+    result["id"] = spec.get("id")
+    result["op"] = spec.get("op")
+
+    error = validateBulkSpec(spec)
+    if error is not None:
+        result["status"] = status.HTTP_400_BAD_REQUEST
+        result["result"] = {"error": error}
+        return result
+
+    result["status"], result["result"] = runBulkOperation(request, spec)
+    return result
+
+
+# Returns the error message for an invalid operation line, None if it is valid
+def validateBulkSpec(spec: dict) -> Optional[str]:
+    if spec.get("op") not in BULK_OPERATIONS:
+        return 'Missing or invalid parameter "op"'
+    if "data" not in spec or not isinstance(spec["data"], (dict, list)):
+        return 'Missing or invalid parameter "data"'
+    if "idempotencyKey" in spec and not isinstance(spec["idempotencyKey"], str):
+        return 'Invalid parameter "idempotencyKey"'
+    return None
+
+
+# Runs the operation's endpoint logic like runAsyncOperation does, with the caller's authentication
+def runBulkOperation(request, spec: dict) -> Tuple[int, Optional[dict]]:
+    opRequest = FzTaskRequest(
+        request.event, spec["data"], user=request.user, auth=request.auth
+    )
+    if "idempotencyKey" in spec:
+        opRequest.headers = {IDEMPOTENCY_KEY_HEADER: spec["idempotencyKey"]}
+    try:
+        response = BULK_OPERATIONS[spec["op"]]().post(
+            opRequest, request.organizer.slug, request.event.slug
+        )
+        return response.status_code, responseToJobResult(response)
+    except Exception as e:
+        return exceptionToErrorData(e)
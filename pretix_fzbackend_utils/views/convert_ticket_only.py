@@ -1,22 +1,39 @@
+from typing import Dict, List, Optional
+
 import logging
 from django.db import transaction
-from django.http import HttpResponse, JsonResponse
-from django.shortcuts import get_object_or_404
+from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.decorators.csrf import csrf_exempt
-from pretix.api.serializers.orderchange import OrderPositionInfoPatchSerializer
-from pretix.base.models import Item, ItemVariation, Order, OrderPosition
-from pretix.base.services import tickets
-from pretix.base.signals import order_modified
-from pretix.helpers import OF_SELF
+from pretix.base.models import (
+    Event,
+    Item,
+    ItemVariation,
+    Order,
+    OrderPosition,
+    Quota,
+    Seat,
+)
+from pretix.base.services.locking import lock_objects
 from rest_framework import status
 from rest_framework.views import APIView
 
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import (
+    enqueueAsyncOperation,
+    isAsyncRequest,
+)
+from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzIdempotency import idempotent
+from pretix_fzbackend_utils.fz_utilites.fzLockManager import FzLockManager
 from pretix_fzbackend_utils.fz_utilites.fzOrderChangeManager import FzOrderChangeManager
+from pretix_fzbackend_utils.fz_utilites.fzOrderSignals import sendOrderModifiedOnCommit
+from pretix_fzbackend_utils.fz_utilites.fzPositionInfo import clonePositionInfo
+from pretix_fzbackend_utils.fz_utilites.fzRetry import atomicWithRetry, retryableReason
 
-from ..utils import verifyToken
+from ..utils import CONVERT_BATCH_DEFAULT_CHUNK_SIZE, exceptionToErrorData, verifyToken
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -27,26 +44,16 @@ logger.setLevel(logging.DEBUG)
 class ApiConvertTicketOnlyOrder(APIView, View):
     permission = "can_change_orders"
 
+    @idempotent("convert-ticket-only-order")
     def post(self, request, organizer, event, *args, **kwargs):
         verifyToken(request)
+        if isAsyncRequest(request):
+            return enqueueAsyncOperation(request, "convert-ticket-only-order")
         data = request.data
 
-        if "orderCode" not in data or not isinstance(data["orderCode"], str):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "orderCode"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "rootPositionId" not in data or not isinstance(data["rootPositionId"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "rootPositionId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "newRootItemId" not in data or not isinstance(data["newRootItemId"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "newRootItemId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "newRootItemVariationId" in data and data["newRootItemVariationId"] and not isinstance(data["newRootItemVariationId"], int):
-            return JsonResponse(
-                {"error": 'Invalid parameter "newRootItemVariationId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
+        error = validateConvertData(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
         orderCode = data["orderCode"]
         currentRootPositionId = data["rootPositionId"]
@@ -58,109 +65,250 @@ class ApiConvertTicketOnlyOrder(APIView, View):
             f"Got from req rootPosId={currentRootPositionId} newRootItemId={newRootItemId} newRootItemVariationId={newRootItemVariationId}"
         )
 
-        CONTEXT = {"event": request.event, "pdf_data": False, "check_quotas": False}
+        atomicWithRetry(
+            "convert-ticket-only-order",
+            lambda: convertTicketOnlyOrder(request, orderCode, currentRootPositionId, newRootItemId, newRootItemVariationId),
+        )
 
-        with transaction.atomic():
-            # OBTAINS OBJECTS FROM DB
-            # Original Order
-            order: Order = get_object_or_404(
-                Order.objects.select_for_update(of=OF_SELF).filter(event=request.event, code=orderCode, event__organizer=request.organizer)
-            )
-            # root position, item and variation
-            rootPosition: OrderPosition = get_object_or_404(
-                OrderPosition.objects.select_for_update(of=OF_SELF).filter(pk=currentRootPositionId, order__pk=order.pk)
-            )
-            rootItem: Item = rootPosition.item
-            rootItemVariation: ItemVariation = rootPosition.variation
-            logger.debug(
-                f"ApiConvertTicketOnlyOrder [{orderCode}]: "
-                f"Fetched current rootItem={rootItem.pk} rootItemVariation={rootItemVariation.pk if rootItemVariation else None}"
-            )
-            # new item and variation
-            newRootItem: Item = get_object_or_404(
-                Item.objects.select_for_update(of=OF_SELF).filter(pk=newRootItemId, event__pk=request.event.pk)
-            )
-            newRootItemVariation: ItemVariation = get_object_or_404(
-                ItemVariation.objects.select_for_update(of=OF_SELF).filter(pk=newRootItemVariationId, item__pk=newRootItemId)
-            ) if newRootItemVariationId is not None else None
-
-            # POSITION SWAP + CREATION
-            ocm = FzOrderChangeManager(
-                order=order,
-                user=self.request.user if self.request.user.is_authenticated else None,
-                auth=request.auth,
-                notify=False,
-                reissue_invoice=False,
-            )
-            newPositionHandler = ocm.add_position_no_addon_validation(
-                item=rootItem,
-                variation=rootItemVariation,
-                price=rootPosition.price,
-                addon_to=rootPosition,
-                subevent=rootPosition.subevent,
-                seat=rootPosition.seat,
-                # membership=rootPosition.membership,
-                valid_from=rootPosition.valid_from,
-                valid_until=rootPosition.valid_until,
-                is_bundled=True  # IMPORTANT!
-            )
-            ocm.change_item(
-                position=rootPosition,
-                item=newRootItem,
-                variation=newRootItemVariation
+        logger.info(
+            f"ApiConvertTicketOnlyOrder [{orderCode}]: Success"
+        )
+
+        return HttpResponse("")
+
+
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiConvertTicketOnlyOrders(APIView, View):
+    permission = "can_change_orders"
+
+    @idempotent("convert-ticket-only-orders")
+    def post(self, request, organizer, event, *args, **kwargs):
+        verifyToken(request)
+        if isAsyncRequest(request):
+            return enqueueAsyncOperation(request, "convert-ticket-only-orders")
+        data = request.data
+
+        if "conversions" not in data or not isinstance(data["conversions"], list):
+            return JsonResponse(
+                {"error": 'Missing or invalid parameter "conversions"'}, status=status.HTTP_400_BAD_REQUEST
             )
-            ocm.change_price(
-                position=rootPosition,
-                price=0  # newRootItem.default_price if newRootItemVariation is None else newRootItemVariation.default_price
+        if "chunkSize" in data and data["chunkSize"] is not None and (not isinstance(data["chunkSize"], int) or data["chunkSize"] < 1):
+            return JsonResponse(
+                {"error": 'Invalid parameter "chunkSize"'}, status=status.HTTP_400_BAD_REQUEST
             )
-            ocm.commit(check_quotas=False)
 
-            newPosition = newPositionHandler.position
-            logger.debug(
-                f"ApiConvertTicketOnlyOrder [{orderCode}]: Newly added position {newPosition.pk}"
-            )
+        conversions = data["conversions"]
+        chunkSize = data.get("chunkSize", None) or CONVERT_BATCH_DEFAULT_CHUNK_SIZE
+        results = [None] * len(conversions)
 
-            # We update with the extra data the newly created position
-            rootPositionSerializer = OrderPositionInfoPatchSerializer(instance=rootPosition, context=CONTEXT, partial=True)
-            tempSerializer = OrderPositionInfoPatchSerializer(context=CONTEXT, data=rootPositionSerializer.data, partial=True)
-            tempSerializer.is_valid(raise_exception=False)
-            finalData = {k: v for k, v in rootPositionSerializer.data.items() if k not in tempSerializer.errors and v is not None}
-            if 'attendee_name' in finalData and 'attendee_name_parts' in finalData:
-                if len(finalData['attendee_name_parts']) > 1:  # We have a _scheme element
-                    del finalData['attendee_name']
-                else:
-                    del finalData['attendee_name_parts']
-            newPositionSerializer = OrderPositionInfoPatchSerializer(instance=newPosition, context=CONTEXT, data=finalData, partial=True)
-            newPositionSerializer.is_valid(raise_exception=True)
-            newPositionSerializer.save()
-            rootPosition.refresh_from_db()
-            rootPositionSerializer = OrderPositionInfoPatchSerializer(instance=rootPosition, context=CONTEXT, data={"answers": []}, partial=True)
-            rootPositionSerializer.is_valid(raise_exception=True)
-            rootPositionSerializer.save()
-            # We log the extra data changes. The position operations are logged inside OCM already
-            if 'answers' in finalData:
-                for a in finalData['answers']:
-                    finalData[f'question_{a["question"]}'] = a["answer"]
-                finalData.pop('answers', None)
-            order.log_action(
-                'pretix.event.order.modified',
-                user=self.request.user,
-                auth=self.request.auth,
-                data={
-                    'data': [
-                        dict(
-                            position=newPosition.pk,
-                            **finalData
-                        )
-                    ]
+        # Invalid specs are reported immediately and never reach the db
+        validIdxs = []
+        for idx, spec in enumerate(conversions):
+            error = validateConvertData(spec) if isinstance(spec, dict) else "Invalid conversion spec"
+            if error is not None:
+                results[idx] = {
+                    "orderCode": spec.get("orderCode", None) if isinstance(spec, dict) else None,
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "error": {"error": error},
                 }
-            )
-
-            tickets.invalidate_cache.apply_async(kwargs={'event': request.event.pk, 'order': order.pk})
-            order_modified.send(sender=request.event, order=order)  # Sadly signal has to be sent twice: One after changing the extra info, and one inside ocm
+            else:
+                validIdxs.append(idx)
 
         logger.info(
-            f"ApiConvertTicketOnlyOrder [{orderCode}]: Success"
+            f"ApiConvertTicketOnlyOrders: Got {len(conversions)} conversions from req, {len(validIdxs)} valid, chunkSize={chunkSize}"
         )
 
-        return HttpResponse("")
+        for chunkStart in range(0, len(validIdxs), chunkSize):
+            chunk = validIdxs[chunkStart:chunkStart + chunkSize]
+            try:
+                atomicWithRetry(
+                    "convert-ticket-only-orders",
+                    lambda: convertChunk(request, conversions, chunk, results),
+                )
+            except Exception as e:
+                # The chunk could not be run (lock timeout, retries exhausted) and was rolled back as a whole, so any
+                # result it stored is void. Earlier chunks are already committed: report them and go on
+                statusCode, errorData = exceptionToErrorData(e)
+                for idx in chunk:
+                    results[idx] = {"orderCode": conversions[idx]["orderCode"], "status": statusCode, "error": errorData}
+                logger.error(
+                    f"ApiConvertTicketOnlyOrders: Chunk of {len(chunk)} conversions failed with status {statusCode}: {errorData}"
+                )
+
+        return JsonResponse({"results": results}, status=status.HTTP_200_OK)
+
+
+def validateConvertData(data) -> Optional[str]:
+    if "orderCode" not in data or not isinstance(data["orderCode"], str):
+        return 'Missing or invalid parameter "orderCode"'
+    if "rootPositionId" not in data or not isinstance(data["rootPositionId"], int):
+        return 'Missing or invalid parameter "rootPositionId"'
+    if "newRootItemId" not in data or not isinstance(data["newRootItemId"], int):
+        return 'Missing or invalid parameter "newRootItemId"'
+    if "newRootItemVariationId" in data and data["newRootItemVariationId"] and not isinstance(data["newRootItemVariationId"], int):
+        return 'Invalid parameter "newRootItemVariationId"'
+    return None
+
+
+# Converts a chunk of valid specs, storing the outcome of each one in results. A single lock_objects() takes the quotas
+# of the new items and variations and the seats of the root positions, then the orders, root positions, items and
+# variations of the chunk are row locked with one query per table. Each conversion runs in its own savepoint, but a
+# deadlock or serialization failure aborts the caller's transaction, so it is re-raised and the chunk is retried whole
+def convertChunk(request, conversions: list, chunk: List[int], results: list):
+    specs = [conversions[idx] for idx in chunk]
+    positionIds = [spec["rootPositionId"] for spec in specs]
+    readPositions = lockConvertedQuotasAndSeats(
+        request.event, positionIds,
+        [spec["newRootItemId"] for spec in specs], [spec.get("newRootItemVariationId", None) for spec in specs],
+    )
+    locks = FzLockManager(request.event).addOrders(
+        spec["orderCode"] for spec in specs
+    ).addPositions(positionIds).addItems(
+        spec["newRootItemId"] for spec in specs
+    ).addVariations(
+        spec.get("newRootItemVariationId", None) for spec in specs
+    ).lock()
+
+    for idx, spec in zip(chunk, specs):
+        orderCode = spec["orderCode"]
+        try:
+            verifyConvertedPosition(readPositions, locks.positions.get(spec["rootPositionId"], None))
+            # Savepoint: a failing conversion is rolled back without aborting the rest of the chunk
+            with transaction.atomic():
+                newPositionId = convertTicketOnlyOrder(
+                    request, orderCode, spec["rootPositionId"], spec["newRootItemId"], spec.get("newRootItemVariationId", None), locks
+                )
+            results[idx] = {"orderCode": orderCode, "status": status.HTTP_200_OK, "newPositionId": newPositionId}
+            logger.info(f"ApiConvertTicketOnlyOrders [{orderCode}]: Success")
+        except Exception as e:
+            if retryableReason(e) is not None:
+                raise
+            statusCode, errorData = exceptionToErrorData(e)
+            results[idx] = {"orderCode": orderCode, "status": statusCode, "error": errorData}
+            logger.error(f"ApiConvertTicketOnlyOrders [{orderCode}]: Failed with status {statusCode}: {errorData}")
+
+
+# A conversion changes the root position to the new item and variation, and adds a copy of the root with its old item,
+# variation and seat. The old item is only swapped with its copy, so its quotas do not change: what has to be locked
+# are the quotas of the new items and variations and the seats the copies keep. For a chunk we do it once: root
+# positions are read without locking to find the seats, then quotas and seats get an exclusive lock and the event a
+# shared one. Returns the seats that have been read, to be checked once the positions are row locked
+def lockConvertedQuotasAndSeats(event: Event, positionIds: List[int], newItemIds: List[int],
+                                newVariationIds: List[Optional[int]]) -> Dict[int, Optional[int]]:
+    readPositions = dict(
+        OrderPosition.all.filter(pk__in=positionIds, order__event=event).values_list("pk", "seat_id")
+    )
+    itemIds = set(newItemIds)
+    variationIds = {v for v in newVariationIds if v is not None}
+    seatIds = {s for s in readPositions.values() if s is not None}
+
+    if seatIds and event.settings.seating_minimal_distance > 0:
+        # Same as pretix: no fine grained locking with seating distance enforcement
+        lock_objects([event])
+        return readPositions
+
+    quotas = list(
+        Quota.objects.filter(event=event, size__isnull=False)
+        .filter(Q(items__in=itemIds) | Q(variations__in=variationIds))
+        .distinct()
+    )
+    seats = list(Seat.objects.filter(pk__in=seatIds)) if seatIds else []
+    lock_objects(quotas + seats, shared_lock_objects=[event])
+    return readPositions
+
+
+# The seat may have been changed between the unlocked read and the row lock, we may not hold the right seat lock
+def verifyConvertedPosition(readPositions: Dict[int, Optional[int]], position: Optional[OrderPosition]):
+    if position is not None and (position.pk not in readPositions or readPositions[position.pk] != position.seat_id):
+        raise FzException("", extraData={"error": f"Position {position.pk} changed while locking, retry"}, code=status.HTTP_409_CONFLICT)
+
+
+# We assume we already are in a transaction.atomic(). Returns the id of the newly added position
+# If locks is given, the caller already locked the quotas and seats (see convertChunk()) and the rows with it
+def convertTicketOnlyOrder(request, orderCode: str, currentRootPositionId: int, newRootItemId: int, newRootItemVariationId: Optional[int],
+                           locks: Optional[FzLockManager] = None) -> int:
+    # OBTAINS OBJECTS FROM DB
+    readPositions = None
+    if locks is None:
+        # Quotas and seats first, then the rows: same order as convertChunk() and the other endpoints
+        readPositions = lockConvertedQuotasAndSeats(request.event, [currentRootPositionId], [newRootItemId], [newRootItemVariationId])
+        locks = FzLockManager(request.event).addOrders([orderCode]).addPositions([currentRootPositionId]) \
+            .addItems([newRootItemId]).addVariations([newRootItemVariationId]).lock()
+    # Original Order
+    order: Order = locks.order(orderCode)
+    # root position, item and variation
+    rootPosition: OrderPosition = locks.position(currentRootPositionId, order)
+    if readPositions is not None:
+        verifyConvertedPosition(readPositions, rootPosition)
+    if rootPosition.canceled:
+        raise Http404("No OrderPosition matches the given query.")
+    rootItem: Item = rootPosition.item
+    rootItemVariation: ItemVariation = rootPosition.variation
+    logger.debug(
+        f"ApiConvertTicketOnlyOrder [{orderCode}]: "
+        f"Fetched current rootItem={rootItem.pk} rootItemVariation={rootItemVariation.pk if rootItemVariation else None}"
+    )
+    # new item and variation
+    newRootItem: Item = locks.item(newRootItemId)
+    newRootItemVariation: ItemVariation = locks.variation(newRootItemVariationId, newRootItem) \
+        if newRootItemVariationId is not None else None
+
+    # POSITION SWAP + CREATION
+    ocm = FzOrderChangeManager(
+        order=order,
+        user=request.user if request.user.is_authenticated else None,
+        auth=request.auth,
+        notify=False,
+        reissue_invoice=False,
+    )
+    ocm.fz_enable_locking = False
+    newPositionHandler = ocm.add_position_no_addon_validation(
+        item=rootItem,
+        variation=rootItemVariation,
+        price=rootPosition.price,
+        addon_to=rootPosition,
+        subevent=rootPosition.subevent,
+        seat=rootPosition.seat,
+        # membership=rootPosition.membership,
+        valid_from=rootPosition.valid_from,
+        valid_until=rootPosition.valid_until,
+        is_bundled=True  # IMPORTANT!
+    )
+    ocm.change_item(
+        position=rootPosition,
+        item=newRootItem,
+        variation=newRootItemVariation
+    )
+    ocm.change_price(
+        position=rootPosition,
+        price=0  # newRootItem.default_price if newRootItemVariation is None else newRootItemVariation.default_price
+    )
+    ocm.commit(check_quotas=False)
+
+    newPosition = newPositionHandler.position
+    logger.debug(
+        f"ApiConvertTicketOnlyOrder [{orderCode}]: Newly added position {newPosition.pk}"
+    )
+
+    # We move the extra data to the newly created position: attendee fields are copied, answers are moved
+    finalData = clonePositionInfo(rootPosition, newPosition, moveAnswers=True)
+    # We log the extra data changes. The position operations are logged inside OCM already
+    order.log_action(
+        'pretix.event.order.modified',
+        user=request.user,
+        auth=request.auth,
+        data={
+            'data': [
+                dict(
+                    position=newPosition.pk,
+                    **finalData
+                )
+            ]
+        }
+    )
+
+    # The ticket cache has already been invalidated by the OCM commit
+    sendOrderModifiedOnCommit(request.event, order)
+
+    return newPosition.pk
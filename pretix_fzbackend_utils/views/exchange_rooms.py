@@ -1,10 +1,11 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
 
 import logging
+from decimal import Decimal
 from django.db import transaction
-from django.db.models import Sum
+from django.db.models import F, Max, Q, Value
+from django.db.models.functions import Length
 from django.http import HttpResponse, JsonResponse
-from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.utils.timezone import now
 from django.views import View
@@ -15,45 +16,56 @@ from pretix.api.serializers.order import (
     OrderRefundCreateSerializer,
 )
 from pretix.base.models import (
+    Event,
     Item,
     ItemVariation,
+    LogEntry,
     Order,
     OrderPayment,
     OrderPosition,
     OrderRefund,
+    Quota,
+    Seat,
 )
 from pretix.base.services.locking import lock_objects
-from pretix.helpers import OF_SELF
 from rest_framework import serializers, status
 from rest_framework.views import APIView
 
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import (
+    enqueueAsyncOperation,
+    isAsyncRequest,
+)
 from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzIdempotency import idempotent
+from pretix_fzbackend_utils.fz_utilites.fzLockManager import FzLockManager
 from pretix_fzbackend_utils.fz_utilites.fzOrderChangeManager import FzOrderChangeManager
+from pretix_fzbackend_utils.fz_utilites.fzPriceTable import (
+    buildItemPriceTable,
+    itemPriceTable,
+)
+from pretix_fzbackend_utils.fz_utilites.fzRetry import atomicWithRetry, retryableReason
 from pretix_fzbackend_utils.payment import (
     FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
     FZ_MANUAL_PAYMENT_PROVIDER_ISSUER,
 )
 from pretix_fzbackend_utils.utils import (
+    EXCHANGE_BATCH_DEFAULT_CHUNK_SIZE,
     STATUS_CODE_PAYMENT_INVALID,
     STATUS_CODE_POSITION_CANCELED,
     STATUS_CODE_REFUND_INVALID,
+    exceptionToErrorData,
+    lockOrderKey,
     verifyToken,
 )
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-
-class Balance:
-    balanceA: int
-    balanceB: int
-
-    def __init__(self, startingA, startingB):
-        self.balanceA = startingA
-        self.balanceB = startingB
-
-    def __add__(self, o):
-        return Balance(self.balanceA + o.balanceA, self.balanceB + o.balanceB)
+# change: every slot is rewritten through OCM change operations (item, price, seat, ...), positions stay in their order
+# move: the position rows themselves are reassigned to the other order, keeping answers, attendee data and secrets
+EXCHANGE_MODE_CHANGE = "change"
+EXCHANGE_MODE_MOVE = "move"
+EXCHANGE_MODES = [EXCHANGE_MODE_CHANGE, EXCHANGE_MODE_MOVE]
 
 
 class SideData:
@@ -61,16 +73,27 @@ class SideData:
     rootPositionId: int
     positions: List[int]
 
-    def __init__(self, data, side: str):
-        self.orderCode = data[f"{side}OrderCode"]
-        self.rootPositionId = data[f"{side}RootPositionId"]
-        self.positions = []
+    def __init__(self, orderCode: str, rootPositionId: int, positions: List[int]):
+        self.orderCode = orderCode
+        self.rootPositionId = rootPositionId
+        self.positions = positions
+
+    # Side of a two sided exchange-rooms request: side is either "source" or "dest"
+    @classmethod
+    def fromExchangeData(cls, data, side: str):
+        positions = []
         for exchange in data["exchanges"]:
             posId = None
             if f"{side}PositionId" in exchange and exchange[f"{side}PositionId"] is not None:
                 posId = exchange[f"{side}PositionId"]
             # Append anyway to not mess with indexes
-            self.positions.append(posId)
+            positions.append(posId)
+        return cls(data[f"{side}OrderCode"], data[f"{side}RootPositionId"], positions)
+
+    # Side of an exchange-rooms-cycle request
+    @classmethod
+    def fromCycleData(cls, side):
+        return cls(side["orderCode"], side["rootPositionId"], list(side["positions"]))
 
     def position(self, idx: int) -> int:
         return self.positions[idx]
@@ -87,17 +110,36 @@ class Element:
     price: int
     itemVar: ItemVariation
 
-    def __init__(self, positionId, order):
-        self.pos = get_object_or_404(
-            # Cancelation validation is done later for improved error reporting
-            OrderPosition.all.select_for_update(of=OF_SELF).filter(pk=positionId, order__pk=order.pk)
-        )
+    def __init__(self, pos: OrderPosition, price):
+        self.pos = pos
         self.paid = self.pos.price
         self.item = self.pos.item
         self.itemVar = self.pos.variation
-        self.price = self.itemVar.price if self.itemVar else self.item.default_price
-        # Remove the bundle price
-        self.price -= self.item.bundles.aggregate(Sum('designated_price'))['designated_price__sum'] or 0
+        # Base price of the item/variation without the bundle price
+        self.price = price
+
+
+# Elements of the given positions of an order, already loaded by the lock manager together with their item, variation,
+# subevent and seat. Prices come from the cached price table of the event
+def loadElements(positionIds: List[int], order: Order, locks: FzLockManager) -> Dict[int, Element]:
+    # Cancelation validation is done later for improved error reporting
+    positions = [locks.position(posId, order) for posId in set(positionIds)]
+
+    priceTable = itemPriceTable(order.event_id)
+    if any((p.item_id, p.variation_id) not in priceTable for p in positions):
+        # Should never happen, since the table is invalidated on item changes. Better safe than sorry
+        priceTable = buildItemPriceTable(order.event_id)
+    return {p.pk: Element(p, priceTable[(p.item_id, p.variation_id)]) for p in positions}
+
+
+# Rows needed by an exchange of the given sides: orders, exchanged and root positions. Existing payments and refunds
+# are never touched by an exchange, so they are just checked (see verifyPaymentsRefundsStatus())
+def exchangeLocks(event: Event, sides: List[SideData]) -> FzLockManager:
+    return FzLockManager(event).addOrders(
+        side.orderCode for side in sides
+    ).addPositions(
+        [posId for side in sides for posId in side.positions] + [side.rootPositionId for side in sides]
+    )
 
 
 class SideInstance:
@@ -106,11 +148,9 @@ class SideInstance:
     rootPosition: OrderPosition
     instances: List[Element]
 
-    # We assume we already are in a transaction.atomic()
-    def __init__(self, data: SideData, request):
-        self.order = get_object_or_404(
-            Order.objects.select_for_update(of=OF_SELF).filter(event=request.event, code=data.orderCode, event__organizer=request.organizer)
-        )
+    # We assume we already are in a transaction.atomic() and that locks has been locked (see exchangeLocks())
+    def __init__(self, data: SideData, request, locks: FzLockManager):
+        self.order = locks.order(data.orderCode)
         self.ocm = FzOrderChangeManager(
             order=self.order,
             user=request.user if request.user.is_authenticated else None,
@@ -119,12 +159,12 @@ class SideInstance:
             reissue_invoice=False,
         )
         self.instances = []
+        # The root position is loaded (and locked) even when it is not exchanged, since new addons are attached to it
+        elements = loadElements([posId for posId in data.positions if posId is not None] + [data.rootPositionId], self.order, locks)
+        self.rootPosition = elements[data.rootPositionId].pos
         for posId in data.positions:
             if posId is not None:
-                e = Element(posId, self.order)
-                self.instances.append(e)
-                if posId == data.rootPositionId:
-                    self.rootPosition = e.pos
+                self.instances.append(elements[posId])
             else:
                 # Store also None for easier indexing
                 self.instances.append(None)
@@ -140,26 +180,56 @@ class SideInstance:
                 )
                 raise FzException("", extraData={"error": f'Position {element.pos.pk} is canceled'}, code=STATUS_CODE_POSITION_CANCELED)
 
-    def verifyPaymentsRefundsStatus(self):
-        # Already ordered in the Meta class of OrderPayment/Refund. Order is important for deadlock prevention
-        payments: List[OrderPayment] = OrderPayment.objects.select_for_update(of=OF_SELF).filter(order__pk=self.order.pk, state__in=[
-            OrderPayment.PAYMENT_STATE_CREATED,
-            OrderPayment.PAYMENT_STATE_PENDING
-        ])
-        for payment in payments:
-            logger.error(
-                f"ApiExchangeRooms [{self.order.code}]: Payment {payment.full_id}: invalid state {payment.state}"
-            )
-            raise FzException("", extraData={"error": f'Payment {payment.full_id} is in invalid state {payment.state}'}, code=STATUS_CODE_PAYMENT_INVALID)
-        refunds: List[OrderRefund] = OrderRefund.objects.select_for_update(of=OF_SELF).filter(order__pk=self.order.pk, state__in=[
-            OrderRefund.REFUND_STATE_CREATED,
-            OrderRefund.REFUND_STATE_TRANSIT
-        ])
-        for refund in refunds:
-            logger.error(
-                f"ApiExchangeRooms [{self.order.code}]: Refund {refund.full_id}: invalid state {refund.state}"
-            )
-            raise FzException("", extraData={"error": f'Refund {refund.full_id} is in invalid state {refund.state}'}, code=STATUS_CODE_REFUND_INVALID)
+    # Only direct addons of the root position can be moved: a moved root (or an addon with addons of its own) would
+    # leave positions of the other order attached to it
+    def verifyMovable(self):
+        if self.order.status not in (Order.STATUS_PAID, Order.STATUS_PENDING):
+            # Quotas are not locked in move mode, which is safe only if both orders count towards them
+            raise FzException("", extraData={"error": f'Order {self.order.code} is in invalid status {self.order.status}'})
+        for element in self.instances:
+            if element is not None and element.pos.addon_to_id != self.rootPosition.pk:
+                logger.error(
+                    f"ApiExchangeRooms [{self.order.code}]: Position {element.pos.pk} is not an addon of the root position"
+                )
+                raise FzException("", extraData={"error": f'Position {element.pos.pk} is not an addon of the root position'})
+        movedIds = [element.pos.pk for element in self.instances if element is not None]
+        parentId = OrderPosition.all.filter(addon_to_id__in=movedIds).values_list("addon_to_id", flat=True).first()
+        if parentId is not None:
+            logger.error(f"ApiExchangeRooms [{self.order.code}]: Position {parentId} has addons of its own")
+            raise FzException("", extraData={"error": f'Position {parentId} has addons of its own'})
+
+
+# Fails if any of the orders has a payment or a refund in a pending state. Payments and refunds of both tables and all the
+# orders are checked with a single query, which stops at the first match. Rows are not locked, since we never touch them
+def verifyPaymentsRefundsStatus(orders: List[Order]):
+    orderIds = [order.pk for order in orders]
+    payments = OrderPayment.objects.filter(order_id__in=orderIds, state__in=[
+        OrderPayment.PAYMENT_STATE_CREATED,
+        OrderPayment.PAYMENT_STATE_PENDING
+    ]).annotate(
+        orderCode=F("order__code"), codeLength=Length("order__code"), kind=Value(0)
+    ).order_by().values_list("codeLength", "orderCode", "kind", "local_id", "state")
+    refunds = OrderRefund.objects.filter(order_id__in=orderIds, state__in=[
+        OrderRefund.REFUND_STATE_CREATED,
+        OrderRefund.REFUND_STATE_TRANSIT
+    ]).annotate(
+        orderCode=F("order__code"), codeLength=Length("order__code"), kind=Value(1)
+    ).order_by().values_list("codeLength", "orderCode", "kind", "local_id", "state")
+    # Same order the orders are locked in (see lockOrderKey()), payments before refunds
+    row = payments.union(refunds, all=True).order_by("-codeLength", "orderCode", "kind", "local_id").first()
+    if row is None:
+        return
+
+    _, orderCode, kind, localId, state = row
+    if kind == 0:
+        logger.error(
+            f"ApiExchangeRooms [{orderCode}]: Payment {orderCode}-P-{localId}: invalid state {state}"
+        )
+        raise FzException("", extraData={"error": f'Payment {orderCode}-P-{localId} is in invalid state {state}'}, code=STATUS_CODE_PAYMENT_INVALID)
+    logger.error(
+        f"ApiExchangeRooms [{orderCode}]: Refund {orderCode}-R-{localId}: invalid state {state}"
+    )
+    raise FzException("", extraData={"error": f'Refund {orderCode}-R-{localId} is in invalid state {state}'}, code=STATUS_CODE_REFUND_INVALID)
 
 
 @method_decorator(xframe_options_exempt, "dispatch")
@@ -167,111 +237,520 @@ class SideInstance:
 class ApiExchangeRooms(APIView, View):
     permission = "can_change_orders"
 
+    @idempotent("exchange-rooms")
     def post(self, request, organizer, event, *args, **kwargs):
         verifyToken(request)
+        if isAsyncRequest(request):
+            return enqueueAsyncOperation(request, "exchange-rooms")
         data = request.data
 
-        # Source info
-        if "sourceOrderCode" not in data or not isinstance(data["sourceOrderCode"], str):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "sourceOrderCode"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "sourceRootPositionId" not in data or not isinstance(data["sourceRootPositionId"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "sourceRootPositionId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        # Dest info
-        if "destOrderCode" not in data or not isinstance(data["destOrderCode"], str):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "destOrderCode"'}, status=status.HTTP_400_BAD_REQUEST
+        error = validateExchangeData(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        src = SideData.fromExchangeData(data, "source")
+        dst = SideData.fromExchangeData(data, "dest")
+        paymentComment = data.get("manualPaymentComment", None)
+        refundComment = data.get("manualRefundComment", None)
+        fineGrainedLocking = data.get("fineGrainedLocking", False)
+        mode = data.get("mode", EXCHANGE_MODE_CHANGE)
+
+        logger.info(
+            f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Got from req  src={src}  dst={dst}  "
+            f"fineGrainedLocking={fineGrainedLocking}  mode={mode}"
+        )
+
+        try:
+            # A two sided exchange is a cycle of length 2: source gets the dest positions and vice versa
+            atomicWithRetry(
+                "exchange-rooms",
+                lambda: exchangeCycle(request, [src, dst], [1, 0], paymentComment, refundComment, fineGrainedLocking, mode),
             )
-        if "destRootPositionId" not in data or not isinstance(data["destRootPositionId"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "destRootPositionId"'}, status=status.HTTP_400_BAD_REQUEST
+        except FzException as fe:
+            status_code = fe.code if fe.code is not None else status.HTTP_400_BAD_REQUEST
+            return JsonResponse(fe.extraData, status=status_code)
+
+        logger.info(
+            f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Success"
+        )
+
+        return HttpResponse("")
+
+
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiExchangeRoomsCycle(APIView, View):
+    permission = "can_change_orders"
+
+    @idempotent("exchange-rooms-cycle")
+    def post(self, request, organizer, event, *args, **kwargs):
+        verifyToken(request)
+        if isAsyncRequest(request):
+            return enqueueAsyncOperation(request, "exchange-rooms-cycle")
+        data = request.data
+
+        error = validateCycleData(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        sides = [SideData.fromCycleData(side) for side in data["sides"]]
+        permutation = data["permutation"]
+        paymentComment = data.get("manualPaymentComment", None)
+        refundComment = data.get("manualRefundComment", None)
+        fineGrainedLocking = data.get("fineGrainedLocking", False)
+        mode = data.get("mode", EXCHANGE_MODE_CHANGE)
+        logTag = "-".join(side.orderCode for side in sides)
+
+        logger.info(
+            f"ApiExchangeRoomsCycle [{logTag}]: Got from req  sides={', '.join(str(side) for side in sides)}  "
+            f"permutation={permutation}  fineGrainedLocking={fineGrainedLocking}  mode={mode}"
+        )
+
+        try:
+            atomicWithRetry(
+                "exchange-rooms-cycle",
+                lambda: exchangeCycle(request, sides, permutation, paymentComment, refundComment, fineGrainedLocking, mode),
             )
-        # Exchange data
+        except FzException as fe:
+            status_code = fe.code if fe.code is not None else status.HTTP_400_BAD_REQUEST
+            return JsonResponse(fe.extraData, status=status_code)
+
+        logger.info(
+            f"ApiExchangeRoomsCycle [{logTag}]: Success"
+        )
+
+        return HttpResponse("")
+
+
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiExchangeRoomsBatch(APIView, View):
+    permission = "can_change_orders"
+
+    @idempotent("exchange-rooms-batch")
+    def post(self, request, organizer, event, *args, **kwargs):
+        verifyToken(request)
+        if isAsyncRequest(request):
+            return enqueueAsyncOperation(request, "exchange-rooms-batch")
+        data = request.data
+
         if "exchanges" not in data or not isinstance(data["exchanges"], list):
             return JsonResponse(
                 {"error": 'Missing or invalid parameter "exchanges"'}, status=status.HTTP_400_BAD_REQUEST
             )
-        for exchangeReq in data["exchanges"]:
-            if "sourcePositionId" in exchangeReq and exchangeReq["sourcePositionId"] is not None and not isinstance(exchangeReq["sourcePositionId"], int):
-                return JsonResponse(
-                    {"error": 'Invalid parameter "sourcePositionId"'}, status=status.HTTP_400_BAD_REQUEST
-                )
-            if "destPositionId" in exchangeReq and exchangeReq["destPositionId"] is not None and not isinstance(exchangeReq["destPositionId"], int):
-                return JsonResponse(
-                    {"error": 'Invalid parameter "destPositionId"'}, status=status.HTTP_400_BAD_REQUEST
-                )
-        # Extra
-        if "manualPaymentComment" in data and data["manualPaymentComment"] and not isinstance(data["manualPaymentComment"], str):
+        if "chunkSize" in data and data["chunkSize"] is not None and (not isinstance(data["chunkSize"], int) or data["chunkSize"] < 1):
             return JsonResponse(
-                {"error": 'Invalid parameter "manualPaymentComment"'}, status=status.HTTP_400_BAD_REQUEST
+                {"error": 'Invalid parameter "chunkSize"'}, status=status.HTTP_400_BAD_REQUEST
             )
-        if "manualRefundComment" in data and data["manualRefundComment"] and not isinstance(data["manualRefundComment"], str):
+        if "fineGrainedLocking" in data and not isinstance(data["fineGrainedLocking"], bool):
             return JsonResponse(
-                {"error": 'Invalid parameter "manualRefundComment"'}, status=status.HTTP_400_BAD_REQUEST
+                {"error": 'Invalid parameter "fineGrainedLocking"'}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        src = SideData(data, "source")
-        dst = SideData(data, "dest")
-        paymentComment = data.get("manualPaymentComment", None)
-        refundComment = data.get("manualRefundComment", None)
+        exchanges = data["exchanges"]
+        chunkSize = data.get("chunkSize", None) or EXCHANGE_BATCH_DEFAULT_CHUNK_SIZE
+        fineGrainedLocking = data.get("fineGrainedLocking", False)
+        results = [None] * len(exchanges)
+
+        # Invalid specs are reported immediately and never reach the db
+        validIdxs = []
+        for idx, spec in enumerate(exchanges):
+            error = validateExchangeData(spec) if isinstance(spec, dict) else "Invalid exchange spec"
+            if error is not None:
+                results[idx] = {
+                    "sourceOrderCode": spec.get("sourceOrderCode", None) if isinstance(spec, dict) else None,
+                    "destOrderCode": spec.get("destOrderCode", None) if isinstance(spec, dict) else None,
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "error": {"error": error},
+                }
+            else:
+                validIdxs.append(idx)
+        # Pairs are processed in the request order, since a pair may depend on the outcome of a previous one. Deadlocks
+        # are prevented by locking all the orders of a chunk upfront, in the global lock order. A spec may override the
+        # batch fineGrainedLocking: since a chunk takes its locks once, consecutive pairs with the same locking share
+        # a chunk and a new one is started whenever it changes
+        chunks = []
+        for idx in validIdxs:
+            locking = exchanges[idx].get("fineGrainedLocking", fineGrainedLocking)
+            if not chunks or len(chunks[-1][1]) >= chunkSize or chunks[-1][0] != locking:
+                chunks.append((locking, []))
+            chunks[-1][1].append(idx)
 
         logger.info(
-            f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Got from req  src={src}  dst={dst}"
+            f"ApiExchangeRoomsBatch: Got {len(exchanges)} exchanges from req, {len(validIdxs)} valid in {len(chunks)} chunks, "
+            f"chunkSize={chunkSize} fineGrainedLocking={fineGrainedLocking}"
         )
 
-        # Create an order over the orders to acquire the locks. In this way we prevent deadlocks
-        # Ugly ass btw
-        srcBigger = strCmp(src.orderCode, dst.orderCode) == src.orderCode
-        ordAdata = src if srcBigger else dst
-        ordBdata = dst if srcBigger else src
+        for chunkLocking, chunk in chunks:
+            try:
+                atomicWithRetry(
+                    "exchange-rooms-batch",
+                    lambda: exchangeChunk(request, exchanges, chunk, chunkLocking, results),
+                )
+            except Exception as e:
+                # The chunk could not be run (lock timeout, retries exhausted) and was rolled back as a whole, so any
+                # result it stored is void. Like a failing pair inside a chunk, it does not stop the following ones
+                statusCode, errorData = exceptionToErrorData(e)
+                for idx in chunk:
+                    results[idx] = {
+                        "sourceOrderCode": exchanges[idx]["sourceOrderCode"],
+                        "destOrderCode": exchanges[idx]["destOrderCode"],
+                        "status": statusCode,
+                        "error": errorData,
+                    }
+                logger.error(f"ApiExchangeRoomsBatch: Chunk of {len(chunk)} exchanges failed with status {statusCode}: {errorData}")
+
+        return JsonResponse({"results": results}, status=status.HTTP_200_OK)
+
+
+# Preview of ApiExchangeRooms: same validation and balance computation, but rows are read without taking any lock and
+# nothing is written. The real exchange may still fail (or end with different balances) if the orders change meanwhile
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiExchangeRoomsQuote(APIView, View):
+    permission = "can_view_orders"
+
+    def post(self, request, organizer, event, *args, **kwargs):
+        verifyToken(request)
+        data = request.data
 
-        balance = Balance(0, 0)
+        error = validateExchangeData(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            with transaction.atomic():
-                # Aggressive locking, but I prefere instead of thinking of all possible quota to lock
-                lock_objects([request.event])
-                ordA = SideInstance(ordAdata, request)
-                ordA.verifyCancelation()
-                ordA.verifyPaymentsRefundsStatus()
-                ordB = SideInstance(ordBdata, request)
-                ordB.verifyCancelation()
-                ordB.verifyPaymentsRefundsStatus()
-                logger.debug(f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Loaded instances and verified payments/refunds")
-
-                rootPosA: OrderPosition = ordA.rootPosition
-                rootPosB: OrderPosition = ordB.rootPosition
-
-                for idx in range(len(data["exchanges"])):
-                    posA: Element = ordA.instance(idx)
-                    posB: Element = ordB.instance(idx)
-                    logger.debug(f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Exchanging pair idx={idx} "
-                                 f"posA={posA.pos.pk if posA is not None else 'None'} "
-                                 f"posB={posB.pos.pk if posB is not None else 'None'}")
-                    balance += exchange(posA, posB, rootPosA, rootPosB, ordA.ocm, ordB.ocm)
-                logger.debug(f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Exchanges done")
-
-                fixPaymentStatus(balance.balanceA, ordA.order, refundComment, paymentComment, request, {"order": ordA.order, "event": request.event})
-                fixPaymentStatus(balance.balanceB, ordB.order, refundComment, paymentComment, request, {"order": ordB.order, "event": request.event})
-                logger.debug(f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Payment status fixed")
-
-                ordA.ocm.fz_enable_locking = False
-                ordB.ocm.fz_enable_locking = False
-                ordA.ocm.commit(check_quotas=False)
-                ordB.ocm.commit(check_quotas=False)
+        src = SideData.fromExchangeData(data, "source")
+        dst = SideData.fromExchangeData(data, "dest")
+        logger.debug(f"ApiExchangeRoomsQuote [{src.orderCode}-{dst.orderCode}]: Got from req  src={src}  dst={dst}")
 
+        try:
+            quote = quoteCycle(request, [src, dst], [1, 0], data.get("mode", EXCHANGE_MODE_CHANGE))
         except FzException as fe:
             status_code = fe.code if fe.code is not None else status.HTTP_400_BAD_REQUEST
             return JsonResponse(fe.extraData, status=status_code)
 
-        logger.info(
-            f"ApiExchangeRooms [{src.orderCode}-{dst.orderCode}]: Success"
+        return JsonResponse({"sides": quote}, status=status.HTTP_200_OK)
+
+
+# Exchanges a chunk of valid pairs, storing the outcome of each one in results. We assume we already are in a
+# transaction.atomic(). Deadlocks and serialization failures are propagated, so that the whole chunk is retried
+def exchangeChunk(request, exchanges: list, chunk: List[int], fineGrainedLocking: bool, results: list):
+    sides = {idx: (SideData.fromExchangeData(exchanges[idx], "source"), SideData.fromExchangeData(exchanges[idx], "dest")) for idx in chunk}
+    # One lock acquisition for the whole chunk. Quotas are locked for every pair, a superset of what a move needs
+    lockedPositions = lockExchange(
+        request.event, [side.orderCode for pair in sides.values() for side in pair],
+        [posId for src, dst in sides.values() for posId in src.positions + dst.positions], fineGrainedLocking
+    )
+    FzLockManager(request.event).addOrders(side.orderCode for pair in sides.values() for side in pair).lock()
+    for idx in chunk:
+        src, dst = sides[idx]
+        spec = exchanges[idx]
+        try:
+            # Savepoint: a failing exchange is rolled back without aborting the rest of the chunk
+            with transaction.atomic():
+                exchangeCycle(
+                    request, [src, dst], [1, 0],
+                    spec.get("manualPaymentComment", None), spec.get("manualRefundComment", None),
+                    mode=spec.get("mode", EXCHANGE_MODE_CHANGE), acquireLocks=False, lockedPositions=lockedPositions,
+                )
+            if lockedPositions is not None:
+                # The exchange changed the positions of these orders, a later pair of the chunk may touch them again
+                lockedPositions.update(readLockedPositions(request.event, [src.orderCode, dst.orderCode]))
+            results[idx] = {"sourceOrderCode": src.orderCode, "destOrderCode": dst.orderCode, "status": status.HTTP_200_OK}
+            logger.info(f"ApiExchangeRoomsBatch [{src.orderCode}-{dst.orderCode}]: Success")
+        except Exception as e:
+            if retryableReason(e) is not None:
+                raise
+            statusCode, errorData = exceptionToErrorData(e)
+            results[idx] = {"sourceOrderCode": src.orderCode, "destOrderCode": dst.orderCode, "status": statusCode, "error": errorData}
+            logger.error(f"ApiExchangeRoomsBatch [{src.orderCode}-{dst.orderCode}]: Failed with status {statusCode}: {errorData}")
+
+
+def validateExchangeData(data) -> Optional[str]:
+    # Source info
+    if "sourceOrderCode" not in data or not isinstance(data["sourceOrderCode"], str):
+        return 'Missing or invalid parameter "sourceOrderCode"'
+    if "sourceRootPositionId" not in data or not isinstance(data["sourceRootPositionId"], int):
+        return 'Missing or invalid parameter "sourceRootPositionId"'
+    # Dest info
+    if "destOrderCode" not in data or not isinstance(data["destOrderCode"], str):
+        return 'Missing or invalid parameter "destOrderCode"'
+    if "destRootPositionId" not in data or not isinstance(data["destRootPositionId"], int):
+        return 'Missing or invalid parameter "destRootPositionId"'
+    # Exchange data
+    if "exchanges" not in data or not isinstance(data["exchanges"], list):
+        return 'Missing or invalid parameter "exchanges"'
+    for exchangeReq in data["exchanges"]:
+        if not isinstance(exchangeReq, dict):
+            return 'Invalid exchange'
+        if "sourcePositionId" in exchangeReq and exchangeReq["sourcePositionId"] is not None and not isinstance(exchangeReq["sourcePositionId"], int):
+            return 'Invalid parameter "sourcePositionId"'
+        if "destPositionId" in exchangeReq and exchangeReq["destPositionId"] is not None and not isinstance(exchangeReq["destPositionId"], int):
+            return 'Invalid parameter "destPositionId"'
+    # Extra
+    if "manualPaymentComment" in data and data["manualPaymentComment"] and not isinstance(data["manualPaymentComment"], str):
+        return 'Invalid parameter "manualPaymentComment"'
+    if "manualRefundComment" in data and data["manualRefundComment"] and not isinstance(data["manualRefundComment"], str):
+        return 'Invalid parameter "manualRefundComment"'
+    if "fineGrainedLocking" in data and not isinstance(data["fineGrainedLocking"], bool):
+        return 'Invalid parameter "fineGrainedLocking"'
+    if "mode" in data and data["mode"] not in EXCHANGE_MODES:
+        return 'Invalid parameter "mode"'
+    return None
+
+
+def validateCycleData(data) -> Optional[str]:
+    if "sides" not in data or not isinstance(data["sides"], list) or len(data["sides"]) < 2:
+        return 'Missing or invalid parameter "sides"'
+    slots = None
+    for side in data["sides"]:
+        if not isinstance(side, dict):
+            return 'Invalid side'
+        if "orderCode" not in side or not isinstance(side["orderCode"], str):
+            return 'Missing or invalid parameter "orderCode"'
+        if "rootPositionId" not in side or not isinstance(side["rootPositionId"], int):
+            return 'Missing or invalid parameter "rootPositionId"'
+        if "positions" not in side or not isinstance(side["positions"], list):
+            return 'Missing or invalid parameter "positions"'
+        for posId in side["positions"]:
+            if posId is not None and not isinstance(posId, int):
+                return 'Invalid position id in "positions"'
+        if slots is not None and len(side["positions"]) != slots:
+            return 'All the sides must have the same number of "positions"'
+        slots = len(side["positions"])
+    if len({side["orderCode"] for side in data["sides"]}) != len(data["sides"]):
+        return 'Duplicated order in "sides"'
+    permutation = data.get("permutation", None)
+    if not isinstance(permutation, list) or any(not isinstance(i, int) for i in permutation) \
+            or sorted(permutation) != list(range(len(data["sides"]))):
+        return 'Missing or invalid parameter "permutation"'
+    if any(i == permutation[i] for i in range(len(permutation))):
+        return 'A side cannot receive its own positions'
+    if "manualPaymentComment" in data and data["manualPaymentComment"] and not isinstance(data["manualPaymentComment"], str):
+        return 'Invalid parameter "manualPaymentComment"'
+    if "manualRefundComment" in data and data["manualRefundComment"] and not isinstance(data["manualRefundComment"], str):
+        return 'Invalid parameter "manualRefundComment"'
+    if "fineGrainedLocking" in data and not isinstance(data["fineGrainedLocking"], bool):
+        return 'Invalid parameter "fineGrainedLocking"'
+    if "mode" in data and data["mode"] not in EXCHANGE_MODES:
+        return 'Invalid parameter "mode"'
+    return None
+
+
+# Takes the locks needed by an exchange of the given positions between the given orders: the whole event, or only the
+# involved quotas and seats with fineGrainedLocking. Moved positions keep item, variation, subevent and seat, so a move
+# affects no quota and only needs the seats locked by fixPaymentStatus(). Returns what has to be checked by
+# verifyLockedPositions() and verifyLockedSeats(), or None if the whole event is locked
+def lockExchange(event: Event, orderCodes: List[str], positionIds: List[int], fineGrainedLocking: bool,
+                 mode: str = EXCHANGE_MODE_CHANGE) -> Optional[Dict[int, tuple]]:
+    if mode == EXCHANGE_MODE_MOVE:
+        return lockExchangedQuotasAndSeats(event, orderCodes, [])
+    if fineGrainedLocking:
+        return lockExchangedQuotasAndSeats(event, orderCodes, positionIds)
+    # Aggressive locking, but I prefere instead of thinking of all possible quota to lock
+    lock_objects([event])
+    return None
+
+
+# Side i receives the positions of side permutation[i], slot by slot. Every side settles its own balance through
+# fixPaymentStatus(). We assume we already are in a transaction.atomic()
+# If acquireLocks is False, the caller already called lockExchange() (passing its result as lockedPositions)
+def exchangeCycle(request, sides: List[SideData], permutation: List[int],
+                  paymentComment: str, refundComment: str, fineGrainedLocking: bool = False, mode: str = EXCHANGE_MODE_CHANGE,
+                  acquireLocks: bool = True, lockedPositions: Optional[Dict[int, tuple]] = None):
+    logTag = "-".join(side.orderCode for side in sides)
+
+    if acquireLocks:
+        lockedPositions = lockExchange(
+            request.event, [side.orderCode for side in sides], [posId for side in sides for posId in side.positions],
+            fineGrainedLocking, mode
         )
-
-        return HttpResponse("")
+    # All the rows are locked together, in the global lock order. In this way we prevent deadlocks
+    locks = exchangeLocks(request.event, sides).lock()
+    lockOrder = sorted(range(len(sides)), key=lambda i: lockOrderKey(sides[i].orderCode))
+    instances: List[SideInstance] = [None] * len(sides)
+    for i in lockOrder:
+        instances[i] = SideInstance(sides[i], request, locks)
+        instances[i].verifyCancelation()
+        if mode == EXCHANGE_MODE_MOVE:
+            instances[i].verifyMovable()
+    verifyPaymentsRefundsStatus([instance.order for instance in instances])
+    if lockedPositions is not None:
+        verifyLockedPositions(lockedPositions, [e for instance in instances for e in instance.instances])
+        verifyLockedSeats(lockedPositions, [instance.order for instance in instances])
+    logger.debug(f"ApiExchangeRooms [{logTag}]: Loaded instances and verified payments/refunds")
+
+    if mode == EXCHANGE_MODE_MOVE:
+        balances = movePositions(request, instances, permutation)
+    else:
+        balances = [0] * len(sides)
+        for i, dest in enumerate(instances):
+            src = instances[permutation[i]]
+            for idx in range(len(sides[i].positions)):
+                srcElement: Element = src.instance(idx)
+                destElement: Element = dest.instance(idx)
+                logger.debug(f"ApiExchangeRooms [{logTag}]: Moving idx={idx} from {src.order.code} to {dest.order.code} "
+                             f"src={srcElement.pos.pk if srcElement is not None else 'None'} "
+                             f"dest={destElement.pos.pk if destElement is not None else 'None'}")
+                # Cannot be an addon of itself
+                addonTo = None if destElement is not None and destElement.pos.pk == dest.rootPosition.pk else dest.rootPosition
+                balances[i] += transfer(srcElement, destElement, addonTo, dest.ocm)
+    logger.debug(f"ApiExchangeRooms [{logTag}]: Exchanges done")
+
+    for i in lockOrder:
+        fixPaymentStatus(balances[i], instances[i].order, refundComment, paymentComment, request, {"order": instances[i].order, "event": request.event})
+    logger.debug(f"ApiExchangeRooms [{logTag}]: Payment status fixed")
+
+    for i in lockOrder:
+        if mode == EXCHANGE_MODE_MOVE:
+            # Let OCM update totals, payment fee and status of the order, like ApiTransferOrder does
+            instances[i].ocm.recomputeOperation()
+        instances[i].ocm.fz_enable_locking = False
+        instances[i].ocm.commit(check_quotas=False)
+
+
+# Move mode of exchangeCycle(): positions are reassigned to the order of the receiving side with one UPDATE, as addons of
+# its root position and with new position ids after the existing ones. Answers, check-ins and attendee data follow the
+# rows. Every position keeps the price it was paid with, so balances are the difference between what comes in and what
+# goes out. Returns the balance of each side
+def movePositions(request, instances: List["SideInstance"], permutation: List[int]) -> List[Decimal]:
+    nextPositionIds = {
+        row["order_id"]: row["maxPositionId"] + 1
+        for row in OrderPosition.all.filter(order_id__in=[instance.order.pk for instance in instances])
+        .values("order_id").annotate(maxPositionId=Max("positionid")).order_by()
+    }
+    balances = []
+    moved = []
+    logEntries = []
+    for i, dest in enumerate(instances):
+        src = instances[permutation[i]]
+        balance = Decimal("0.00")
+        movedIn = []
+        for idx in range(len(dest.instances)):
+            srcElement: Element = src.instance(idx)
+            _, diff = planMove(srcElement, dest.instance(idx))
+            balance += diff
+            if srcElement is None:
+                continue
+            pos = srcElement.pos
+            movedIn.append({"position": pos.pk, "fromOrder": src.order.code, "oldPositionid": pos.positionid})
+            pos.order = dest.order
+            pos.addon_to = dest.rootPosition
+            pos.positionid = nextPositionIds[dest.order.pk]
+            nextPositionIds[dest.order.pk] += 1
+            moved.append(pos)
+        balances.append(balance)
+        if movedIn:
+            logEntries.append(dest.order.log_action(
+                "pretix.plugins.fzbackendutils.positions.moved",
+                data={"positions": movedIn},
+                user=request.user if request.user.is_authenticated else None,
+                auth=request.auth,
+                save=False
+            ))
+    OrderPosition.all.bulk_update(moved, ["order", "addon_to", "positionid"])
+    LogEntry.bulk_create_and_postprocess(logEntries)
+    return balances
+
+
+# Balances and operations exchangeCycle() would apply, computed on unlocked reads
+def quoteCycle(request, sides: List[SideData], permutation: List[int], mode: str = EXCHANGE_MODE_CHANGE) -> List[dict]:
+    locks = exchangeLocks(request.event, sides).read()
+    lockOrder = sorted(range(len(sides)), key=lambda i: lockOrderKey(sides[i].orderCode))
+    instances: List[SideInstance] = [None] * len(sides)
+    for i in lockOrder:
+        instances[i] = SideInstance(sides[i], request, locks)
+        instances[i].verifyCancelation()
+        if mode == EXCHANGE_MODE_MOVE:
+            instances[i].verifyMovable()
+    verifyPaymentsRefundsStatus([instance.order for instance in instances])
+
+    quote = []
+    for i, dest in enumerate(instances):
+        src = instances[permutation[i]]
+        balance = Decimal("0.00")
+        operations = []
+        for idx in range(len(sides[i].positions)):
+            srcElement: Element = src.instance(idx)
+            destElement: Element = dest.instance(idx)
+            operation, diff = planMove(srcElement, destElement) if mode == EXCHANGE_MODE_MOVE else planTransfer(srcElement, destElement)
+            balance += diff
+            operations.append({
+                "slot": idx,
+                "operation": operation,
+                "sourcePositionId": srcElement.pos.pk if srcElement is not None else None,
+                "destPositionId": destElement.pos.pk if destElement is not None else None,
+                "itemId": srcElement.item.pk if srcElement is not None else None,
+                "itemVariationId": srcElement.itemVar.pk if srcElement is not None and srcElement.itemVar is not None else None,
+                "price": (srcElement.paid if mode == EXCHANGE_MODE_MOVE else srcElement.price) if srcElement is not None else None,
+                "balance": diff,
+            })
+        quote.append({
+            "orderCode": dest.order.code,
+            "balance": balance,
+            # Same as fixPaymentStatus()
+            "settlement": "payment" if balance > 0 else ("refund" if balance < 0 else None),
+            "operations": operations,
+        })
+    return quote
+
+
+# Fine grained alternative to lock_objects([event]). The positions of the involved orders are read without locking to
+# find out which quotas and seats are involved: those get an exclusive lock, the event a shared one. Quotas are the
+# ones of the exchanged positions, seats the ones of every position of the orders, since confirming the payment of an
+# order checks all its seats (see fixPaymentStatus()). lock_objects() sorts the keys, so every request acquires them in
+# the same global order. Returns what has been read, to be checked by verifyLockedPositions() and verifyLockedSeats()
+# once the positions are row locked
+def lockExchangedQuotasAndSeats(event: Event, orderCodes: List[str], positionIds: List[int]) -> Dict[int, tuple]:
+    lockedPositions = readLockedPositions(event, orderCodes)
+    exchanged = [lockedPositions[p] for p in positionIds if p in lockedPositions]
+    itemIds = {p[0] for p in exchanged}
+    variationIds = {p[1] for p in exchanged if p[1] is not None}
+    seatIds = {p[3] for p in lockedPositions.values() if p[3] is not None}
+
+    if seatIds and event.settings.seating_minimal_distance > 0:
+        # Same as pretix: no fine grained locking with seating distance enforcement
+        lock_objects([event])
+        return lockedPositions
+
+    # Superset of the involved quotas, locking a few more of them is harmless
+    quotas = list(
+        Quota.objects.filter(event=event, size__isnull=False)
+        .filter(Q(items__in=itemIds) | Q(variations__in=variationIds))
+        .distinct()
+    ) if exchanged else []
+    seats = list(Seat.objects.filter(pk__in=seatIds)) if seatIds else []
+    lock_objects(quotas + seats, shared_lock_objects=[event])
+    return lockedPositions
+
+
+# Positions of the given orders, canceled ones included
+def readLockedPositions(event: Event, orderCodes: List[str]) -> Dict[int, tuple]:
+    return {
+        row[0]: row[1:]
+        for row in OrderPosition.all.filter(order__code__in=orderCodes, order__event=event)
+        .values_list("pk", "item_id", "variation_id", "subevent_id", "seat_id")
+    }
+
+
+# Positions may have been changed between the unlocked read and the row lock, in which case we may hold the wrong locks
+def verifyLockedPositions(lockedPositions: Dict[int, tuple], elements: List[Element]):
+    for element in elements:
+        if element is None:
+            continue
+        pos = element.pos
+        if lockedPositions.get(pos.pk) != (pos.item_id, pos.variation_id, pos.subevent_id, pos.seat_id):
+            logger.error(f"ApiExchangeRooms [{pos.order.code}]: Position {pos.pk} changed while acquiring locks")
+            raise FzException("", extraData={"error": f'Position {pos.pk} changed while acquiring locks, retry'}, code=status.HTTP_409_CONFLICT)
+
+
+# A position of the orders may have been given a seat between the unlocked read and the row lock, and we would not hold
+# its lock when the payment is confirmed
+def verifyLockedSeats(lockedPositions: Dict[int, tuple], orders: List[Order]):
+    seatIds = {p[3] for p in lockedPositions.values()}
+    for posId, seatId in OrderPosition.all.filter(order__in=orders, seat__isnull=False).values_list("pk", "seat_id"):
+        if seatId not in seatIds:
+            logger.error(f"ApiExchangeRooms: Seat of position {posId} changed while acquiring locks")
+            raise FzException("", extraData={"error": f'Position {posId} changed while acquiring locks, retry'}, code=status.HTTP_409_CONFLICT)
 
 
 def fixPaymentStatus(balance: int, order: Order, refundComment: str, paymentComment: str, request, orderContext):
@@ -333,6 +812,8 @@ def fixPaymentStatus(balance: int, order: Order, refundComment: str, paymentComm
             user=request.user if request.user.is_authenticated else None,
             auth=request.auth
         )
+        # With force, pretix would lock the seats of all the positions of the order and take a shared event lock: both
+        # are already held, taken by lockExchange() before the rows
         newPayment.confirm(
             user=request.user if request.user.is_authenticated else None,
             auth=request.auth,
@@ -340,66 +821,66 @@ def fixPaymentStatus(balance: int, order: Order, refundComment: str, paymentComm
             ignore_date=True,
             force=True,
             send_mail=False,
+            lock=False,
         )
 
 
+TRANSFER_NOOP = "none"
+TRANSFER_CANCEL = "cancel"
+TRANSFER_ADD = "add"
+TRANSFER_CHANGE = "change"
+TRANSFER_MOVE = "move"
+
+
+# What transfer() does to dest and how much it changes the balance of its order:
+# >0 if dest should pay more, <0 if dest should instead get a refund
+def planTransfer(src: Element, dest: Element) -> Tuple[str, Decimal]:
+    if src is None:
+        if dest is None:
+            return TRANSFER_NOOP, Decimal("0.00")
+        return TRANSFER_CANCEL, -dest.paid
+    if dest is None:
+        return TRANSFER_ADD, src.price
+    return TRANSFER_CHANGE, src.price - dest.paid
+
+
+# Move mode counterpart of planTransfer(): src comes in and dest goes out, both with the price they were paid with
+def planMove(src: Element, dest: Element) -> Tuple[str, Decimal]:
+    if src is None and dest is None:
+        return TRANSFER_NOOP, Decimal("0.00")
+    return TRANSFER_MOVE, (src.paid if src is not None else Decimal("0.00")) - (dest.paid if dest is not None else Decimal("0.00"))
+
+
 # We return >0 if dest should pay more, <0 if dest should instead get a refund
-def transfer(src: Element, dest: Element, addonTo: OrderPosition, ocmDest: FzOrderChangeManager) -> int:
+def transfer(src: Element, dest: Element, addonTo: OrderPosition, ocmDest: FzOrderChangeManager) -> Decimal:
     # This DOES NOT copy or transfer extra position information!!
     # We now can track the newly created position, but we still need extra work to do this
-    if src is None:
-        if dest is None:
-            return 0
-        else:
-            ocmDest.cancel(dest.pos)
-            return -dest.paid
-    else:
-        if dest is None:
-            ocmDest.add_position_no_addon_validation(
-                item=src.item,
-                variation=src.itemVar,
-                price=src.price,
-                addon_to=addonTo,
-                subevent=src.pos.subevent,
-                seat=src.pos.seat,
-                # membership=rootPosition.membership,
-                valid_from=src.pos.valid_from,
-                valid_until=src.pos.valid_until,
-                is_bundled=False
-            )
-            return src.price
-        else:
-            ocmDest.change_item(dest.pos, src.item, src.itemVar)
-            ocmDest.change_price(dest.pos, src.price)
-            if src.pos.subevent is not None:
-                ocmDest.change_subevent(dest.pos, src.pos.subevent)
-            if src.pos.seat is not None:
-                ocmDest.change_seat(dest.pos, src.pos.seat)
-            if src.pos.valid_from is not None:
-                ocmDest.change_valid_from(dest.pos, src.pos.valid_from)
-            if src.pos.valid_until is not None:
-                ocmDest.change_valid_until(dest.pos, src.pos.valid_until)
-            # Currently we cannot change the bundle status
-            return src.price - dest.paid
-
-
-def exchange(a: Element, b: Element,
-             rootPositionA: OrderPosition, rootPositionB: OrderPosition,
-             ocmA: FzOrderChangeManager, ocmB: FzOrderChangeManager) -> Balance:
-    # Cannot be an addon of itself
-    if a is not None and a.pos.pk == rootPositionA.pk:
-        rootPositionA = None
-    if b is not None and b.pos.pk == rootPositionB.pk:
-        rootPositionB = None
-    balB = transfer(a, b, rootPositionB, ocmB)
-    balA = transfer(b, a, rootPositionA, ocmA)
-    return Balance(balA, balB)
-
-
-def strCmp(x, y):
-    if len(x) > len(y):
-        return x
-    if len(x) == len(y):
-        return min(x, y)
-    else:
-        return y
+    operation, balance = planTransfer(src, dest)
+    if operation == TRANSFER_CANCEL:
+        ocmDest.cancel(dest.pos)
+    elif operation == TRANSFER_ADD:
+        ocmDest.add_position_no_addon_validation(
+            item=src.item,
+            variation=src.itemVar,
+            price=src.price,
+            addon_to=addonTo,
+            subevent=src.pos.subevent,
+            seat=src.pos.seat,
+            # membership=rootPosition.membership,
+            valid_from=src.pos.valid_from,
+            valid_until=src.pos.valid_until,
+            is_bundled=False
+        )
+    elif operation == TRANSFER_CHANGE:
+        ocmDest.change_item(dest.pos, src.item, src.itemVar)
+        ocmDest.change_price(dest.pos, src.price)
+        if src.pos.subevent is not None:
+            ocmDest.change_subevent(dest.pos, src.pos.subevent)
+        if src.pos.seat is not None:
+            ocmDest.change_seat(dest.pos, src.pos.seat)
+        if src.pos.valid_from is not None:
+            ocmDest.change_valid_from(dest.pos, src.pos.valid_from)
+        if src.pos.valid_until is not None:
+            ocmDest.change_valid_until(dest.pos, src.pos.valid_until)
+        # Currently we cannot change the bundle status
+    return balance
@@ -0,0 +1,39 @@
+import logging
+from celery.result import AsyncResult
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.clickjacking import xframe_options_exempt
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.views import APIView
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import isKnownAsyncJob, jobStatusData
+from pretix_fzbackend_utils.utils import verifyToken
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiJobStatus(APIView, View):
+    permission = "can_change_orders"
+
+    def get(self, request, organizer, event, jobId, *args, **kwargs):
+        verifyToken(request)
+
+        # Without a celery broker jobs run eagerly and their result was already returned when they were queued.
+        # Celery reports ids it doesn't know as pending, so unknown and expired ids are answered here
+        if not settings.HAS_CELERY or not isKnownAsyncJob(request.event, jobId):
+            return JsonResponse(
+                {"error": f"Job {jobId} not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        data = jobStatusData(AsyncResult(str(jobId)), request.event.pk)
+        if data is None:
+            return JsonResponse(
+                {"error": f"Job {jobId} not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        return JsonResponse(data, status=status.HTTP_200_OK)
@@ -1,7 +1,8 @@
-from typing import List
+from typing import Dict, List, Optional
 
 import logging
 from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
@@ -10,33 +11,46 @@ from django.views import View
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.decorators.csrf import csrf_exempt
 from pretix.api.serializers.order import (
+    OrderCreateSerializer,
     OrderPaymentCreateSerializer,
     OrderRefundCreateSerializer,
-    OrderCreateSerializer,
     Question,
 )
+from pretix.base.i18n import language
 from pretix.base.models import (
+    Event,
     Item,
+    LogEntry,
     Order,
     OrderFee,
-    OrderPosition,
-    QuestionAnswer,
     OrderPayment,
+    OrderPosition,
     OrderRefund,
+    QuestionAnswer,
+    Quota,
+    Seat,
 )
-from pretix.helpers import OF_SELF
+from pretix.base.services.locking import lock_objects
+from pretix.base.services.orders import cancel_order
 from rest_framework import serializers, status
 from rest_framework.views import APIView
 
-from pretix.base.signals import (
-    order_paid, order_placed    
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import (
+    enqueueAsyncOperation,
+    isAsyncRequest,
 )
-
-from pretix.base.i18n import language
-from pretix.base.services.orders import cancel_order
-
 from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzIdempotency import idempotent
+from pretix_fzbackend_utils.fz_utilites.fzLockManager import FzLockManager
 from pretix_fzbackend_utils.fz_utilites.fzOrderChangeManager import FzOrderChangeManager
+from pretix_fzbackend_utils.fz_utilites.fzOrderSignals import (
+    sendOrderPaidOnCommit,
+    sendOrderPlacedOnCommit,
+)
+from pretix_fzbackend_utils.fz_utilites.fzRetry import atomicWithRetry, retryableReason
+from pretix_fzbackend_utils.fz_utilites.fzTransferPositions import (
+    renumberTransferPositions,
+)
 from pretix_fzbackend_utils.payment import (
     FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
     FZ_MANUAL_PAYMENT_PROVIDER_ISSUER,
@@ -44,6 +58,9 @@ from pretix_fzbackend_utils.payment import (
 from pretix_fzbackend_utils.utils import (
     STATUS_CODE_PAYMENT_INVALID,
     STATUS_CODE_REFUND_INVALID,
+    TRANSFER_BATCH_DEFAULT_CHUNK_SIZE,
+    exceptionToErrorData,
+    lockOrderKey,
     verifyToken,
 )
 
@@ -56,454 +73,663 @@ logger.setLevel(logging.DEBUG)
 class ApiTransferOrder(APIView, View):
     permission = "can_change_orders"
 
+    @idempotent("transfer-order")
     def post(self, request, organizer, event, *args, **kwargs):
         verifyToken(request)
+        if isAsyncRequest(request):
+            return enqueueAsyncOperation(request, "transfer-order")
         data = request.data
 
-        if "orderCode" not in data or not isinstance(data["orderCode"], str):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "orderCode"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "membershipCardItemIds" not in data or not isinstance(data["membershipCardItemIds"], list) or len(data["membershipCardItemIds"]) == 0:
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "membershipCardItemIds"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        for itemId in data["membershipCardItemIds"]:
-            if not isinstance(itemId, int):
-                return JsonResponse(
-                    {"error": 'Invalid parameter membershipcard item id'}, status=status.HTTP_400_BAD_REQUEST
-                )
-        if "membershipCardNeededForNewUser" not in data or not isinstance(data["membershipCardNeededForNewUser"], bool):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "membershipCardNeededForNewUser"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "userIdQuestionId" not in data or not isinstance(data["userIdQuestionId"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "userIdQuestionId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "newUserId" not in data or not isinstance(data["newUserId"], int):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "newUserId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "newEmail" not in data or not isinstance(data["newEmail"], str):
-            return JsonResponse(
-                {"error": 'Missing or invalid parameter "newEmail"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "membershipCardAddonToPositionId" in data and data["membershipCardAddonToPositionId"] and not isinstance(data["membershipCardAddonToPositionId"], int):
-            return JsonResponse(
-                {"error": 'Invalid parameter "membershipCardAddonToPositionId"'}, status=status.HTTP_400_BAD_REQUEST
-            )
+        error = validateTransferData(data)
+        if error is not None:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+        orderCode = data["orderCode"]
 
-                
-        if "name" in data and data["name"] and not isinstance(data["name"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "name"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "street" in data and data["street"] and not isinstance(data["street"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "street"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "zipcode" in data and data["zipcode"] and not isinstance(data["zipcode"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "zipcode"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "city" in data and data["city"] and not isinstance(data["city"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "city"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "country" in data and data["country"] and not isinstance(data["country"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "country"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "state" in data and data["state"] and not isinstance(data["state"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "state"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "cancellationComment" in data and data["cancellationComment"] and not isinstance(data["cancellationComment"], str):
-            return JsonResponse(
-                {"error": 'Invalid parameter "cancellationComment"'}, status=status.HTTP_400_BAD_REQUEST
-            )
-        if "manualPaymentComment" in data and data["manualPaymentComment"] and not isinstance(data["manualPaymentComment"], str):
+        if data.get("dryRun", False):
+            return JsonResponse(transferOrderDryRun(request, data), status=status.HTTP_200_OK)
+
+        try:
+            newOrderCode = atomicWithRetry("transfer-order", lambda: transferOrder(request, data))
+        except FzException as fe:
+            status_code = fe.code if fe.code is not None else status.HTTP_400_BAD_REQUEST
+            return JsonResponse(fe.extraData, status=status_code)
+
+        logger.info(
+            f"ApiTransferOrder [{orderCode}]: Success"
+        )
+
+        if (newOrderCode is not None):
+            return JsonResponse({"newOrderCode": newOrderCode}, status=status.HTTP_200_OK)
+
+        return HttpResponse("")
+
+
+@method_decorator(xframe_options_exempt, "dispatch")
+@method_decorator(csrf_exempt, "dispatch")
+class ApiTransferOrders(APIView, View):
+    permission = "can_change_orders"
+
+    @idempotent("transfer-orders")
+    def post(self, request, organizer, event, *args, **kwargs):
+        verifyToken(request)
+        data = request.data
+
+        if "transfers" not in data or not isinstance(data["transfers"], list):
             return JsonResponse(
-                {"error": 'Invalid parameter "manualPaymentComment"'}, status=status.HTTP_400_BAD_REQUEST
+                {"error": 'Missing or invalid parameter "transfers"'}, status=status.HTTP_400_BAD_REQUEST
             )
-        if "manualRefundComment" in data and data["manualRefundComment"] and not isinstance(data["manualRefundComment"], str):
+        if "chunkSize" in data and data["chunkSize"] is not None and (not isinstance(data["chunkSize"], int) or data["chunkSize"] < 1):
             return JsonResponse(
-                {"error": 'Invalid parameter "manualRefundComment"'}, status=status.HTTP_400_BAD_REQUEST
+                {"error": 'Invalid parameter "chunkSize"'}, status=status.HTTP_400_BAD_REQUEST
             )
 
-        orderCode = data["orderCode"]
-        membershipCardItemIds = data["membershipCardItemIds"]
-        membershipCardNeededForNewUser = data["membershipCardNeededForNewUser"]
-        membershipCardAddonToPositionId = data.get("membershipCardAddonToPositionId", None)
-        userIdQuestionId = data["userIdQuestionId"]
-        newUserId = data["newUserId"]
-        newEmail = data["newEmail"]
-        name = data.get("name", None)
-        street = data.get("street", None)
-        zipcode = data.get("zipcode", None)
-        city = data.get("city", None)
-        country = data.get("country", None)
-        state = data.get("state", None)
-        cancellationComment = data.get("cancellationComment", None)
-        paymentComment = data.get("manualPaymentComment", None)
-        refundComment = data.get("manualRefundComment", None)
-
-        #logger.info(
-        #    f"ApiTransferOrder [{orderCode}]: Got from req posId={positionId} qId={questionId} newUserId={newUserId}"
-        #)
-
-        CONTEXT = {"event": request.event, "pdf_data": False, "check_quotas": False, "auth": request.auth}
-        
-        newOrderCode = None
+        transfers = data["transfers"]
+        chunkSize = data.get("chunkSize", None) or TRANSFER_BATCH_DEFAULT_CHUNK_SIZE
+        results = [None] * len(transfers)
+
+        # Invalid specs are reported immediately and never reach the db
+        validIdxs = []
+        for idx, spec in enumerate(transfers):
+            error = validateTransferData(spec) if isinstance(spec, dict) else "Invalid transfer spec"
+            if error is not None:
+                results[idx] = {
+                    "orderCode": spec.get("orderCode", None) if isinstance(spec, dict) else None,
+                    "status": status.HTTP_400_BAD_REQUEST,
+                    "error": {"error": error},
+                }
+            else:
+                validIdxs.append(idx)
+        # Always acquire the order locks in the same order, like ApiExchangeRooms does. In this way we prevent deadlocks
+        validIdxs.sort(key=lambda i: lockOrderKey(transfers[i]["orderCode"]))
+
+        logger.info(
+            f"ApiTransferOrders: Got {len(transfers)} transfers from req, {len(validIdxs)} valid, chunkSize={chunkSize}"
+        )
+
+        for chunkStart in range(0, len(validIdxs), chunkSize):
+            chunk = validIdxs[chunkStart:chunkStart + chunkSize]
+            try:
+                atomicWithRetry("transfer-orders", lambda: transferChunk(request, transfers, chunk, results))
+            except Exception as e:
+                # The chunk could not be run (lock timeout, retries exhausted) and was rolled back as a whole, so any
+                # result it stored is void. Earlier chunks are already committed: report them and go on
+                statusCode, errorData = exceptionToErrorData(e)
+                for idx in chunk:
+                    results[idx] = {"orderCode": transfers[idx]["orderCode"], "status": statusCode, "error": errorData}
+                logger.error(f"ApiTransferOrders: Chunk of {len(chunk)} transfers failed with status {statusCode}: {errorData}")
 
+        return JsonResponse({"results": results}, status=status.HTTP_200_OK)
+
+
+# Transfers a chunk of valid specs, storing the outcome of each one in results. The quotas and seats of every order
+# of the chunk are locked upfront with a single lock_objects(). We assume we already are in a transaction.atomic().
+# Deadlocks and serialization failures are propagated, so that the whole chunk is retried
+def transferChunk(request, transfers: list, chunk: List[int], results: list):
+    specs = [transfers[idx] for idx in chunk if not transfers[idx].get("dryRun", False)]
+    readPositions = lockTransferredQuotasAndSeats(
+        request.event,
+        [spec["orderCode"] for spec in specs],
+        [itemId for spec in specs for itemId in spec["membershipCardItemIds"]],
+    ) if specs else {}
+    for idx in chunk:
+        orderCode = transfers[idx]["orderCode"]
         try:
+            if transfers[idx].get("dryRun", False):
+                results[idx] = {"orderCode": orderCode, "status": status.HTTP_200_OK, **transferOrderDryRun(request, transfers[idx])}
+                continue
+            # Savepoint: a failing transfer is rolled back without aborting the rest of the chunk
             with transaction.atomic():
-                membershipCardItem = get_object_or_404(
-                    Item.objects.filter(event=request.event, id__in=membershipCardItemIds)
-                )
-                sourceOrder: Order = get_object_or_404(
-                    Order.objects.select_for_update(of=OF_SELF).filter(event=request.event, code=orderCode, event__organizer=request.organizer)
-                )
-                sourcePositions = sourceOrder.positions.all()
-                sourceFees = sourceOrder.fees.all()
-                
-                membershipCardAddonToNewPositionId = None
-                membershipCardTotalAmount = 0
-                
-                # FIRST CREATES THE NEW ORDER FOR THE DEST USER
-                
-                # Copy positions and answers
-                
-                #First copy run
-                basePositions = []
-                positionIdToAddons = {}
-                position: OrderPosition
-                for position in sourcePositions:
-                    if position.canceled:
-                        #Don't copy canceled positions
-                        continue
-                    
-                    if (position.item_id in membershipCardItemIds):
-                        # We save how much the membership cards
-                        membershipCardTotalAmount += position.price
-                        continue # Skip copying membership cards
-                    
-                    answers = position.answers.all()
-                    newAnswers = []
-                    answer: QuestionAnswer
-                    for answer in answers:
-                        opts = answer.options.all()
-                        newAnswer = {
-                            "question": answer.question_id,
-                            "answer": answer.answer,
-                            "options": [option.identifier for option in opts] if (answer.options and len(opts) > 0) else []
-                        }
-                        if (answer.question_id == userIdQuestionId):
-                            if answer.question.type != Question.TYPE_NUMBER:
-                                raise FzException("", extraData={"error": f'Question {userIdQuestionId} is not of type number'}, code=status.HTTP_400_BAD_REQUEST)
-                            newAnswer["answer"] = str(serializers.DecimalField(max_digits=50, decimal_places=1).to_internal_value(newUserId))
-                            newAnswer["options"] = []
-                        newAnswers.append(newAnswer)
-                    
-                    addon = position.addon_to_id if position.addon_to else None                    
-                    newPos = {
-                        "positionid": position.id, # Needs to be updated later
-                        "item": position.item_id,
-                        "variation": position.variation_id if position.variation else None,
-                        "price": position.price,
-                        "seat": position.seat.seat_guid if position.seat else None,
-                        "attendee_name": position.attendee_name,
-                        #"voucher": position.voucher.id if position.voucher else None,
-                        "attendee_email": position.attendee_email,
-                        "company": position.company,
-                        "street": position.street,
-                        "zipcode": position.zipcode,
-                        "city": position.city,
-                        "country": position.country,
-                        "state": position.state,
-                        #"secret": position.secret,
-                        "subevent": position.subevent_id if position.subevent else None,
-                        "valid_from": position.valid_from,
-                        "valid_until": position.valid_until,
-                        "discount": position.discount,
-                        "answers": newAnswers,
-                    }
-                    
-                    if (addon is None):
-                        basePositions.append(newPos)
-                    else:
-                        if addon not in positionIdToAddons:
-                            l = []
-                            positionIdToAddons[addon] = l
-                        else:
-                            l = positionIdToAddons[addon]
-                        l.append(newPos)
-                #Adjust positionid and positions
-                posId = 1
-                newPositions = []
-                for pos in basePositions:
-                    orgPositionId = pos["positionid"]
-                    pos["positionid"] = posId
-                    if membershipCardAddonToPositionId is not None and orgPositionId == membershipCardAddonToPositionId:
-                        membershipCardAddonToNewPositionId = posId
-                    basePosId = posId
-                    posId += 1
-                    newPositions.append(pos)
-                    if (orgPositionId in positionIdToAddons):
-                        for addonPos in positionIdToAddons[orgPositionId]:
-                            addonPos["addon_to"] = basePosId
-                            addonPos["positionid"] = posId
-                            posId += 1
-                            newPositions.append(addonPos)
-                
-                newFees = []
-                fee: OrderFee
-                for fee in sourceFees:
-                    newFee = {
-                        "fee_type": fee.fee_type,
-                        "value": fee.value,
-                        "internal_type": fee.internal_type,
-                        "tax_rule": fee.tax_rule_id if fee.tax_rule else None,
-                        "description": fee.description,
-                    }
-                    newFees.append(newFee)
-                
-                # CREATE NEW ORDER
-                orderData = {
-                    "status": "p", #paid
-                    "email": newEmail,
-                    "invoice_address": {
-                        "name": name,
-                        "street": street,
-                        "zipcode": zipcode,
-                        "city": city,
-                        "country": country,
-                        "state": state
-                    },
-                    "force": True,
-                    "send_email": False,
-                    "positions": newPositions,
-                    "fees": newFees,
-                    "payment_provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
-                    "payment_info": {
-                        "issued_by": FZ_MANUAL_PAYMENT_PROVIDER_ISSUER,
-                        "comment": paymentComment
-                    },
-                    "testmode": sourceOrder.testmode,
-                }
-                # Actually create the order. Code taken from the create order api endpoint
-                createOrderSerializer = OrderCreateSerializer(data = orderData, context=CONTEXT)
-                createOrderSerializer.is_valid(raise_exception=True)
-                createOrderSerializer.save()
-                newOrder: Order = createOrderSerializer.instance
-                newOrder.log_action(
-                    'pretix.event.order.placed',
-                    user=request.user if request.user.is_authenticated else None,
-                    auth=request.auth,
-                )
-                newOrderCode = newOrder.code
-                with language(newOrder.locale, self.request.event.settings.region):
-                    payment = newOrder.payments.last()
-                    # OrderCreateSerializer creates at most one payment
-                    if payment and payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
-                        newOrder.log_action(
-                            'pretix.event.order.payment.confirmed', {
-                                'local_id': payment.local_id,
-                                'provider': payment.provider,
-                            },
-                            user=request.user if request.user.is_authenticated else None,
-                            auth=request.auth,
-                        )
-                    order_placed.send(self.request.event, order=newOrder, bulk=False)
-                    if newOrder.status == Order.STATUS_PAID:
-                        order_paid.send(self.request.event, order=newOrder)
-                        newOrder.log_action(
-                            'pretix.event.order.paid',
-                            {
-                                'provider': payment.provider if payment else None,
-                                'info': {},
-                                'date': now().isoformat(),
-                                'force': False
-                            },
-                            user=request.user if request.user.is_authenticated else None,
-                            auth=request.auth,
-                        )
-                logger.info(f"ApiTransferOrder [{orderCode}]: New order created for user {newUserId} with code {newOrderCode}")
-                # If users needs a membership card, we add it there
-                if membershipCardNeededForNewUser:
-                    pos: OrderPosition
-                    for pos in newOrder.positions.all():
-                        if (pos.positionid == membershipCardAddonToNewPositionId):
-                            ocm = FzOrderChangeManager(
-                                    order=newOrder,
-                                    user=self.request.user if self.request.user.is_authenticated else None,
-                                    auth=request.auth,
-                                    notify=False,
-                                    reissue_invoice=True,
-                                )
-                            ocm.add_position_no_addon_validation(item=membershipCardItem, variation=None, price=membershipCardItem.default_price, addon_to=pos)
-                            ocm.commit()
-                            logger.info(f"ApiTransferOrder [{orderCode}]: Membership card added to new order {newOrderCode} for user {newUserId}")
-                            break
-                    else:
-                        logger.error(f"ApiTransferOrder [{orderCode}]: Membership card addon position to not found in new order {newOrderCode} for user {newUserId}")
-                
-                # FIX PAYMENTS ON SOURCE ORDER
-
-                # Prevent refunds so admin CANNOT refund the wrong owner
-                totalPaid = 0
-                # Already ordered in the Meta class of OrderPayment/Refund. Order is important for deadlock prevention
-                payments: List[OrderPayment] = OrderPayment.objects.select_for_update(of=OF_SELF).filter(order__pk=sourceOrder.pk, state__in=[
-                    OrderPayment.PAYMENT_STATE_CONFIRMED,
-                    OrderPayment.PAYMENT_STATE_CREATED,
-                    OrderPayment.PAYMENT_STATE_PENDING
-                ])
-                for payment in payments:
-                    if payment.state != OrderPayment.PAYMENT_STATE_CONFIRMED:
-                        logger.error(
-                            f"ApiTransferOrder [{orderCode}]: Payment {payment.full_id}: invalid state {payment.state}"
-                        )
-                        raise FzException("", extraData={"error": f'Payment {payment.full_id} is in invalid state {payment.state}'},
-                                          code=STATUS_CODE_PAYMENT_INVALID)
-                    payment.state = OrderPayment.PAYMENT_STATE_REFUNDED
-                    payment.save(update_fields=["state"])
-                    sourceOrder.log_action(
-                        'pretix.event.order.payment.refunded', {
-                            'local_id': payment.local_id,
-                            'provider': payment.provider,
-                        },
-                        user=request.user if request.user.is_authenticated else None,
-                        auth=request.auth
-                    )
-                    totalPaid += payment.amount
-                refunds: List[OrderRefund] = OrderRefund.objects.select_for_update(of=OF_SELF).filter(order__pk=sourceOrder.pk, state__in=[
-                    OrderRefund.REFUND_STATE_CREATED,
-                    OrderRefund.REFUND_STATE_TRANSIT
-                ])
-                for refund in refunds:
-                    logger.error(
-                        f"ApiTransferOrder [{orderCode}]: Refund {refund.full_id}: invalid state {refund.state}"
-                    )
-                    raise FzException("", extraData={"error": f'Refund {refund.full_id} is in invalid state {refund.state}'},
-                                      code=STATUS_CODE_REFUND_INVALID)
-
-                orderContext = {"order": sourceOrder, **CONTEXT}
-
-                logger.info(f"ApiTransferOrder [{orderCode}]: Payments marked as refunded")
-
-                # It's enough to mark payment as refunded. However this may seem an inconsistent state (order paid with no valid payments),
-                # so we create a refund object as well
-                amount = serializers.DecimalField(max_digits=13, decimal_places=2).to_internal_value(str(totalPaid))
-                dateNow = serializers.DateTimeField().to_internal_value(now())
-
-                # Perform refund
-                refundData = {
-                    "state": OrderRefund.REFUND_STATE_DONE,
-                    "source": OrderRefund.REFUND_SOURCE_EXTERNAL,
-                    "amount": amount,
-                    "execution_date": dateNow,
-                    "comment": refundComment,
-                    "provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
-                    # mark canceled/pending not needed
-                }
-                refundSerializer = OrderRefundCreateSerializer(data=refundData, context=orderContext)
-                refundSerializer.is_valid(raise_exception=True)
-                refundSerializer.save()
-                newRefund: OrderRefund = refundSerializer.instance
-                # Double log to follow what the api.views.order.RefundViewSet.create() does
-                sourceOrder.log_action(
-                    'pretix.event.order.refund.created', {
-                        'local_id': newRefund.local_id,
-                        'provider': newRefund.provider,
-                    },
-                    user=request.user if request.user.is_authenticated else None,
-                    auth=request.auth
-                )
-                sourceOrder.log_action(
-                    f'pretix.event.order.refund.{newRefund.state}', {
-                        'local_id': newRefund.local_id,
-                        'provider': newRefund.provider,
-                    },
-                    user=request.user if request.user.is_authenticated else None,
-                    auth=request.auth
-                )
-                logger.info(f"ApiTransferOrder [{orderCode}]: Refund created")
-
-                # If the sourceOrder had some membership cards, we create a new fake payment.
-                # This is going to be our canceletion fee
-                if membershipCardTotalAmount > 0:
-                    logger.info(f"ApiTransferOrder [{orderCode}]: Creating payment for membership card amount {membershipCardTotalAmount}")
-                    paymentData = {
-                        "state": OrderPayment.PAYMENT_STATE_PENDING,
-                        "amount": membershipCardTotalAmount,
-                        "payment_date": dateNow,
-                        "sendEmail": False,
-                        "provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
-                        "info": {
-                            "issued_by": FZ_MANUAL_PAYMENT_PROVIDER_ISSUER,
-                            "comment": paymentComment
-                        }
-                    }
-                    paymentSerializer = OrderPaymentCreateSerializer(data=paymentData, context=orderContext)
-                    paymentSerializer.is_valid(raise_exception=True)
-                    paymentSerializer.save()
-                    newPayment: OrderPayment = paymentSerializer.instance
-                    sourceOrder.log_action(
-                        'pretix.event.order.payment.started', {
-                            'local_id': newPayment.local_id,
-                            'provider': newPayment.provider,
-                        },
-                        user=request.user if request.user.is_authenticated else None,
-                        auth=request.auth
-                    )
-                    newPayment.confirm(
-                        user=self.request.user if self.request.user.is_authenticated else None,
-                        auth=self.request.auth,
-                        count_waitinglist=False,
-                        ignore_date=True,
-                        force=True,
-                        send_mail=False,
-                    )
-                    logger.info(f"ApiTransferOrder [{orderCode}]: Payment created")
-
-                # Let OCM update the internal fields of the order
+                newOrderCode = transferOrder(request, transfers[idx], readPositions)
+            results[idx] = {"orderCode": orderCode, "status": status.HTTP_200_OK, "newOrderCode": newOrderCode}
+            logger.info(f"ApiTransferOrders [{orderCode}]: Success")
+        except Exception as e:
+            if retryableReason(e) is not None:
+                raise
+            statusCode, errorData = exceptionToErrorData(e)
+            results[idx] = {"orderCode": orderCode, "status": statusCode, "error": errorData}
+            logger.error(f"ApiTransferOrders [{orderCode}]: Failed with status {statusCode}: {errorData}")
+
+
+def validateTransferData(data) -> Optional[str]:
+    if "orderCode" not in data or not isinstance(data["orderCode"], str):
+        return 'Missing or invalid parameter "orderCode"'
+    if "membershipCardItemIds" not in data or not isinstance(data["membershipCardItemIds"], list) or len(data["membershipCardItemIds"]) == 0:
+        return 'Missing or invalid parameter "membershipCardItemIds"'
+    for itemId in data["membershipCardItemIds"]:
+        if not isinstance(itemId, int):
+            return 'Invalid parameter membershipcard item id'
+    if "membershipCardNeededForNewUser" not in data or not isinstance(data["membershipCardNeededForNewUser"], bool):
+        return 'Missing or invalid parameter "membershipCardNeededForNewUser"'
+    if "userIdQuestionId" not in data or not isinstance(data["userIdQuestionId"], int):
+        return 'Missing or invalid parameter "userIdQuestionId"'
+    if "newUserId" not in data or not isinstance(data["newUserId"], int):
+        return 'Missing or invalid parameter "newUserId"'
+    if "newEmail" not in data or not isinstance(data["newEmail"], str):
+        return 'Missing or invalid parameter "newEmail"'
+    if "membershipCardAddonToPositionId" in data and data["membershipCardAddonToPositionId"] and not isinstance(data["membershipCardAddonToPositionId"], int):
+        return 'Invalid parameter "membershipCardAddonToPositionId"'
+    if "name" in data and data["name"] and not isinstance(data["name"], str):
+        return 'Invalid parameter "name"'
+    if "street" in data and data["street"] and not isinstance(data["street"], str):
+        return 'Invalid parameter "street"'
+    if "zipcode" in data and data["zipcode"] and not isinstance(data["zipcode"], str):
+        return 'Invalid parameter "zipcode"'
+    if "city" in data and data["city"] and not isinstance(data["city"], str):
+        return 'Invalid parameter "city"'
+    if "country" in data and data["country"] and not isinstance(data["country"], str):
+        return 'Invalid parameter "country"'
+    if "state" in data and data["state"] and not isinstance(data["state"], str):
+        return 'Invalid parameter "state"'
+    if "cancellationComment" in data and data["cancellationComment"] and not isinstance(data["cancellationComment"], str):
+        return 'Invalid parameter "cancellationComment"'
+    if "manualPaymentComment" in data and data["manualPaymentComment"] and not isinstance(data["manualPaymentComment"], str):
+        return 'Invalid parameter "manualPaymentComment"'
+    if "manualRefundComment" in data and data["manualRefundComment"] and not isinstance(data["manualRefundComment"], str):
+        return 'Invalid parameter "manualRefundComment"'
+    if "dryRun" in data and not isinstance(data["dryRun"], bool):
+        return 'Invalid parameter "dryRun"'
+    return None
+
+
+# We assume we already are in a transaction.atomic(). Returns the code of the newly created order
+# If readPositions is given, the caller already locked the quotas and seats (see transferChunk())
+def transferOrder(request, data, readPositions: Optional[Dict[str, Dict[int, tuple]]] = None) -> str:
+    orderCode = data["orderCode"]
+    membershipCardItemIds = data["membershipCardItemIds"]
+    membershipCardNeededForNewUser = data["membershipCardNeededForNewUser"]
+    newUserId = data["newUserId"]
+    cancellationComment = data.get("cancellationComment", None)
+    paymentComment = data.get("manualPaymentComment", None)
+    refundComment = data.get("manualRefundComment", None)
+
+    # logger.info(
+    #     f"ApiTransferOrder [{orderCode}]: Got from req posId={positionId} qId={questionId} newUserId={newUserId}"
+    # )
+
+    CONTEXT = {"event": request.event, "pdf_data": False, "check_quotas": False, "auth": request.auth}
+
+    newOrderCode = None
+
+    membershipCardItem = get_object_or_404(
+        Item.objects.filter(event=request.event, id__in=membershipCardItemIds)
+    )
+    if readPositions is None:
+        # Quotas and seats first, then the rows: same order as transferChunk() and the other endpoints
+        readPositions = lockTransferredQuotasAndSeats(request.event, [orderCode], membershipCardItemIds)
+    locks = transferLocks(request.event, orderCode).lock()
+    sourceOrder: Order = locks.order(orderCode)
+    verifyTransferredPositions(readPositions, sourceOrder)
+
+    # FIRST CREATES THE NEW ORDER FOR THE DEST USER
+    orderData, membershipCardTotalAmount, membershipCardAddonToNewPositionId = buildTransferOrderData(sourceOrder, data)
+
+    # Actually create the order. Code taken from the create order api endpoint
+    createOrderSerializer = OrderCreateSerializer(data=orderData, context=CONTEXT)
+    createOrderSerializer.is_valid(raise_exception=True)
+    createOrderSerializer.save()
+    newOrder: Order = createOrderSerializer.instance
+    newOrder.log_action(
+        'pretix.event.order.placed',
+        user=request.user if request.user.is_authenticated else None,
+        auth=request.auth,
+    )
+    newOrderCode = newOrder.code
+    with language(newOrder.locale, request.event.settings.region):
+        payment = newOrder.payments.last()
+        # OrderCreateSerializer creates at most one payment
+        if payment and payment.state == OrderPayment.PAYMENT_STATE_CONFIRMED:
+            newOrder.log_action(
+                'pretix.event.order.payment.confirmed', {
+                    'local_id': payment.local_id,
+                    'provider': payment.provider,
+                },
+                user=request.user if request.user.is_authenticated else None,
+                auth=request.auth,
+            )
+        # Deferred, a retried attempt must not notify the receivers twice
+        sendOrderPlacedOnCommit(request.event, newOrder)
+        if newOrder.status == Order.STATUS_PAID:
+            sendOrderPaidOnCommit(request.event, newOrder)
+            newOrder.log_action(
+                'pretix.event.order.paid',
+                {
+                    'provider': payment.provider if payment else None,
+                    'info': {},
+                    'date': now().isoformat(),
+                    'force': False
+                },
+                user=request.user if request.user.is_authenticated else None,
+                auth=request.auth,
+            )
+    logger.info(f"ApiTransferOrder [{orderCode}]: New order created for user {newUserId} with code {newOrderCode}")
+    # If users needs a membership card, we add it there
+    if membershipCardNeededForNewUser:
+        pos: OrderPosition
+        for pos in newOrder.positions.all():
+            if (pos.positionid == membershipCardAddonToNewPositionId):
                 ocm = FzOrderChangeManager(
-                    order=sourceOrder,
-                    user=self.request.user if self.request.user.is_authenticated else None,
+                    order=newOrder,
+                    user=request.user if request.user.is_authenticated else None,
                     auth=request.auth,
                     notify=False,
-                    reissue_invoice=False,
+                    reissue_invoice=True,
                 )
-                ocm.recomputeOperation()
+                ocm.fz_enable_locking = False
+                ocm.add_position_no_addon_validation(item=membershipCardItem, variation=None, price=membershipCardItem.default_price, addon_to=pos)
                 ocm.commit()
-                logger.debug(f"ApiTransferOrder [{orderCode}]: OCM recompute")
-
-                # Both already done inside ocm
-                # tickets.invalidate_cache.apply_async(kwargs={'event': request.event.pk, 'order': order.pk})
-                # order_modified.send(sender=request.event, order=order)
-                
-                # Cancel order with paid fee
-                cancel_order(
-                    sourceOrder.pk,
-                    user=self.request.user,
-                    email_comment=cancellationComment,
-                    send_mail=False,
-                    cancel_invoice=False,
-                    cancellation_fee=membershipCardTotalAmount if membershipCardTotalAmount > 0 else None
-                )
-                logger.info(f"ApiTransferOrder [{orderCode}]: Order canceled with paid fee of {membershipCardTotalAmount}")
-                if newOrderCode is None:
-                    raise FzException("New order code is none", extraData={"error": f'New order code is None'}, code=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        except FzException as fe:
-            status_code = fe.code if fe.code is not None else status.HTTP_400_BAD_REQUEST
-            return JsonResponse(fe.extraData, status=status_code)
+                logger.info(f"ApiTransferOrder [{orderCode}]: Membership card added to new order {newOrderCode} for user {newUserId}")
+                break
+        else:
+            logger.error(f"ApiTransferOrder [{orderCode}]: Membership card addon position to not found in new order {newOrderCode} for user {newUserId}")
 
-        logger.info(
-            f"ApiTransferOrder [{orderCode}]: Success"
+    # FIX PAYMENTS ON SOURCE ORDER
+
+    # Prevent refunds so admin CANNOT refund the wrong owner
+    payments = loadTransferPayments(sourceOrder, locks)
+
+    # One UPDATE for all the payments. The log entries are inserted in bulk together with the refund ones below
+    OrderPayment.objects.filter(pk__in=[payment.pk for payment in payments]).update(state=OrderPayment.PAYMENT_STATE_REFUNDED)
+    logEntries = [
+        sourceOrder.log_action(
+            'pretix.event.order.payment.refunded', {
+                'local_id': payment.local_id,
+                'provider': payment.provider,
+            },
+            user=request.user if request.user.is_authenticated else None,
+            auth=request.auth,
+            save=False
+        ) for payment in payments
+    ]
+    totalPaid = sum((payment.amount for payment in payments), 0)
+
+    orderContext = {"order": sourceOrder, **CONTEXT}
+
+    logger.info(f"ApiTransferOrder [{orderCode}]: Payments marked as refunded")
+
+    # It's enough to mark payment as refunded. However this may seem an inconsistent state (order paid with no valid payments),
+    # so we create a refund object as well
+    amount = serializers.DecimalField(max_digits=13, decimal_places=2).to_internal_value(str(totalPaid))
+    dateNow = serializers.DateTimeField().to_internal_value(now())
+
+    # Perform refund
+    refundData = {
+        "state": OrderRefund.REFUND_STATE_DONE,
+        "source": OrderRefund.REFUND_SOURCE_EXTERNAL,
+        "amount": amount,
+        "execution_date": dateNow,
+        "comment": refundComment,
+        "provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
+        # mark canceled/pending not needed
+    }
+    refundSerializer = OrderRefundCreateSerializer(data=refundData, context=orderContext)
+    refundSerializer.is_valid(raise_exception=True)
+    refundSerializer.save()
+    newRefund: OrderRefund = refundSerializer.instance
+    # Double log to follow what the api.views.order.RefundViewSet.create() does
+    logEntries.append(sourceOrder.log_action(
+        'pretix.event.order.refund.created', {
+            'local_id': newRefund.local_id,
+            'provider': newRefund.provider,
+        },
+        user=request.user if request.user.is_authenticated else None,
+        auth=request.auth,
+        save=False
+    ))
+    logEntries.append(sourceOrder.log_action(
+        f'pretix.event.order.refund.{newRefund.state}', {
+            'local_id': newRefund.local_id,
+            'provider': newRefund.provider,
+        },
+        user=request.user if request.user.is_authenticated else None,
+        auth=request.auth,
+        save=False
+    ))
+    LogEntry.bulk_create_and_postprocess(logEntries)
+    logger.info(f"ApiTransferOrder [{orderCode}]: Refund created")
+
+    # If the sourceOrder had some membership cards, we create a new fake payment.
+    # This is going to be our canceletion fee
+    if membershipCardTotalAmount > 0:
+        logger.info(f"ApiTransferOrder [{orderCode}]: Creating payment for membership card amount {membershipCardTotalAmount}")
+        paymentData = {
+            "state": OrderPayment.PAYMENT_STATE_PENDING,
+            "amount": membershipCardTotalAmount,
+            "payment_date": dateNow,
+            "sendEmail": False,
+            "provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
+            "info": {
+                "issued_by": FZ_MANUAL_PAYMENT_PROVIDER_ISSUER,
+                "comment": paymentComment
+            }
+        }
+        paymentSerializer = OrderPaymentCreateSerializer(data=paymentData, context=orderContext)
+        paymentSerializer.is_valid(raise_exception=True)
+        paymentSerializer.save()
+        newPayment: OrderPayment = paymentSerializer.instance
+        sourceOrder.log_action(
+            'pretix.event.order.payment.started', {
+                'local_id': newPayment.local_id,
+                'provider': newPayment.provider,
+            },
+            user=request.user if request.user.is_authenticated else None,
+            auth=request.auth
         )
-        
-        if (newOrderCode is not None):
-            return JsonResponse({"newOrderCode": newOrderCode}, status=status.HTTP_200_OK)
+        newPayment.confirm(
+            user=request.user if request.user.is_authenticated else None,
+            auth=request.auth,
+            count_waitinglist=False,
+            ignore_date=True,
+            force=True,
+            send_mail=False,
+            lock=False,
+        )
+        logger.info(f"ApiTransferOrder [{orderCode}]: Payment created")
 
-        return HttpResponse("")
+    # Let OCM update the internal fields of the order
+    ocm = FzOrderChangeManager(
+        order=sourceOrder,
+        user=request.user if request.user.is_authenticated else None,
+        auth=request.auth,
+        notify=False,
+        reissue_invoice=False,
+    )
+    ocm.fz_enable_locking = False
+    ocm.recomputeOperation()
+    ocm.commit()
+    logger.debug(f"ApiTransferOrder [{orderCode}]: OCM recompute")
+
+    # Both already done inside ocm
+    # tickets.invalidate_cache.apply_async(kwargs={'event': request.event.pk, 'order': order.pk})
+    # order_modified.send(sender=request.event, order=order)
+
+    # Cancel order with paid fee
+    cancel_order(
+        sourceOrder.pk,
+        user=request.user,
+        email_comment=cancellationComment,
+        send_mail=False,
+        cancel_invoice=False,
+        cancellation_fee=membershipCardTotalAmount if membershipCardTotalAmount > 0 else None
+    )
+    logger.info(f"ApiTransferOrder [{orderCode}]: Order canceled with paid fee of {membershipCardTotalAmount}")
+    if newOrderCode is None:
+        raise FzException("New order code is none", extraData={"error": 'New order code is None'}, code=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return newOrderCode
+
+
+# Computes the new order that transferOrder() would create and checks whether the transfer would succeed, without
+# taking any lock and without writing anything
+def transferOrderDryRun(request, data) -> dict:
+    orderCode = data["orderCode"]
+    CONTEXT = {"event": request.event, "pdf_data": False, "check_quotas": False, "auth": request.auth}
+    errors = []
+
+    get_object_or_404(
+        Item.objects.filter(event=request.event, id__in=data["membershipCardItemIds"])
+    )
+    locks = transferLocks(request.event, orderCode).read()
+    sourceOrder: Order = locks.order(orderCode)
+
+    try:
+        loadTransferPayments(sourceOrder, locks)
+    except FzException as fe:
+        errors.append(fe.extraData)
+
+    orderData, membershipCardTotalAmount, membershipCardAddonToNewPositionId = None, None, None
+    try:
+        orderData, membershipCardTotalAmount, membershipCardAddonToNewPositionId = buildTransferOrderData(sourceOrder, data)
+        createOrderSerializer = OrderCreateSerializer(data=orderData, context=CONTEXT)
+        # Payment providers store their default settings the first time they are loaded, which the validation does.
+        # It runs in a savepoint that is always rolled back, so that nothing is written
+        with transaction.atomic():
+            valid = createOrderSerializer.is_valid()
+            transaction.set_rollback(True)
+        if not valid:
+            errors.append(createOrderSerializer.errors)
+    except FzException as fe:
+        errors.append(fe.extraData)
+
+    logger.info(f"ApiTransferOrder [{orderCode}]: Dry run done with {len(errors)} errors")
+    return {
+        "dryRun": True,
+        "valid": len(errors) == 0,
+        "errors": errors,
+        "order": orderData,
+        "membershipCardTotalAmount": membershipCardTotalAmount,
+        "membershipCardAddonToNewPositionId": membershipCardAddonToNewPositionId,
+    }
+
+
+# Rows needed by a transfer: the source order, its confirmed or pending payments and its pending refunds
+def transferLocks(event, orderCode: str) -> FzLockManager:
+    return FzLockManager(event).addOrders([orderCode]).addPayments([
+        OrderPayment.PAYMENT_STATE_CONFIRMED,
+        OrderPayment.PAYMENT_STATE_CREATED,
+        OrderPayment.PAYMENT_STATE_PENDING
+    ]).addRefunds([
+        OrderRefund.REFUND_STATE_CREATED,
+        OrderRefund.REFUND_STATE_TRANSIT
+    ])
+
+
+# A transfer copies the positions of the source order into a new one, adds the membership card to it and cancels the
+# source order. The quotas involved are the ones of the copied items and variations and of the membership card items,
+# the seats are the ones of the source positions. Source positions are read without locking to find them, then quotas
+# and seats get an exclusive lock and the event a shared one. This has to happen before the rows are locked and it
+# must cover everything pretix locks later on its own (OrderCreateSerializer, OCM commit, payment confirm), so that
+# those calls only take locks we already hold. Returns what has been read, to be checked by
+# verifyTransferredPositions() once the source order is row locked
+def lockTransferredQuotasAndSeats(event: Event, orderCodes: List[str], membershipCardItemIds: List[int]) -> Dict[str, Dict[int, tuple]]:
+    readPositions = {code: {} for code in orderCodes}
+    for pk, code, itemId, variationId, seatId in readTransferredPositions(event, orderCodes):
+        readPositions[code][pk] = (itemId, variationId, seatId)
+    positions = [p for positions in readPositions.values() for p in positions.values()]
+    itemIds = {p[0] for p in positions} | set(membershipCardItemIds)
+    variationIds = {p[1] for p in positions if p[1] is not None}
+    seatIds = {p[2] for p in positions if p[2] is not None}
+
+    if seatIds and event.settings.seating_minimal_distance > 0:
+        # Same as pretix: no fine grained locking with seating distance enforcement
+        lock_objects([event])
+        return readPositions
+
+    # Superset of the involved quotas, locking a few more of them is harmless
+    quotas = list(
+        Quota.objects.filter(event=event, size__isnull=False)
+        .filter(Q(items__in=itemIds) | Q(variations__in=variationIds))
+        .distinct()
+    )
+    seats = list(Seat.objects.filter(pk__in=seatIds)) if seatIds else []
+    lock_objects(quotas + seats, shared_lock_objects=[event])
+    return readPositions
+
+
+def readTransferredPositions(event: Event, orderCodes: List[str]):
+    return OrderPosition.objects.filter(order__event=event, order__code__in=orderCodes).values_list(
+        "pk", "order__code", "item_id", "variation_id", "seat_id"
+    )
+
+
+# Positions may have been changed between the unlocked read and the row lock, in which case we may hold the wrong locks
+def verifyTransferredPositions(readPositions: Dict[str, Dict[int, tuple]], sourceOrder: Order):
+    lockedPositions = {
+        pk: (itemId, variationId, seatId)
+        for pk, _, itemId, variationId, seatId in readTransferredPositions(sourceOrder.event, [sourceOrder.code])
+    }
+    if readPositions.get(sourceOrder.code, {}) != lockedPositions:
+        logger.error(f"ApiTransferOrder [{sourceOrder.code}]: Positions changed while acquiring locks")
+        raise FzException("", extraData={"error": f'Order {sourceOrder.code} changed while acquiring locks, retry'},
+                          code=status.HTTP_409_CONFLICT)
+
+
+# Returns the confirmed payments of the source order, which are going to be marked as refunded. Fails if the order
+# has payments or refunds that are still in progress
+def loadTransferPayments(sourceOrder: Order, locks: FzLockManager) -> List[OrderPayment]:
+    payments: List[OrderPayment] = locks.paymentsOf(sourceOrder)
+    for payment in payments:
+        if payment.state != OrderPayment.PAYMENT_STATE_CONFIRMED:
+            logger.error(
+                f"ApiTransferOrder [{sourceOrder.code}]: Payment {payment.full_id}: invalid state {payment.state}"
+            )
+            raise FzException("", extraData={"error": f'Payment {payment.full_id} is in invalid state {payment.state}'},
+                              code=STATUS_CODE_PAYMENT_INVALID)
+    for refund in locks.refundsOf(sourceOrder):
+        logger.error(
+            f"ApiTransferOrder [{sourceOrder.code}]: Refund {refund.full_id}: invalid state {refund.state}"
+        )
+        raise FzException("", extraData={"error": f'Refund {refund.full_id} is in invalid state {refund.state}'},
+                          code=STATUS_CODE_REFUND_INVALID)
+
+    return payments
+
+
+# Builds the OrderCreateSerializer payload of the new order. Used both by the real transfer and by the dry run,
+# so the caller decides whether sourceOrder is locked or not
+def buildTransferOrderData(sourceOrder: Order, data):
+    membershipCardItemIds = data["membershipCardItemIds"]
+    membershipCardAddonToPositionId = data.get("membershipCardAddonToPositionId", None)
+    userIdQuestionId = data["userIdQuestionId"]
+    newUserId = data["newUserId"]
+    newEmail = data["newEmail"]
+    name = data.get("name", None)
+    street = data.get("street", None)
+    zipcode = data.get("zipcode", None)
+    city = data.get("city", None)
+    country = data.get("country", None)
+    state = data.get("state", None)
+    paymentComment = data.get("manualPaymentComment", None)
+
+    sourcePositions = loadSourcePositions(sourceOrder)
+    sourceFees = sourceOrder.fees.all()
+
+    # Copy positions and answers
+
+    # First copy run
+    basePositions, positionIdToAddons, membershipCardTotalAmount = copySourcePositions(
+        sourcePositions, membershipCardItemIds, userIdQuestionId, newUserId
+    )
+    # Adjust positionid and positions
+    newPositions, membershipCardAddonToNewPositionId = renumberTransferPositions(
+        basePositions, positionIdToAddons, membershipCardAddonToPositionId
+    )
+
+    newFees = []
+    fee: OrderFee
+    for fee in sourceFees:
+        newFee = {
+            "fee_type": fee.fee_type,
+            "value": fee.value,
+            "internal_type": fee.internal_type,
+            "tax_rule": fee.tax_rule_id,
+            "description": fee.description,
+        }
+        newFees.append(newFee)
+
+    # CREATE NEW ORDER
+    orderData = {
+        "status": "p",  # paid
+        "email": newEmail,
+        "invoice_address": {
+            "name": name,
+            "street": street,
+            "zipcode": zipcode,
+            "city": city,
+            "country": country,
+            "state": state
+        },
+        "force": True,
+        "send_email": False,
+        "positions": newPositions,
+        "fees": newFees,
+        "payment_provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER,
+        "payment_info": {
+            "issued_by": FZ_MANUAL_PAYMENT_PROVIDER_ISSUER,
+            "comment": paymentComment
+        },
+        "testmode": sourceOrder.testmode,
+    }
+
+    return orderData, membershipCardTotalAmount, membershipCardAddonToNewPositionId
+
+
+# Prefetch plan for the source order of a transfer. Answers, their question, their options and the seat are
+# fetched together with the positions, so copySourcePositions() runs a fixed number of queries
+def loadSourcePositions(order: Order):
+    return order.positions.select_related("seat").prefetch_related(
+        Prefetch(
+            "answers",
+            queryset=QuestionAnswer.objects.select_related("question").prefetch_related("options"),
+        )
+    )
+
+
+# Converts the source positions into OrderCreateSerializer position dicts. Membership cards are skipped and
+# their price summed up. Addons are grouped by the original id of the position they are attached to
+def copySourcePositions(sourcePositions, membershipCardItemIds: List[int], userIdQuestionId: int, newUserId: int):
+    membershipCardTotalAmount = 0
+    basePositions = []
+    positionIdToAddons = {}
+    position: OrderPosition
+    for position in sourcePositions:
+        if position.canceled:
+            # Don't copy canceled positions
+            continue
+
+        if (position.item_id in membershipCardItemIds):
+            # We save how much the membership cards
+            membershipCardTotalAmount += position.price
+            continue  # Skip copying membership cards
+
+        answers = position.answers.all()
+        newAnswers = []
+        answer: QuestionAnswer
+        for answer in answers:
+            opts = answer.options.all()
+            newAnswer = {
+                "question": answer.question_id,
+                "answer": answer.answer,
+                "options": [option.identifier for option in opts] if (answer.options and len(opts) > 0) else []
+            }
+            if (answer.question_id == userIdQuestionId):
+                if answer.question.type != Question.TYPE_NUMBER:
+                    raise FzException("", extraData={"error": f'Question {userIdQuestionId} is not of type number'}, code=status.HTTP_400_BAD_REQUEST)
+                newAnswer["answer"] = str(serializers.DecimalField(max_digits=50, decimal_places=1).to_internal_value(newUserId))
+                newAnswer["options"] = []
+            newAnswers.append(newAnswer)
+
+        addon = position.addon_to_id
+        newPos = {
+            "positionid": position.id,  # Needs to be updated later
+            "item": position.item_id,
+            "variation": position.variation_id,
+            "price": position.price,
+            "seat": position.seat.seat_guid if position.seat else None,
+            "attendee_name": position.attendee_name,
+            # "voucher": position.voucher.id if position.voucher else None,
+            "attendee_email": position.attendee_email,
+            "company": position.company,
+            "street": position.street,
+            "zipcode": position.zipcode,
+            "city": position.city,
+            "country": position.country,
+            "state": position.state,
+            # "secret": position.secret,
+            "subevent": position.subevent_id,
+            "valid_from": position.valid_from,
+            "valid_until": position.valid_until,
+            "discount": position.discount_id,
+            "answers": newAnswers,
+        }
+
+        if (addon is None):
+            basePositions.append(newPos)
+        else:
+            if addon not in positionIdToAddons:
+                addons = []
+                positionIdToAddons[addon] = addons
+            else:
+                addons = positionIdToAddons[addon]
+            addons.append(newPos)
+
+    return basePositions, positionIdToAddons, membershipCardTotalAmount
@@ -1 +1,205 @@
 # put your pytest fixtures here
+import datetime
+import pytest
+from decimal import Decimal
+from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import (
+    Event,
+    Item,
+    Order,
+    OrderPayment,
+    OrderPosition,
+    Organizer,
+    Question,
+    QuestionAnswer,
+    Quota,
+    Team,
+)
+from rest_framework.test import APIClient
+
+
+@pytest.fixture
+def organizer():
+    with scopes_disabled():
+        return Organizer.objects.create(name="Furizon", slug="furizon")
+
+
+@pytest.fixture
+def event(organizer):
+    with scopes_disabled():
+        return Event.objects.create(
+            organizer=organizer,
+            name="Furizon",
+            slug="fz",
+            date_from=now(),
+            plugins="pretix_fzbackend_utils",
+            live=True,
+        )
+
+
+@pytest.fixture
+def items(event):
+    with scopes_disabled():
+        return {
+            "ticket": Item.objects.create(
+                event=event, name="Ticket", default_price=Decimal("100.00")
+            ),
+            "room": Item.objects.create(
+                event=event, name="Room", default_price=Decimal("50.00")
+            ),
+            "card": Item.objects.create(
+                event=event, name="Membership card", default_price=Decimal("10.00")
+            ),
+        }
+
+
+@pytest.fixture
+def questions(event):
+    with scopes_disabled():
+        userId = Question.objects.create(
+            event=event, question="User id", type=Question.TYPE_NUMBER, required=False
+        )
+        return {"userId": userId}
+
+
+@pytest.fixture
+def order(event):
+    with scopes_disabled():
+        return Order.objects.create(
+            event=event,
+            code="FZ001",
+            email="fz@example.org",
+            status=Order.STATUS_PAID,
+            total=Decimal("0.00"),
+            datetime=now(),
+            expires=now() + datetime.timedelta(days=10),
+            locale="en",
+            sales_channel=event.organizer.sales_channels.get(identifier="web"),
+        )
+
+
+@pytest.fixture
+def quota(event, items):
+    with scopes_disabled():
+        quota = Quota.objects.create(event=event, name="All", size=None)
+        quota.items.add(*items.values())
+        return quota
+
+
+# Working cache for the tests that need one, the test settings use a dummy cache
+@pytest.fixture
+def locmemCache():
+    with override_settings(
+        CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+    ):
+        yield
+
+
+# Api client authenticated with a team token with all permissions
+@pytest.fixture
+def apiClient(organizer):
+    with scopes_disabled():
+        team = Team.objects.create(
+            organizer=organizer,
+            all_events=True,
+            all_event_permissions=True,
+            all_organizer_permissions=True,
+        )
+        token = team.tokens.create(name="fz-backend")
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {token.token}")
+    return client
+
+
+@pytest.fixture
+def apiUrl(organizer, event):
+    return lambda name: f"/{organizer.slug}/{event.slug}/fzbackendutils/api/{name}/"
+
+
+# Replaces lock_objects() in the given module with a stub that records its calls in the returned list, shared by all
+# the modules stubbed in the same test. Each call is recorded as label, or as (objects, shared_lock_objects) if no
+# label is given
+@pytest.fixture
+def stubLockObjects(monkeypatch):
+    calls = []
+
+    def stub(module, label=None):
+        monkeypatch.setattr(
+            module,
+            "lock_objects",
+            lambda objects, shared_lock_objects=None: calls.append(
+                label if label is not None else (objects, shared_lock_objects)
+            ),
+        )
+        return calls
+
+    return stub
+
+
+# Creates an order with a ticket root position, the given room addons and optionally a membership card addon.
+# Paid orders get a confirmed payment of the whole total. Returns (order, root position, room positions)
+@pytest.fixture
+def makeOrder(event, items, questions):
+    def make(
+        code,
+        rooms=(),
+        card=False,
+        status=Order.STATUS_PAID,
+        email="fz@example.org",
+        orderEvent=None,
+    ):
+        with scopes_disabled():
+            total = items["ticket"].default_price + sum(r.default_price for r in rooms)
+            total += items["card"].default_price if card else 0
+            orderEvent = orderEvent or event
+            order = Order.objects.create(
+                event=orderEvent,
+                code=code,
+                email=email,
+                status=status,
+                total=total,
+                datetime=now(),
+                expires=now() + datetime.timedelta(days=10),
+                locale="en",
+                sales_channel=orderEvent.organizer.sales_channels.get(identifier="web"),
+            )
+            root = OrderPosition.objects.create(
+                order=order,
+                item=items["ticket"],
+                price=items["ticket"].default_price,
+                positionid=1,
+                attendee_name_parts={"_scheme": "full", "full_name": "Pippo"},
+            )
+            QuestionAnswer.objects.create(
+                orderposition=root, question=questions["userId"], answer="1"
+            )
+            roomPositions = [
+                OrderPosition.objects.create(
+                    order=order,
+                    item=r,
+                    price=r.default_price,
+                    positionid=i + 2,
+                    addon_to=root,
+                )
+                for i, r in enumerate(rooms)
+            ]
+            if card:
+                OrderPosition.objects.create(
+                    order=order,
+                    item=items["card"],
+                    price=items["card"].default_price,
+                    positionid=len(rooms) + 2,
+                    addon_to=root,
+                )
+            if status == Order.STATUS_PAID:
+                order.payments.create(
+                    amount=total,
+                    state=OrderPayment.PAYMENT_STATE_CONFIRMED,
+                    provider="manual",
+                    payment_date=now(),
+                )
+            return order, root, roomPositions
+
+    return make
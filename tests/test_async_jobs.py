@@ -0,0 +1,113 @@
+import datetime
+import pytest
+import uuid
+from django.test import override_settings
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.base.models import Event
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import (
+    ASYNC_JOB_STATE_DONE,
+    ASYNC_JOB_STATE_PENDING,
+    evictExpiredAsyncJobs,
+    jobStatusData,
+)
+from pretix_fzbackend_utils.models import FzAsyncJob
+from pretix_fzbackend_utils.views import jobs
+
+
+class FakeAsyncResult:
+    def __init__(self, state="PENDING", info=None):
+        self.id = str(uuid.uuid4())
+        self.state = state
+        self.info = info
+
+    def ready(self):
+        return self.state == "SUCCESS"
+
+    def successful(self):
+        return self.state == "SUCCESS"
+
+
+@pytest.mark.django_db
+def test_async_request_is_accepted(event, items, apiClient, apiUrl):
+    # Without a broker the job runs eagerly and is already done
+    response = apiClient.post(
+        apiUrl("convert-ticket-only-order") + "?async=1",
+        {
+            "orderCode": "MISSING",
+            "rootPositionId": 1,
+            "newRootItemId": items["room"].pk,
+        },
+        format="json",
+    )
+
+    assert response.status_code == 202
+    data = response.json()
+    assert FzAsyncJob.objects.filter(
+        event=event, job_id=data["jobId"], operation="convert-ticket-only-order"
+    ).exists()
+    assert (data["state"], data["status"]) == ("failed", 404)
+
+
+@pytest.mark.django_db
+@override_settings(HAS_CELERY=True)
+def test_job_status(event, apiClient, apiUrl, monkeypatch):
+    results = {}
+    monkeypatch.setattr(
+        jobs, "AsyncResult", lambda jobId: results.get(jobId, FakeAsyncResult())
+    )
+    with scopes_disabled():
+        otherEvent = Event.objects.create(
+            organizer=event.organizer, name="Other", slug="other", date_from=now()
+        )
+    pendingId, doneId, otherId = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    FzAsyncJob.objects.create(event=event, job_id=pendingId, operation="transfer-order")
+    FzAsyncJob.objects.create(event=event, job_id=doneId, operation="transfer-order")
+    FzAsyncJob.objects.create(
+        event=otherEvent, job_id=otherId, operation="transfer-order"
+    )
+    results[str(doneId)] = FakeAsyncResult(
+        "SUCCESS", {"event": event.pk, "status": 200, "result": {"newOrderCode": "X"}}
+    )
+    results[str(otherId)] = FakeAsyncResult(
+        "SUCCESS", {"event": otherEvent.pk, "status": 200, "result": None}
+    )
+
+    response = apiClient.get(apiUrl(f"jobs/{pendingId}"))
+    assert (response.status_code, response.json()["state"]) == (
+        200,
+        ASYNC_JOB_STATE_PENDING,
+    )
+    response = apiClient.get(apiUrl(f"jobs/{doneId}"))
+    assert response.status_code == 200
+    assert (response.json()["state"], response.json()["result"]) == (
+        ASYNC_JOB_STATE_DONE,
+        {"newOrderCode": "X"},
+    )
+    # Unknown ids and jobs of other events are not found, instead of pending forever
+    assert apiClient.get(apiUrl(f"jobs/{uuid.uuid4()}")).status_code == 404
+    assert apiClient.get(apiUrl(f"jobs/{otherId}")).status_code == 404
+
+    # Expired jobs are not found either, and get evicted
+    FzAsyncJob.objects.filter(job_id=pendingId).update(
+        created=now() - datetime.timedelta(days=2)
+    )
+    assert apiClient.get(apiUrl(f"jobs/{pendingId}")).status_code == 404
+    evictExpiredAsyncJobs()
+    assert FzAsyncJob.objects.count() == 2
+
+
+def test_job_status_data_of_other_event():
+    assert (
+        jobStatusData(
+            FakeAsyncResult("SUCCESS", {"event": 2, "status": 200, "result": None}), 1
+        )
+        is None
+    )
+    assert (
+        jobStatusData(
+            FakeAsyncResult("SUCCESS", {"event": 1, "status": 461, "result": None}), 1
+        )["state"]
+        == "failed"
+    )
@@ -0,0 +1,58 @@
+import io
+import json
+import pytest
+from decimal import Decimal
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPosition
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import FzTaskRequest
+from pretix_fzbackend_utils.views import bulk
+from pretix_fzbackend_utils.views.bulk import readLines, runBulkStream
+
+
+@pytest.mark.django_db
+def test_bulk_stream(event, order, items, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_MAX_LINE_BYTES", 200)
+    with scopes_disabled():
+        position = OrderPosition.objects.create(
+            order=order, item=items["ticket"], price=Decimal("0.00"), positionid=1
+        )
+    body = b"\n".join(
+        [
+            json.dumps(
+                {
+                    "op": "set-item-bundle",
+                    "id": "a",
+                    "data": {"position": position.pk, "is_bundle": True},
+                }
+            ).encode(),
+            b"",
+            b"{not json",
+            json.dumps({"op": "bulk", "id": "b", "data": {}}).encode(),
+            b'{"op": "set-item-bundle", "data": {"position": 1, "is_bundle": true}, "pad": "'
+            + b"x" * 500
+            + b'"}',
+            json.dumps(
+                {
+                    "op": "set-item-bundle",
+                    "id": "c",
+                    "data": [{"position": 999999, "is_bundle": False}],
+                }
+            ).encode(),
+        ]
+    )
+
+    stream = runBulkStream(FzTaskRequest(event, None), readLines(io.BytesIO(body)))
+    results = [json.loads(line) for line in stream]
+
+    assert [(r["line"], r["id"], r["status"]) for r in results] == [
+        (1, "a", 200),
+        (3, None, 400),
+        (4, "b", 400),
+        (5, None, 413),
+        (6, "c", 200),
+    ]
+    assert results[4]["result"] == {"updated": 0, "missing": [999999]}
+    with scopes_disabled():
+        position.refresh_from_db()
+        assert position.is_bundled
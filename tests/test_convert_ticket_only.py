@@ -0,0 +1,192 @@
+import pytest
+from decimal import Decimal
+from django.db import transaction
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPosition, Quota, Seat
+from pretix.base.services import orders
+from pretix.base.services.locking import LockTimeoutException
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import FzTaskRequest
+from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzLockManager import FzLockManager
+from pretix_fzbackend_utils.views import convert_ticket_only
+from pretix_fzbackend_utils.views.convert_ticket_only import (
+    convertChunk,
+    convertTicketOnlyOrder,
+    lockConvertedQuotasAndSeats,
+    validateConvertData,
+    verifyConvertedPosition,
+)
+
+
+@pytest.mark.django_db
+def test_convert_chunk_locks_once(event, items, makeOrder, stubLockObjects):
+    locks = stubLockObjects(convert_ticket_only)
+    order, root, _ = makeOrder("FZ001")
+    other, otherRoot, _ = makeOrder("FZ002")
+    roots = [root, otherRoot]
+    with scopes_disabled():
+        Quota.objects.create(event=event, name="Tickets", size=100).items.add(
+            items["ticket"]
+        )
+        roomQuota = Quota.objects.create(event=event, name="Rooms", size=100)
+        roomQuota.items.add(items["room"])
+        conversions = [
+            {
+                "orderCode": order.code,
+                "rootPositionId": roots[0].pk,
+                "newRootItemId": items["room"].pk,
+            },
+            {
+                "orderCode": "MISSING",
+                "rootPositionId": roots[1].pk,
+                "newRootItemId": items["room"].pk,
+            },
+            {
+                "orderCode": other.code,
+                "rootPositionId": roots[1].pk,
+                "newRootItemId": items["room"].pk,
+            },
+        ]
+        results = [None] * len(conversions)
+        with transaction.atomic():
+            convertChunk(FzTaskRequest(event, {}), conversions, [0, 1, 2], results)
+
+        # Only the quota of the new item, the ticket is swapped with its copy
+        assert locks == [([roomQuota], [event])]
+        assert [r["status"] for r in results] == [200, 404, 200]
+        for root, result in zip(roots, [results[0], results[2]]):
+            root.refresh_from_db()
+            assert (root.item_id, root.price) == (items["room"].pk, Decimal("0.00"))
+            newPosition = OrderPosition.objects.get(pk=result["newPositionId"])
+            assert (
+                newPosition.item_id,
+                newPosition.addon_to_id,
+                newPosition.is_bundled,
+            ) == (items["ticket"].pk, root.pk, True)
+
+
+# A chunk that cannot take its locks is reported as a whole, the following chunks are still committed
+@pytest.mark.django_db
+def test_convert_orders_chunk_lock_timeout(
+    event, items, makeOrder, apiClient, apiUrl, monkeypatch
+):
+    order, root, _ = makeOrder("FZ001")
+    other, otherRoot, _ = makeOrder("FZ002")
+    with scopes_disabled():
+        for item in (items["ticket"], items["room"]):
+            Quota.objects.create(event=event, name=item.name, size=100).items.add(item)
+    timedOut = []
+
+    def lockOrTimeout(objects, shared_lock_objects=None):
+        if not timedOut:
+            timedOut.append(objects)
+            raise LockTimeoutException()
+
+    monkeypatch.setattr(convert_ticket_only, "lock_objects", lockOrTimeout)
+    conversions = [
+        {
+            "orderCode": code,
+            "rootPositionId": position.pk,
+            "newRootItemId": items["room"].pk,
+        }
+        for code, position in ((order.code, root), (other.code, otherRoot))
+    ]
+
+    response = apiClient.post(
+        apiUrl("convert-ticket-only-orders"),
+        {"conversions": conversions, "chunkSize": 1},
+        format="json",
+    )
+
+    assert response.status_code == 200, response.content
+    results = response.json()["results"]
+    assert [(r["orderCode"], r["status"]) for r in results] == [
+        ("FZ001", 409),
+        ("FZ002", 200),
+    ]
+    with scopes_disabled():
+        root.refresh_from_db()
+        otherRoot.refresh_from_db()
+        assert root.item_id == items["ticket"].pk
+        assert otherRoot.item_id == items["room"].pk
+
+
+@pytest.mark.django_db
+def test_convert_locks_kept_seat(event, order, items, stubLockObjects):
+    locks = stubLockObjects(convert_ticket_only)
+    with scopes_disabled():
+        Quota.objects.create(event=event, name="Tickets", size=100).items.add(
+            items["ticket"]
+        )
+        seat = Seat.objects.create(
+            event=event, seat_guid="A1", row_name="A", seat_number="1"
+        )
+        root = OrderPosition.objects.create(
+            order=order,
+            item=items["ticket"],
+            price=Decimal("100.00"),
+            positionid=1,
+            seat=seat,
+        )
+
+        readPositions = lockConvertedQuotasAndSeats(
+            event, [root.pk], [items["room"].pk], [None]
+        )
+
+        assert locks == [([seat], [event])]
+        verifyConvertedPosition(readPositions, root)
+        root.seat = None
+        with pytest.raises(FzException) as e:
+            verifyConvertedPosition(readPositions, root)
+        assert e.value.code == 409
+
+
+@pytest.mark.django_db
+def test_convert_locks_quotas_before_rows(
+    event, order, items, monkeypatch, stubLockObjects
+):
+    calls = stubLockObjects(convert_ticket_only, "quotas")
+    stubLockObjects(orders, "ocm")
+    lock = FzLockManager.lock
+    monkeypatch.setattr(
+        FzLockManager, "lock", lambda self: calls.append("rows") or lock(self)
+    )
+    with scopes_disabled():
+        Quota.objects.create(event=event, name="All", size=100).items.add(
+            items["ticket"], items["room"]
+        )
+        root = OrderPosition.objects.create(
+            order=order, item=items["ticket"], price=Decimal("100.00"), positionid=1
+        )
+        with transaction.atomic():
+            convertTicketOnlyOrder(
+                FzTaskRequest(event, {}), order.code, root.pk, items["room"].pk, None
+            )
+
+    # The OCM does not lock anything on its own
+    assert calls == ["quotas", "rows"]
+
+
+def test_validate_convert_data():
+    assert (
+        validateConvertData(
+            {"orderCode": "FZ001", "rootPositionId": 1, "newRootItemId": 2}
+        )
+        is None
+    )
+    assert (
+        validateConvertData(
+            {
+                "orderCode": "FZ001",
+                "rootPositionId": 1,
+                "newRootItemId": 2,
+                "newRootItemVariationId": "3",
+            }
+        )
+        == 'Invalid parameter "newRootItemVariationId"'
+    )
+    assert (
+        validateConvertData({"rootPositionId": 1, "newRootItemId": 2})
+        == 'Missing or invalid parameter "orderCode"'
+    )
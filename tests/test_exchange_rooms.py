@@ -0,0 +1,718 @@
+import pytest
+from decimal import Decimal
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import (
+    Item,
+    ItemBundle,
+    LogEntry,
+    Order,
+    OrderPayment,
+    OrderPosition,
+    OrderRefund,
+    Quota,
+    Seat,
+)
+from pretix.base.services.locking import LockTimeoutException
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import FzTaskRequest
+from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzPriceTable import itemPriceTable
+from pretix_fzbackend_utils.payment import FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER
+from pretix_fzbackend_utils.utils import (
+    STATUS_CODE_PAYMENT_INVALID,
+    STATUS_CODE_REFUND_INVALID,
+)
+from pretix_fzbackend_utils.views import exchange_rooms
+from pretix_fzbackend_utils.views.exchange_rooms import (
+    EXCHANGE_MODE_MOVE,
+    SideData,
+    SideInstance,
+    exchangeCycle,
+    exchangeLocks,
+    lockExchangedQuotasAndSeats,
+    quoteCycle,
+    validateCycleData,
+    verifyLockedPositions,
+    verifyLockedSeats,
+    verifyPaymentsRefundsStatus,
+)
+
+
+def sideQueries(event, order, positions):
+    data = SideData(order.code, positions[0].pk, [p.pk for p in positions] + [None])
+    with transaction.atomic(), CaptureQueriesContext(connection) as ctx:
+        side = SideInstance(
+            data, FzTaskRequest(event, {}), exchangeLocks(event, [data]).lock()
+        )
+    return len(ctx.captured_queries), side
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("locmemCache")
+def test_side_instance_query_count_is_constant(event, order, items):
+    with scopes_disabled():
+        ItemBundle.objects.create(
+            base_item=items["room"],
+            bundled_item=items["card"],
+            designated_price=Decimal("5.00"),
+            count=1,
+        )
+        itemPriceTable(event.pk)
+        root = OrderPosition.objects.create(
+            order=order, item=items["ticket"], price=Decimal("100.00"), positionid=1
+        )
+        rooms = [
+            OrderPosition.objects.create(
+                order=order,
+                item=items["room"],
+                price=Decimal("50.00"),
+                positionid=i + 2,
+                addon_to=root,
+            )
+            for i in range(5)
+        ]
+
+        smallCount, _ = sideQueries(event, order, [root])
+        bigCount, side = sideQueries(event, order, [root] + rooms)
+
+    # order, positions (+ item, variation, subevent, seat). Prices come from the cached price table
+    assert smallCount == bigCount == 2
+    assert side.rootPosition.pk == root.pk
+    assert side.instance(0).price == Decimal("100.00")
+    assert [side.instance(i).price for i in range(1, 6)] == [Decimal("45.00")] * 5
+    assert side.instance(6) is None
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("locmemCache")
+def test_item_price_table_is_invalidated(event, items):
+    with scopes_disabled():
+        room = items["room"]
+        variation = room.variations.create(
+            value="Double", default_price=Decimal("70.00")
+        )
+        bundle = ItemBundle.objects.create(
+            base_item=room,
+            bundled_item=items["card"],
+            designated_price=Decimal("5.00"),
+            count=1,
+        )
+
+        table = itemPriceTable(event.pk)
+        assert table[(room.pk, None)] == Decimal("45.00")
+        assert table[(room.pk, variation.pk)] == Decimal("65.00")
+        with CaptureQueriesContext(connection) as ctx:
+            itemPriceTable(event.pk)
+        assert len(ctx.captured_queries) == 0
+
+        room.default_price = Decimal("60.00")
+        room.save()
+        assert itemPriceTable(event.pk)[(room.pk, None)] == Decimal("55.00")
+
+        variation.default_price = None
+        variation.save()
+        assert itemPriceTable(event.pk)[(room.pk, variation.pk)] == Decimal("55.00")
+
+        bundle.delete()
+        assert itemPriceTable(event.pk)[(room.pk, None)] == Decimal("60.00")
+
+
+def singlePositionSide(event, order, position):
+    data = SideData(order.code, position.pk, [position.pk])
+    return SideInstance(
+        data, FzTaskRequest(event, {}), exchangeLocks(event, [data]).lock()
+    )
+
+
+@pytest.mark.django_db
+def test_fine_grained_locking_locks_only_involved_quotas(
+    event, order, items, stubLockObjects
+):
+    locks = stubLockObjects(exchange_rooms)
+    with scopes_disabled():
+        roomQuota = Quota.objects.create(event=event, name="Rooms", size=10)
+        roomQuota.items.add(items["room"])
+        Quota.objects.create(event=event, name="Unlimited rooms", size=None).items.add(
+            items["room"]
+        )
+        Quota.objects.create(event=event, name="Tickets", size=10).items.add(
+            items["ticket"]
+        )
+        # Not exchanged: its quota is not locked, its seat is (the payment confirmation checks every seat)
+        seat = Seat.objects.create(
+            event=event, seat_guid="A1", row_name="A", seat_number="1"
+        )
+        root = OrderPosition.objects.create(
+            order=order,
+            item=items["ticket"],
+            price=Decimal("100.00"),
+            positionid=1,
+            seat=seat,
+        )
+        room = OrderPosition.objects.create(
+            order=order,
+            item=items["room"],
+            price=Decimal("50.00"),
+            positionid=2,
+            addon_to=root,
+        )
+
+        lockedPositions = lockExchangedQuotasAndSeats(
+            event, [order.code], [room.pk, None]
+        )
+
+        assert locks == [([roomQuota, seat], [event])]
+        verifyLockedSeats(lockedPositions, [order])
+        verifyLockedPositions(
+            lockedPositions, singlePositionSide(event, order, room).instances
+        )
+
+        room.item = items["card"]
+        room.save()
+        with pytest.raises(FzException) as e:
+            verifyLockedPositions(
+                lockedPositions, singlePositionSide(event, order, room).instances
+            )
+        assert e.value.code == 409
+
+        root.seat = Seat.objects.create(
+            event=event, seat_guid="A2", row_name="A", seat_number="2"
+        )
+        root.save()
+        with pytest.raises(FzException) as e:
+            verifyLockedSeats(lockedPositions, [order])
+        assert e.value.code == 409
+
+
+@pytest.mark.django_db
+def test_verify_payments_refunds_status_single_query(event, order, makeOrder):
+    other, _, _ = makeOrder("FZ0001")
+    with scopes_disabled():
+        order.payments.create(
+            amount=Decimal("10.00"),
+            state=OrderPayment.PAYMENT_STATE_CONFIRMED,
+            provider="manual",
+        )
+        other.refunds.create(
+            amount=Decimal("10.00"),
+            state=OrderRefund.REFUND_STATE_DONE,
+            provider="manual",
+            source=OrderRefund.REFUND_SOURCE_ADMIN,
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            verifyPaymentsRefundsStatus([order, other])
+        assert len(ctx.captured_queries) == 1
+
+        order.payments.create(
+            amount=Decimal("10.00"),
+            state=OrderPayment.PAYMENT_STATE_PENDING,
+            provider="manual",
+        )
+        other.refunds.create(
+            amount=Decimal("10.00"),
+            state=OrderRefund.REFUND_STATE_TRANSIT,
+            provider="manual",
+            source=OrderRefund.REFUND_SOURCE_ADMIN,
+        )
+        # Longer codes are locked (and checked) first
+        with pytest.raises(FzException) as e:
+            verifyPaymentsRefundsStatus([order, other])
+        assert e.value.code == STATUS_CODE_REFUND_INVALID
+        assert e.value.extraData == {
+            "error": "Refund FZ0001-R-2 is in invalid state transit"
+        }
+        with pytest.raises(FzException) as e:
+            verifyPaymentsRefundsStatus([order])
+        assert e.value.code == STATUS_CODE_PAYMENT_INVALID
+        assert e.value.extraData == {
+            "error": "Payment FZ001-P-2 is in invalid state pending"
+        }
+
+
+@pytest.mark.django_db
+def test_quote_cycle_takes_no_locks(event, items, makeOrder):
+    order, root, (room,) = makeOrder("FZ001", rooms=[items["room"]])
+    other, otherRoot, _ = makeOrder("FZ002", card=True)
+    with scopes_disabled():
+        card = other.positions.get(item=items["card"])
+        sides = [
+            SideData(order.code, root.pk, [room.pk, None]),
+            SideData(other.code, otherRoot.pk, [None, card.pk]),
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            quote = quoteCycle(FzTaskRequest(event, {}), sides, [1, 0])
+
+    assert not any("FOR UPDATE" in q["sql"] for q in ctx.captured_queries)
+    assert [
+        (side["orderCode"], side["balance"], side["settlement"]) for side in quote
+    ] == [
+        (order.code, Decimal("-40.00"), "refund"),
+        (other.code, Decimal("40.00"), "payment"),
+    ]
+    assert [op["operation"] for op in quote[0]["operations"]] == ["cancel", "add"]
+    assert quote[0]["operations"][1]["sourcePositionId"] == card.pk
+
+
+@pytest.mark.django_db
+def test_move_mode_reassigns_positions(event, items, questions, makeOrder):
+    order, root, (room,) = makeOrder("FZ001", rooms=[items["room"]])
+    other, otherRoot, (otherRoom,) = makeOrder(
+        "FZ002", rooms=[items["room"]], card=True
+    )
+    with scopes_disabled():
+        room.attendee_email = "a@example.org"
+        room.save()
+        room.answers.create(question=questions["userId"], answer="42")
+        card = other.positions.get(item=items["card"])
+
+        # Roots cannot be moved
+        sides = [
+            SideData(order.code, root.pk, [root.pk]),
+            SideData(other.code, otherRoot.pk, [otherRoom.pk]),
+        ]
+        with pytest.raises(FzException):
+            exchangeCycle(
+                FzTaskRequest(event, {}),
+                sides,
+                [1, 0],
+                None,
+                None,
+                mode=EXCHANGE_MODE_MOVE,
+            )
+
+        sides = [
+            SideData(order.code, root.pk, [room.pk, None]),
+            SideData(other.code, otherRoot.pk, [otherRoom.pk, card.pk]),
+        ]
+        with transaction.atomic():
+            exchangeCycle(
+                FzTaskRequest(event, {}),
+                sides,
+                [1, 0],
+                None,
+                None,
+                mode=EXCHANGE_MODE_MOVE,
+            )
+
+        room.refresh_from_db()
+        otherRoom.refresh_from_db()
+        card.refresh_from_db()
+        assert (room.order_id, room.addon_to_id, room.positionid) == (
+            other.pk,
+            otherRoot.pk,
+            4,
+        )
+        assert (otherRoom.order_id, otherRoom.addon_to_id, otherRoom.positionid) == (
+            order.pk,
+            root.pk,
+            3,
+        )
+        assert (card.order_id, card.addon_to_id, card.positionid) == (
+            order.pk,
+            root.pk,
+            4,
+        )
+        assert room.attendee_email == "a@example.org"
+        assert room.answers.get().answer == "42"
+        order.refresh_from_db()
+        other.refresh_from_db()
+        assert (order.total, other.total) == (Decimal("160.00"), Decimal("150.00"))
+        assert (
+            LogEntry.objects.filter(
+                action_type="pretix.plugins.fzbackendutils.positions.moved"
+            ).count()
+            == 2
+        )
+
+
+# Move mode takes no quota lock: it only accepts orders that count towards the quotas
+@pytest.mark.django_db
+def test_move_mode_order_status(event, items, makeOrder, stubLockObjects):
+    locks = stubLockObjects(exchange_rooms)
+    order, root, (room,) = makeOrder("FZ001", rooms=[items["room"]])
+    pending, pendingRoot, _ = makeOrder("FZ002", status=Order.STATUS_PENDING)
+    canceled, canceledRoot, _ = makeOrder("FZ003", status=Order.STATUS_CANCELED)
+
+    with scopes_disabled():
+        sides = [
+            SideData(order.code, root.pk, [room.pk]),
+            SideData(canceled.code, canceledRoot.pk, [None]),
+        ]
+        with pytest.raises(FzException) as e:
+            exchangeCycle(
+                FzTaskRequest(event, {}),
+                sides,
+                [1, 0],
+                None,
+                None,
+                mode=EXCHANGE_MODE_MOVE,
+            )
+        assert e.value.extraData == {"error": "Order FZ003 is in invalid status c"}
+
+        sides = [
+            SideData(order.code, root.pk, [room.pk]),
+            SideData(pending.code, pendingRoot.pk, [None]),
+        ]
+        with transaction.atomic():
+            exchangeCycle(
+                FzTaskRequest(event, {}),
+                sides,
+                [1, 0],
+                None,
+                None,
+                mode=EXCHANGE_MODE_MOVE,
+            )
+        room.refresh_from_db()
+        assert (room.order_id, room.addon_to_id) == (pending.pk, pendingRoot.pk)
+    assert locks == [([], [event]), ([], [event])]
+
+
+# The payment settling a balance is confirmed without locking: the seats of every position of the order, which pretix
+# would lock there, are locked upfront together with the shared event lock
+@pytest.mark.django_db
+def test_move_mode_locks_seats_before_rows(
+    event, items, makeOrder, monkeypatch, stubLockObjects
+):
+    locks = stubLockObjects(exchange_rooms)
+    order, root, (room,) = makeOrder("FZ001", rooms=[items["room"]])
+    other, otherRoot, _ = makeOrder("FZ002")
+    confirm = OrderPayment.confirm
+    confirmLocks = []
+    monkeypatch.setattr(
+        OrderPayment,
+        "confirm",
+        lambda self, **kwargs: confirmLocks.append(kwargs["lock"])
+        or confirm(self, **kwargs),
+    )
+    with scopes_disabled():
+        seat = Seat.objects.create(
+            event=event, seat_guid="A1", row_name="A", seat_number="1"
+        )
+        otherRoot.seat = seat
+        otherRoot.save()
+        sides = [
+            SideData(order.code, root.pk, [room.pk]),
+            SideData(other.code, otherRoot.pk, [None]),
+        ]
+        with transaction.atomic():
+            exchangeCycle(
+                FzTaskRequest(event, {}),
+                sides,
+                [1, 0],
+                None,
+                None,
+                mode=EXCHANGE_MODE_MOVE,
+            )
+    assert confirmLocks == [False]
+    assert locks == [([seat], [event])]
+
+
+@pytest.mark.django_db
+def test_move_mode_rejects_nested_addons(event, items, makeOrder):
+    order, root, (room,) = makeOrder("FZ001", rooms=[items["room"]])
+    other, otherRoot, _ = makeOrder("FZ002")
+    with scopes_disabled():
+        OrderPosition.objects.create(
+            order=order,
+            item=items["card"],
+            price=Decimal("10.00"),
+            positionid=3,
+            addon_to=room,
+        )
+
+        sides = [
+            SideData(order.code, root.pk, [room.pk]),
+            SideData(other.code, otherRoot.pk, [None]),
+        ]
+        with pytest.raises(FzException) as e:
+            exchangeCycle(
+                FzTaskRequest(event, {}),
+                sides,
+                [1, 0],
+                None,
+                None,
+                mode=EXCHANGE_MODE_MOVE,
+            )
+        assert e.value.extraData == {
+            "error": f"Position {room.pk} has addons of its own"
+        }
+
+
+def test_validate_cycle_data():
+    sides = [
+        {"orderCode": "AAAAA", "rootPositionId": 1, "positions": [2, None]},
+        {"orderCode": "BBBBB", "rootPositionId": 3, "positions": [4, 5]},
+        {"orderCode": "CCCCC", "rootPositionId": 6, "positions": [None, 7]},
+    ]
+    assert validateCycleData({"sides": sides, "permutation": [1, 2, 0]}) is None
+    assert validateCycleData({"sides": sides, "permutation": [2, 0, 1]}) is None
+    assert (
+        validateCycleData({"sides": sides, "permutation": [1, 0, 2]})
+        == "A side cannot receive its own positions"
+    )
+    assert (
+        validateCycleData({"sides": sides, "permutation": [1, 1, 0]})
+        == 'Missing or invalid parameter "permutation"'
+    )
+    assert (
+        validateCycleData({"sides": sides[:1], "permutation": [0]})
+        == 'Missing or invalid parameter "sides"'
+    )
+    assert (
+        validateCycleData(
+            {"sides": sides + [dict(sides[0])], "permutation": [1, 2, 3, 0]}
+        )
+        == 'Duplicated order in "sides"'
+    )
+    sides[2]["positions"] = [7]
+    assert (
+        validateCycleData({"sides": sides, "permutation": [1, 2, 0]})
+        == 'All the sides must have the same number of "positions"'
+    )
+
+
+def settlements(order):
+    payments = [
+        (p.provider, p.state, p.amount) for p in order.payments.order_by("local_id")
+    ]
+    refunds = [
+        (r.provider, r.state, r.amount) for r in order.refunds.order_by("local_id")
+    ]
+    return payments, refunds
+
+
+@pytest.mark.django_db
+def test_exchange_rooms_cycle(event, items, quota, makeOrder, apiClient, apiUrl):
+    with scopes_disabled():
+        suite = Item.objects.create(
+            event=event, name="Suite", default_price=Decimal("80.00")
+        )
+        quota.items.add(suite)
+    a, aRoot, (aRoom,) = makeOrder("AAAAA", rooms=[items["room"]])
+    b, bRoot, (bRoom,) = makeOrder("BBBB", rooms=[suite])
+    c, cRoot, _ = makeOrder("CCC")
+    sides = [
+        {"orderCode": a.code, "rootPositionId": aRoot.pk, "positions": [aRoom.pk]},
+        {"orderCode": b.code, "rootPositionId": bRoot.pk, "positions": [bRoom.pk]},
+        {"orderCode": c.code, "rootPositionId": cRoot.pk, "positions": [None]},
+    ]
+    # A takes B's suite, B takes C's (missing) room, C takes A's room
+    response = apiClient.post(
+        apiUrl("exchange-rooms-cycle"),
+        {"sides": sides, "permutation": [1, 2, 0]},
+        format="json",
+    )
+    assert response.status_code == 200, response.content
+
+    with scopes_disabled():
+        for o in (a, b, c):
+            o.refresh_from_db()
+        rooms = {
+            o.code: [
+                (p.item_id, p.price) for p in o.positions.filter(addon_to__isnull=False)
+            ]
+            for o in (a, b, c)
+        }
+        assert rooms == {
+            a.code: [(suite.pk, Decimal("80.00"))],
+            b.code: [],
+            c.code: [(items["room"].pk, Decimal("50.00"))],
+        }
+        assert (a.total, b.total, c.total) == (
+            Decimal("180.00"),
+            Decimal("100.00"),
+            Decimal("150.00"),
+        )
+        assert all(o.status == Order.STATUS_PAID for o in (a, b, c))
+        # Every order settles its own balance with the fz manual provider
+        manual = FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER
+        assert settlements(a) == (
+            [
+                ("manual", OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("150.00")),
+                (manual, OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("30.00")),
+            ],
+            [],
+        )
+        assert settlements(b) == (
+            [("manual", OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("180.00"))],
+            [(manual, OrderRefund.REFUND_STATE_DONE, Decimal("80.00"))],
+        )
+        assert settlements(c) == (
+            [
+                ("manual", OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("100.00")),
+                (manual, OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("50.00")),
+            ],
+            [],
+        )
+
+
+def exchangeSpec(source, dest):
+    (sourceOrder, sourceRoot, (sourceRoom,)), (destOrder, destRoot, (destRoom,)) = (
+        source,
+        dest,
+    )
+    return {
+        "sourceOrderCode": sourceOrder.code,
+        "sourceRootPositionId": sourceRoot.pk,
+        "destOrderCode": destOrder.code,
+        "destRootPositionId": destRoot.pk,
+        "exchanges": [
+            {"sourcePositionId": sourceRoom.pk, "destPositionId": destRoom.pk}
+        ],
+    }
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("fineGrainedLocking", [False, True])
+def test_exchange_rooms_batch(
+    event, items, quota, makeOrder, apiClient, apiUrl, fineGrainedLocking
+):
+    with scopes_disabled():
+        suite = Item.objects.create(
+            event=event, name="Suite", default_price=Decimal("80.00")
+        )
+        quota.items.add(suite)
+    a = makeOrder("AAAAA", rooms=[items["room"]])
+    b = makeOrder("BBBB", rooms=[suite])
+    c = makeOrder("CCC", rooms=[items["room"]])
+    e = makeOrder("EEE", rooms=[suite])
+    with scopes_disabled():
+        e[0].payments.create(
+            amount=Decimal("1.00"),
+            state=OrderPayment.PAYMENT_STATE_PENDING,
+            provider="manual",
+        )
+    # All in the same chunk: the last pair exchanges again the position A got from the first one
+    exchanges = [
+        exchangeSpec(a, b),
+        {"sourceOrderCode": 1},
+        exchangeSpec(c, e),
+        exchangeSpec(a, c),
+    ]
+    response = apiClient.post(
+        apiUrl("exchange-rooms-batch"),
+        {"exchanges": exchanges, "fineGrainedLocking": fineGrainedLocking},
+        format="json",
+    )
+    assert response.status_code == 200, response.content
+
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == [
+        200,
+        400,
+        STATUS_CODE_PAYMENT_INVALID,
+        200,
+    ]
+    assert "error" in results[1] and "error" in results[2]
+    with scopes_disabled():
+        for order, _, (room,) in (a, b, c, e):
+            order.refresh_from_db()
+            room.refresh_from_db()
+        rooms = {
+            order.code: (room.item_id, room.price, order.total)
+            for order, _, (room,) in (a, b, c, e)
+        }
+        assert rooms == {
+            "AAAAA": (items["room"].pk, Decimal("50.00"), Decimal("150.00")),
+            "BBBB": (items["room"].pk, Decimal("50.00"), Decimal("150.00")),
+            "CCC": (suite.pk, Decimal("80.00"), Decimal("180.00")),
+            # The failed pair is rolled back alone
+            "EEE": (suite.pk, Decimal("80.00"), Decimal("180.00")),
+        }
+        manual = FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER
+        assert settlements(a[0]) == (
+            [
+                ("manual", OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("150.00")),
+                (manual, OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("30.00")),
+            ],
+            [(manual, OrderRefund.REFUND_STATE_DONE, Decimal("30.00"))],
+        )
+        assert settlements(c[0]) == (
+            [
+                ("manual", OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("150.00")),
+                (manual, OrderPayment.PAYMENT_STATE_CONFIRMED, Decimal("30.00")),
+            ],
+            [],
+        )
+        assert e[0].payments.count() == 2 and not e[0].refunds.exists()
+
+
+# A chunk that cannot take its locks is reported as a whole, the following chunks are still run
+@pytest.mark.django_db
+def test_exchange_rooms_batch_chunk_lock_timeout(
+    event, items, quota, makeOrder, apiClient, apiUrl, monkeypatch
+):
+    with scopes_disabled():
+        suite = Item.objects.create(
+            event=event, name="Suite", default_price=Decimal("80.00")
+        )
+        quota.items.add(suite)
+    a = makeOrder("AAAAA", rooms=[items["room"]])
+    b = makeOrder("BBBB", rooms=[suite])
+    c = makeOrder("CCC", rooms=[items["room"]])
+    d = makeOrder("DDD", rooms=[suite])
+    lock = exchange_rooms.lockExchange
+    timedOut = []
+
+    def lockOrTimeout(event, orderCodes, positionIds, fineGrainedLocking):
+        if not timedOut:
+            timedOut.append(orderCodes)
+            raise LockTimeoutException()
+        return lock(event, orderCodes, positionIds, fineGrainedLocking)
+
+    monkeypatch.setattr(exchange_rooms, "lockExchange", lockOrTimeout)
+
+    response = apiClient.post(
+        apiUrl("exchange-rooms-batch"),
+        {"exchanges": [exchangeSpec(a, b), exchangeSpec(c, d)], "chunkSize": 1},
+        format="json",
+    )
+
+    assert response.status_code == 200, response.content
+    results = response.json()["results"]
+    assert [(r["sourceOrderCode"], r["status"]) for r in results] == [
+        ("AAAAA", 409),
+        ("CCC", 200),
+    ]
+    with scopes_disabled():
+        (aRoom,), (cRoom,) = a[2], c[2]
+        aRoom.refresh_from_db()
+        cRoom.refresh_from_db()
+        assert aRoom.item_id == items["room"].pk
+        assert cRoom.item_id == suite.pk
+
+
+# A spec overriding the batch fineGrainedLocking gets its own chunk, without changing the order of the pairs
+@pytest.mark.django_db
+def test_exchange_rooms_batch_spec_locking(
+    event, items, quota, makeOrder, apiClient, apiUrl, monkeypatch
+):
+    a, b, c, d = (
+        makeOrder(code, rooms=[items["room"]])
+        for code in ("AAAAA", "BBBB", "CCC", "DDD")
+    )
+    lock = exchange_rooms.lockExchange
+    chunks = []
+
+    def recordingLock(event, orderCodes, positionIds, fineGrainedLocking):
+        chunks.append((len(orderCodes) // 2, fineGrainedLocking))
+        return lock(event, orderCodes, positionIds, fineGrainedLocking)
+
+    monkeypatch.setattr(exchange_rooms, "lockExchange", recordingLock)
+    exchanges = [
+        exchangeSpec(a, b),
+        {**exchangeSpec(c, d), "fineGrainedLocking": True},
+        {**exchangeSpec(a, c), "fineGrainedLocking": True},
+        {**exchangeSpec(b, d), "fineGrainedLocking": False},
+        exchangeSpec(a, d),
+    ]
+
+    response = apiClient.post(
+        apiUrl("exchange-rooms-batch"), {"exchanges": exchanges}, format="json"
+    )
+
+    assert response.status_code == 200, response.content
+    assert [r["status"] for r in response.json()["results"]] == [200] * 5
+    assert chunks == [(1, False), (2, True), (2, False)]
@@ -0,0 +1,105 @@
+import pytest
+from decimal import Decimal
+from django.http import JsonResponse
+from django.http.request import QueryDict
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPosition
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import FzTaskRequest
+from pretix_fzbackend_utils.fz_utilites.fzIdempotency import (
+    IDEMPOTENCY_KEY_HEADER,
+    idempotencyRequestHash,
+    idempotent,
+)
+from pretix_fzbackend_utils.models import FzIdempotencyRecord
+
+
+class Endpoint:
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = 0
+
+    @idempotent("test")
+    def post(self, request, *args, **kwargs):
+        self.calls += 1
+        return self.respond()
+
+
+def keyedRequest(event, data, key):
+    request = FzTaskRequest(event, data)
+    request.headers = {IDEMPOTENCY_KEY_HEADER: key}
+    return request
+
+
+@pytest.mark.django_db
+def test_replay_and_different_body(event, order, items, apiClient, apiUrl):
+    with scopes_disabled():
+        position = OrderPosition.objects.create(
+            order=order, item=items["ticket"], price=Decimal("0.00"), positionid=1
+        )
+    body = [{"position": position.pk, "is_bundle": True}]
+
+    first = apiClient.post(
+        apiUrl("set-item-bundle"), body, format="json", HTTP_IDEMPOTENCY_KEY="k1"
+    )
+    assert first.status_code == 200
+    with scopes_disabled():
+        OrderPosition.all.filter(pk=position.pk).update(is_bundled=False)
+
+    replay = apiClient.post(
+        apiUrl("set-item-bundle"), body, format="json", HTTP_IDEMPOTENCY_KEY="k1"
+    )
+    assert (replay.status_code, replay.content) == (200, first.content)
+    # Not executed again
+    position.refresh_from_db()
+    assert not position.is_bundled
+
+    other = apiClient.post(
+        apiUrl("set-item-bundle"),
+        [{"position": position.pk, "is_bundle": False}],
+        format="json",
+        HTTP_IDEMPOTENCY_KEY="k1",
+    )
+    assert other.status_code == 422
+    tooLong = apiClient.post(
+        apiUrl("set-item-bundle"), body, format="json", HTTP_IDEMPOTENCY_KEY="k" * 191
+    )
+    assert tooLong.status_code == 400
+    assert FzIdempotencyRecord.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_key_in_progress(event):
+    endpoint = Endpoint(lambda: JsonResponse({}))
+    FzIdempotencyRecord.objects.create(
+        event=event,
+        endpoint="test",
+        key="k1",
+        request_hash=idempotencyRequestHash({"a": 1}, QueryDict()),
+    )
+
+    response = endpoint.post(keyedRequest(event, {"a": 1}, "k1"))
+
+    assert response.status_code == 409
+    assert endpoint.calls == 0
+
+
+@pytest.mark.django_db
+def test_key_released_on_server_error(event):
+    def fail():
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        Endpoint(fail).post(keyedRequest(event, {"a": 1}, "k1"))
+    assert (
+        Endpoint(lambda: JsonResponse({}, status=500))
+        .post(keyedRequest(event, {"a": 1}, "k1"))
+        .status_code
+        == 500
+    )
+    assert not FzIdempotencyRecord.objects.exists()
+
+    endpoint = Endpoint(lambda: JsonResponse({"ok": True}))
+    assert endpoint.post(keyedRequest(event, {"a": 1}, "k1")).status_code == 200
+    assert endpoint.post(keyedRequest(event, {"a": 1}, "k1")).status_code == 200
+    assert endpoint.calls == 1
@@ -0,0 +1,65 @@
+import pytest
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import Event, OrderPosition
+
+from pretix_fzbackend_utils.general_views import setItemBundles, validateItemBundleEntry
+
+
+@pytest.mark.django_db
+def test_set_item_bundles(event, order, items, makeOrder):
+    with scopes_disabled():
+        otherEvent = Event.objects.create(
+            organizer=event.organizer,
+            name="Other",
+            slug="other",
+            date_from=event.date_from,
+        )
+    _, foreign, _ = makeOrder("OT001", orderEvent=otherEvent)
+    with scopes_disabled():
+        positions = [
+            OrderPosition.objects.create(
+                order=order,
+                item=items["ticket"],
+                price=Decimal("0.00"),
+                positionid=i,
+                is_bundled=i % 2 == 0,
+            )
+            for i in range(1, 5)
+        ]
+
+        entries = [
+            {"position": p.pk, "is_bundle": p.positionid <= 2} for p in positions
+        ]
+        entries += [
+            {"position": foreign.pk, "is_bundle": True},
+            {"position": 999999, "is_bundle": False},
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            updated, missing = setItemBundles(event, entries)
+        # Existing ids + one UPDATE per value
+        assert len(ctx.captured_queries) == 3
+        assert (updated, missing) == (4, sorted([foreign.pk, 999999]))
+        assert [OrderPosition.objects.get(pk=p.pk).is_bundled for p in positions] == [
+            True,
+            True,
+            False,
+            False,
+        ]
+        foreign.refresh_from_db()
+        assert not foreign.is_bundled
+
+
+def test_validate_item_bundle_entry():
+    assert validateItemBundleEntry({"position": 1, "is_bundle": True}) is None
+    assert (
+        validateItemBundleEntry({"position": "1", "is_bundle": True})
+        == 'Missing or invalid parameter "position"'
+    )
+    assert (
+        validateItemBundleEntry({"position": 1})
+        == 'Missing or invalid parameter "is_bundle"'
+    )
+    assert validateItemBundleEntry(1) == 'Missing or invalid parameter "position"'
@@ -0,0 +1,63 @@
+import pytest
+from decimal import Decimal
+from django.db import connection, transaction
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPayment, OrderPosition, OrderRefund
+
+from pretix_fzbackend_utils.fz_utilites.fzLockManager import FzLockManager
+
+
+@pytest.mark.django_db
+def test_lock_manager_locks_one_statement_per_table(event, order, items):
+    with scopes_disabled():
+        positions = [
+            OrderPosition.objects.create(
+                order=order,
+                item=items["ticket"],
+                price=Decimal("100.00"),
+                positionid=i + 1,
+            )
+            for i in range(3)
+        ]
+        pending = order.payments.create(
+            amount=Decimal("10.00"),
+            state=OrderPayment.PAYMENT_STATE_PENDING,
+            provider="manual",
+        )
+        order.payments.create(
+            amount=Decimal("10.00"),
+            state=OrderPayment.PAYMENT_STATE_CONFIRMED,
+            provider="manual",
+        )
+
+        with transaction.atomic(), CaptureQueriesContext(connection) as ctx:
+            locks = (
+                FzLockManager(event)
+                .addOrders([order.code, "MISSING"])
+                .addPositions([p.pk for p in positions] + [None])
+                .addPayments(
+                    [
+                        OrderPayment.PAYMENT_STATE_CREATED,
+                        OrderPayment.PAYMENT_STATE_PENDING,
+                    ]
+                )
+                .addRefunds([OrderRefund.REFUND_STATE_CREATED])
+                .addItems([items["ticket"].pk])
+                .lock()
+            )
+
+    # orders, positions, payments, refunds, items
+    assert len(ctx.captured_queries) == 5
+    assert locks.order(order.code).pk == order.pk
+    assert [locks.position(p.pk, order).pk for p in positions] == [
+        p.pk for p in positions
+    ]
+    assert locks.paymentsOf(order) == [pending]
+    assert locks.refundsOf(order) == []
+    assert locks.item(items["ticket"].pk).pk == items["ticket"].pk
+    with pytest.raises(Http404):
+        locks.order("MISSING")
+    with pytest.raises(Http404):
+        locks.item(items["card"].pk)
@@ -0,0 +1,62 @@
+import pytest
+from django.db import transaction
+from pretix.base.services import tickets
+from pretix.base.signals import order_modified
+
+from pretix_fzbackend_utils.fz_utilites.fzOrderSignals import (
+    invalidateTicketsOnCommit,
+    sendOrderModifiedOnCommit,
+)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_dispatched_once_per_order_on_commit(event, order, monkeypatch):
+    invalidations = []
+    monkeypatch.setattr(
+        tickets.invalidate_cache,
+        "apply_async",
+        lambda kwargs: invalidations.append(kwargs),
+    )
+    modified = []
+    monkeypatch.setattr(
+        order_modified, "send", lambda sender, order: modified.append(order.pk)
+    )
+
+    with transaction.atomic():
+        invalidateTicketsOnCommit(event, order)
+        sendOrderModifiedOnCommit(event, order)
+        try:
+            with transaction.atomic():
+                invalidateTicketsOnCommit(event, order)
+                sendOrderModifiedOnCommit(event, order)
+                raise ValueError()
+        except ValueError:
+            pass
+        invalidateTicketsOnCommit(event, order)
+        assert invalidations == [] and modified == []
+
+    assert invalidations == [{"event": event.pk, "order": order.pk}]
+    assert modified == [order.pk]
+
+    # Nothing is dispatched for rolled back transactions, a later commit dispatches again
+    with pytest.raises(ValueError), transaction.atomic():
+        invalidateTicketsOnCommit(event, order)
+        raise ValueError()
+    assert len(invalidations) == 1
+    with transaction.atomic():
+        invalidateTicketsOnCommit(event, order)
+    assert len(invalidations) == 2
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rolled_back_keys_are_not_kept(event, order, monkeypatch):
+    monkeypatch.setattr(tickets.invalidate_cache, "apply_async", lambda kwargs: None)
+    with pytest.raises(ValueError), transaction.atomic():
+        invalidateTicketsOnCommit(event, order)
+        raise ValueError()
+
+    with transaction.atomic():
+        sendOrderModifiedOnCommit(event, order)
+        assert transaction.get_connection().fzPendingOnCommitKeys == {
+            ("modified", order.pk)
+        }
@@ -0,0 +1,33 @@
+import pytest
+from django.urls import resolve
+
+from pretix_fzbackend_utils.fz_utilites.fzOrderUrl import matchOrderUrl, resolveOrderUrl
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/furizon/fz/order/ABC12/s3cr3t/",
+        "/furizon/fz/order/ABC12/s3cr3t/pay/change",
+        "/furizon/fz/order/ABC12/s3cr3t",
+        "/furizon/fz/",
+        "/furizon/fz/redeem",
+        "/order/ABC12/s3cr3t/",
+        "/furizon/fz/order/ABC12/s3cr3t-/",
+        "/not/a/valid/order/ABC12/s3cr3t/",
+    ],
+)
+def test_match_order_url_like_resolve(path):
+    resolveOrderUrl.cache_clear()
+    try:
+        match = resolve(path)
+        expected = (
+            (match.kwargs["order"], match.kwargs["secret"])
+            if match.url_name == "event.order"
+            else None
+        )
+    except Exception:
+        expected = None
+    assert matchOrderUrl(path) == expected
+    # Cached result
+    assert matchOrderUrl(path) == expected
@@ -0,0 +1,30 @@
+import pytest
+from django.urls import Resolver404, resolve
+
+from pretix_fzbackend_utils.fz_utilites.fzOrderUrl import matchOrderUrl
+
+pytest.importorskip("pytest_benchmark")
+
+PATHS = {
+    "index": "/furizon/fz/",
+    "checkout": "/furizon/fz/checkout/questions/",
+    "order": "/furizon/fz/order/ABC12/s3cr3t/",
+}
+
+
+# What returnurl_process_request did before on every presale request
+def resolveOrderUrlName(path: str):
+    try:
+        return resolve(path).url_name == "event.order"
+    except Resolver404:
+        return False
+
+
+@pytest.mark.parametrize("page", list(PATHS))
+@pytest.mark.parametrize("matcher", ["resolve", "fastPath"])
+def test_benchmark_order_url_match(benchmark, page, matcher):
+    path = PATHS[page]
+    func = resolveOrderUrlName if matcher == "resolve" else matchOrderUrl
+    result = benchmark(func, path)
+    assert bool(result) == (page == "order")
+    benchmark.extra_info["page"] = page
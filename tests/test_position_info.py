@@ -0,0 +1,61 @@
+import pytest
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+from pretix.base.models import OrderPosition, Question, QuestionOption
+
+from pretix_fzbackend_utils.fz_utilites.fzPositionInfo import clonePositionInfo
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("moveAnswers", [False, True])
+def test_clone_position_info(event, order, items, questions, moveAnswers):
+    with scopes_disabled():
+        choice = Question.objects.create(
+            event=event,
+            question="Choice",
+            type=Question.TYPE_CHOICE_MULTIPLE,
+            required=False,
+        )
+        options = [
+            QuestionOption.objects.create(question=choice, answer=a, identifier=a)
+            for a in ("A", "B")
+        ]
+        source = OrderPosition.objects.create(
+            order=order,
+            item=items["ticket"],
+            price=Decimal("100.00"),
+            positionid=1,
+            attendee_name_parts={"_scheme": "full", "full_name": "Pippo"},
+            attendee_email="p@example.org",
+            country="IT",
+        )
+        source.answers.create(question=questions["userId"], answer="42")
+        source.answers.create(question=choice, answer="A, B").options.set(options)
+        dest = OrderPosition.objects.create(
+            order=order,
+            item=items["room"],
+            price=Decimal("50.00"),
+            positionid=2,
+            addon_to=source,
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            logData = clonePositionInfo(source, dest, moveAnswers=moveAnswers)
+        # order touch + fields update, answers read (+ options), answers insert + options insert or answers update
+        assert len(ctx.captured_queries) == (4 if moveAnswers else 6)
+
+        dest.refresh_from_db()
+        assert dest.attendee_name == "Pippo"
+        assert (dest.attendee_email, str(dest.country)) == ("p@example.org", "IT")
+        assert sorted(
+            (a.question_id, a.answer, sorted(o.identifier for o in a.options.all()))
+            for a in dest.answers.all()
+        ) == [
+            (questions["userId"].pk, "42", []),
+            (choice.pk, "A, B", ["A", "B"]),
+        ]
+        assert source.answers.count() == (0 if moveAnswers else 2)
+        assert logData[f"question_{questions['userId'].pk}"] == "42"
+        assert logData["country"] == "IT"
@@ -0,0 +1,106 @@
+import pytest
+from django.db import OperationalError, transaction
+from pretix.base.signals import order_paid, order_placed
+
+from pretix_fzbackend_utils.fz_utilites import fzRetry
+from pretix_fzbackend_utils.fz_utilites.fzOrderSignals import (
+    sendOrderPaidOnCommit,
+    sendOrderPlacedOnCommit,
+)
+from pretix_fzbackend_utils.fz_utilites.fzRetry import (
+    RETRY_MAX_ATTEMPTS,
+    atomicWithRetry,
+    retryableReason,
+)
+
+
+class DriverError(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def dbError(pgcode):
+    # Same chaining Django's DatabaseErrorWrapper does
+    try:
+        raise DriverError(pgcode)
+    except DriverError as e:
+        try:
+            raise OperationalError(str(e)) from e
+        except OperationalError as wrapped:
+            return wrapped
+
+
+def failing(pgcode, attempts):
+    def fn():
+        attempts.append(1)
+        raise dbError(pgcode)
+
+    return fn
+
+
+def test_retryable_reason():
+    assert retryableReason(dbError("40P01")) == "deadlock"
+    assert retryableReason(dbError("40001")) == "serialization"
+    assert retryableReason(dbError("23505")) is None
+    assert retryableReason(ValueError()) is None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_atomic_with_retry(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(fzRetry.time, "sleep", sleeps.append)
+
+    attempts = []
+
+    def flaky():
+        attempts.append(transaction.get_connection().in_atomic_block)
+        if len(attempts) < 3:
+            raise dbError("40P01")
+        return "done"
+
+    assert atomicWithRetry("test", flaky) == "done"
+    assert attempts == [True, True, True]
+    assert len(sleeps) == 2
+    assert all(0 <= s <= fzRetry.RETRY_MAX_DELAY for s in sleeps)
+
+    # Non retryable errors are raised immediately, retryable ones after RETRY_MAX_ATTEMPTS attempts
+    attempts.clear()
+    with pytest.raises(OperationalError):
+        atomicWithRetry("test", failing("23505", attempts))
+    assert len(attempts) == 1
+
+    attempts.clear()
+    with pytest.raises(OperationalError):
+        atomicWithRetry("test", failing("40001", attempts))
+    assert len(attempts) == RETRY_MAX_ATTEMPTS
+
+    # Inside an outer transaction there is nothing we can retry
+    attempts.clear()
+    with pytest.raises(OperationalError), transaction.atomic():
+        atomicWithRetry("test", failing("40P01", attempts))
+    assert len(attempts) == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_retried_attempts_send_no_order_signals(event, order, monkeypatch):
+    monkeypatch.setattr(fzRetry.time, "sleep", lambda delay: None)
+    placed = []
+    monkeypatch.setattr(
+        order_placed, "send", lambda sender, order, bulk: placed.append(order.pk)
+    )
+    paid = []
+    monkeypatch.setattr(order_paid, "send", lambda sender, order: paid.append(order.pk))
+
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        sendOrderPlacedOnCommit(event, order)
+        sendOrderPaidOnCommit(event, order)
+        if len(attempts) < 2:
+            raise dbError("40P01")
+
+    atomicWithRetry("test", flaky)
+    assert len(attempts) == 2
+    assert placed == [order.pk] and paid == [order.pk]
@@ -0,0 +1,60 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django_scopes import scopes_disabled
+
+from pretix_fzbackend_utils.fz_utilites.fzSettings import (
+    SETTINGS_CACHE,
+    eventPluginSettings,
+)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("locmemCache")
+def test_event_plugin_settings_cached_and_invalidated(event):
+    with scopes_disabled():
+        event.settings.fzbackendutils_redirect_url = "https://fz.example.org/a"
+        assert (
+            eventPluginSettings(event)["fzbackendutils_redirect_url"]
+            == "https://fz.example.org/a"
+        )
+        with CaptureQueriesContext(connection) as ctx:
+            assert (
+                eventPluginSettings(event)["fzbackendutils_redirect_url"]
+                == "https://fz.example.org/a"
+            )
+        assert len(ctx.captured_queries) == 0
+
+        # Saving the setting invalidates the cached value
+        event.settings.fzbackendutils_redirect_url = "https://fz.example.org/b"
+        assert (
+            eventPluginSettings(event)["fzbackendutils_redirect_url"]
+            == "https://fz.example.org/b"
+        )
+        # Organizer settings are inherited
+        event.settings.delete("fzbackendutils_redirect_url")
+        event.organizer.settings.fzbackendutils_redirect_url = (
+            "https://fz.example.org/c"
+        )
+        assert (
+            eventPluginSettings(event)["fzbackendutils_redirect_url"]
+            == "https://fz.example.org/c"
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("locmemCache")
+def test_local_ttl_skips_version_read(event, monkeypatch):
+    reads = []
+    version = SETTINGS_CACHE.version
+    monkeypatch.setattr(
+        SETTINGS_CACHE, "version", lambda scope: reads.append(scope) or version(scope)
+    )
+    SETTINGS_CACHE.invalidate(event.pk)
+    eventPluginSettings(event)
+    eventPluginSettings(event)
+    assert reads == [event.pk]
+
+    monkeypatch.setattr(SETTINGS_CACHE, "localTtl", 0)
+    eventPluginSettings(event)
+    assert reads == [event.pk, event.pk]
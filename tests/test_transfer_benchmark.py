@@ -0,0 +1,79 @@
+import pytest
+import random
+import tracemalloc
+from decimal import Decimal
+
+from pretix_fzbackend_utils.fz_utilites.fzTransferPositions import (
+    renumberTransferPositions,
+)
+
+pytest.importorskip("pytest_benchmark")
+
+POSITION_COUNTS = [1, 10, 100, 1000, 10000]
+ANSWERS_PER_POSITION = 20
+MAX_ADDONS_PER_ROOT = 50
+
+
+# Builds the copySourcePositions() output of a synthetic order with positionCount positions. Pretix only allows
+# one addon level, so addon trees are deep in the sense of wide: each root gets up to MAX_ADDONS_PER_ROOT addons
+def syntheticTransferPositions(positionCount: int, seed: int = 0):
+    rnd = random.Random(seed)
+    basePositions = []
+    positionIdToAddons = {}
+    sourceId = 1000
+    remaining = positionCount
+    while remaining > 0:
+        rootId = sourceId
+        basePositions.append(syntheticPosition(rootId))
+        sourceId += 1
+        remaining -= 1
+        addonCount = min(remaining, rnd.randint(0, MAX_ADDONS_PER_ROOT))
+        if addonCount > 0:
+            positionIdToAddons[rootId] = [
+                syntheticPosition(sourceId + i) for i in range(addonCount)
+            ]
+            sourceId += addonCount
+            remaining -= addonCount
+    return basePositions, positionIdToAddons
+
+
+def syntheticPosition(sourceId: int) -> dict:
+    return {
+        "positionid": sourceId,
+        "item": sourceId % 7 + 1,
+        "variation": None,
+        "price": Decimal("10.00"),
+        "seat": None,
+        "attendee_name": f"Attendee {sourceId}",
+        "attendee_email": f"a{sourceId}@example.com",
+        "subevent": None,
+        "discount": None,
+        "answers": [
+            {"question": q, "answer": f"answer {sourceId}-{q}", "options": []}
+            for q in range(1, ANSWERS_PER_POSITION + 1)
+        ],
+    }
+
+
+@pytest.mark.parametrize("positionCount", POSITION_COUNTS)
+def test_benchmark_renumber_transfer_positions(benchmark, positionCount):
+    # Input is modified in place, so every round gets a fresh copy
+    def setup():
+        return syntheticTransferPositions(positionCount), {}
+
+    result = benchmark.pedantic(
+        renumberTransferPositions,
+        setup=setup,
+        rounds=20 if positionCount < 10000 else 5,
+    )
+    assert len(result[0]) == positionCount
+
+    basePositions, positionIdToAddons = syntheticTransferPositions(positionCount)
+    tracemalloc.start()
+    try:
+        renumberTransferPositions(basePositions, positionIdToAddons)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["positions"] = positionCount
+    benchmark.extra_info["peakMemoryBytes"] = peak
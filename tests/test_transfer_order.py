@@ -0,0 +1,443 @@
+import pytest
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from django_scopes import scopes_disabled
+from pretix.api.serializers import order as orderSerializers
+from pretix.api.webhooks import notify_webhooks
+from pretix.base.models import (
+    Event_SettingsStore,
+    LogEntry,
+    Order,
+    OrderPayment,
+    OrderPosition,
+    Question,
+    QuestionAnswer,
+    QuestionOption,
+    Quota,
+)
+from pretix.base.services import orders
+from pretix.base.services.locking import LockTimeoutException
+from pretix.base.services.notifications import notify
+
+from pretix_fzbackend_utils.fz_utilites.fzException import FzException
+from pretix_fzbackend_utils.fz_utilites.fzLockManager import FzLockManager
+from pretix_fzbackend_utils.fz_utilites.fzTransferPositions import (
+    renumberTransferPositions,
+)
+from pretix_fzbackend_utils.payment import FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER
+from pretix_fzbackend_utils.utils import STATUS_CODE_PAYMENT_INVALID
+from pretix_fzbackend_utils.views import transfer_order
+from pretix_fzbackend_utils.views.transfer_order import (
+    copySourcePositions,
+    loadSourcePositions,
+    lockTransferredQuotasAndSeats,
+    verifyTransferredPositions,
+)
+
+
+def transferSpec(items, questions, orderCode, **kwargs):
+    return {
+        "orderCode": orderCode,
+        "membershipCardItemIds": [items["card"].pk],
+        "membershipCardNeededForNewUser": False,
+        "userIdQuestionId": questions["userId"].pk,
+        "newUserId": 42,
+        "newEmail": f"{orderCode.lower()}@example.org",
+        "name": "Pluto",
+        "street": "Via Roma 1",
+        "zipcode": "00100",
+        "city": "Roma",
+        "country": "IT",
+        "state": "",
+        **kwargs,
+    }
+
+
+def choiceQuestions(event, count):
+    questions = []
+    for i in range(count):
+        question = Question.objects.create(
+            event=event,
+            question=f"Choice {i}",
+            type=Question.TYPE_CHOICE_MULTIPLE,
+            required=False,
+        )
+        QuestionOption.objects.create(
+            question=question, answer="A", identifier=f"Q{i}A"
+        )
+        QuestionOption.objects.create(
+            question=question, answer="B", identifier=f"Q{i}B"
+        )
+        questions.append(question)
+    return questions
+
+
+def addPositions(order, items, questions, roots, addonsPerRoot, answersPerPosition):
+    choices = choiceQuestions(order.event, answersPerPosition)
+    positionid = order.all_positions.count() + 1
+    for _ in range(roots):
+        root = OrderPosition.objects.create(
+            order=order,
+            item=items["ticket"],
+            price=Decimal("100.00"),
+            positionid=positionid,
+        )
+        positionid += 1
+        positions = [root]
+        for _ in range(addonsPerRoot):
+            positions.append(
+                OrderPosition.objects.create(
+                    order=order,
+                    item=items["room"],
+                    price=Decimal("50.00"),
+                    positionid=positionid,
+                    addon_to=root,
+                )
+            )
+            positionid += 1
+        OrderPosition.objects.create(
+            order=order,
+            item=items["card"],
+            price=Decimal("10.00"),
+            positionid=positionid,
+            addon_to=root,
+        )
+        positionid += 1
+        for pos in positions:
+            QuestionAnswer.objects.create(
+                orderposition=pos, question=questions["userId"], answer="1"
+            )
+            for question in choices:
+                answer = QuestionAnswer.objects.create(
+                    orderposition=pos, question=question, answer="A, B"
+                )
+                answer.options.add(*question.options.all())
+
+
+def copyQueries(order, items, questions):
+    with CaptureQueriesContext(connection) as ctx:
+        result = copySourcePositions(
+            loadSourcePositions(order), [items["card"].pk], questions["userId"].pk, 42
+        )
+    return len(ctx.captured_queries), result
+
+
+@pytest.mark.django_db
+def test_copy_source_positions_query_count_is_constant(order, items, questions):
+    with scopes_disabled():
+        addPositions(
+            order, items, questions, roots=1, addonsPerRoot=0, answersPerPosition=1
+        )
+        smallCount, _ = copyQueries(order, items, questions)
+
+        addPositions(
+            order, items, questions, roots=3, addonsPerRoot=3, answersPerPosition=15
+        )
+        bigCount, (basePositions, positionIdToAddons, membershipCardTotalAmount) = (
+            copyQueries(order, items, questions)
+        )
+
+    # positions (+ seat), answers (+ question), answer options
+    assert smallCount == bigCount == 3
+    assert len(basePositions) == 4
+    assert sum(len(addons) for addons in positionIdToAddons.values()) == 9
+    assert membershipCardTotalAmount == Decimal("40.00")
+    for pos in basePositions:
+        userIdAnswer = next(
+            a for a in pos["answers"] if a["question"] == questions["userId"].pk
+        )
+        assert userIdAnswer["answer"] == "42.0"
+
+
+def test_renumber_transfer_positions():
+    basePositions = [{"positionid": 10}, {"positionid": 20}, {"positionid": 30}]
+    positionIdToAddons = {
+        10: [{"positionid": 11}, {"positionid": 12}],
+        30: [{"positionid": 31}],
+    }
+
+    newPositions, membershipCardNewId = renumberTransferPositions(
+        basePositions, positionIdToAddons, 30
+    )
+
+    assert [p["positionid"] for p in newPositions] == [1, 2, 3, 4, 5, 6]
+    assert [p.get("addon_to") for p in newPositions] == [None, 1, 1, None, None, 5]
+    assert membershipCardNewId == 5
+
+
+@pytest.mark.django_db
+def test_transfer_orders_batch(
+    event, items, questions, quota, makeOrder, apiClient, apiUrl
+):
+    # Locks are taken longest code first: chunks are [BBBBBB, CCCCC], [AAAA, DDD], [ZZ]
+    for code in ("AAAA", "BBBBBB", "CCCCC", "DDD"):
+        makeOrder(code, rooms=[items["room"]])
+    with scopes_disabled():
+        # The transfer of CCCCC fails after its new order has been created
+        Order.objects.get(code="CCCCC").payments.create(
+            amount=Decimal("1.00"),
+            state=OrderPayment.PAYMENT_STATE_PENDING,
+            provider="manual",
+        )
+    transfers = [
+        transferSpec(items, questions, code)
+        for code in ("AAAA", "DDD", "CCCCC", "BBBBBB", "ZZ")
+    ]
+    transfers.insert(2, {"orderCode": "AAAA"})
+
+    response = apiClient.post(
+        apiUrl("transfer-orders"),
+        {"transfers": transfers, "chunkSize": 2},
+        format="json",
+    )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(r["orderCode"], r["status"]) for r in results] == [
+        ("AAAA", 200),
+        ("DDD", 200),
+        ("AAAA", 400),
+        ("CCCCC", 462),
+        ("BBBBBB", 200),
+        ("ZZ", 404),
+    ]
+    with scopes_disabled():
+        for code in ("AAAA", "DDD", "BBBBBB"):
+            result = next(r for r in results if r["orderCode"] == code)
+            newOrder = Order.objects.get(code=result["newOrderCode"])
+            assert newOrder.email == f"{code.lower()}@example.org"
+            assert Order.objects.get(code=code).status == Order.STATUS_CANCELED
+        # The failed transfer is rolled back alone, the rest of its chunk is committed
+        assert not Order.objects.filter(email="ccccc@example.org").exists()
+        assert Order.objects.get(code="CCCCC").status == Order.STATUS_PAID
+
+
+# A chunk that cannot take its locks is reported as a whole, the chunks before and after it are still committed
+@pytest.mark.django_db
+def test_transfer_orders_batch_chunk_lock_timeout(
+    event, items, questions, quota, makeOrder, apiClient, apiUrl, monkeypatch
+):
+    for code in ("AAAA", "BBBBBB", "CCCCC"):
+        makeOrder(code, rooms=[items["room"]])
+    lock = transfer_order.lockTransferredQuotasAndSeats
+
+    def lockOrTimeout(event, orderCodes, membershipCardItemIds):
+        if orderCodes == ["CCCCC"]:
+            raise LockTimeoutException()
+        return lock(event, orderCodes, membershipCardItemIds)
+
+    monkeypatch.setattr(transfer_order, "lockTransferredQuotasAndSeats", lockOrTimeout)
+    transfers = [
+        transferSpec(items, questions, code) for code in ("AAAA", "BBBBBB", "CCCCC")
+    ]
+
+    response = apiClient.post(
+        apiUrl("transfer-orders"),
+        {"transfers": transfers, "chunkSize": 1},
+        format="json",
+    )
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [(r["orderCode"], r["status"]) for r in results] == [
+        ("AAAA", 200),
+        ("BBBBBB", 200),
+        ("CCCCC", 409),
+    ]
+    with scopes_disabled():
+        assert Order.objects.get(code="AAAA").status == Order.STATUS_CANCELED
+        assert Order.objects.get(code="BBBBBB").status == Order.STATUS_CANCELED
+        assert Order.objects.get(code="CCCCC").status == Order.STATUS_PAID
+        assert not Order.objects.filter(email="ccccc@example.org").exists()
+
+
+# Quotas and seats of the whole chunk are locked once, before any row. What pretix locks on its own afterwards is
+# already held
+@pytest.mark.django_db
+def test_transfer_locks_quotas_before_rows(
+    event, items, questions, makeOrder, apiClient, apiUrl, monkeypatch, stubLockObjects
+):
+    calls = stubLockObjects(transfer_order)
+    stubLockObjects(orders)
+    stubLockObjects(orderSerializers)
+    lock = FzLockManager.lock
+    monkeypatch.setattr(
+        FzLockManager, "lock", lambda self: calls.append("rows") or lock(self)
+    )
+    with scopes_disabled():
+        roomQuota = Quota.objects.create(event=event, name="Rooms", size=10)
+        roomQuota.items.add(items["room"])
+        cardQuota = Quota.objects.create(event=event, name="Cards", size=10)
+        cardQuota.items.add(items["card"])
+        Quota.objects.create(event=event, name="Tickets", size=None).items.add(
+            items["ticket"]
+        )
+    makeOrder("AAAA", rooms=[items["room"]])
+    makeOrder("BBB")
+    transfers = [transferSpec(items, questions, code) for code in ("AAAA", "BBB")]
+
+    response = apiClient.post(
+        apiUrl("transfer-orders"), {"transfers": transfers}, format="json"
+    )
+
+    assert [r["status"] for r in response.json()["results"]] == [200, 200]
+    (quotas, shared), *rest = calls
+    assert (sorted(q.pk for q in quotas), shared) == (
+        sorted([roomQuota.pk, cardQuota.pk]),
+        [event],
+    )
+    assert [c for c in rest if c == "rows"] == ["rows", "rows"]
+    assert rest[0] == "rows"
+    assert all(
+        set(objects) <= set(quotas) and set(later) <= set(shared)
+        for objects, later in (c for c in rest if c != "rows")
+    )
+
+
+@pytest.mark.django_db
+def test_transfer_verifies_locked_positions(event, items, makeOrder, stubLockObjects):
+    stubLockObjects(transfer_order)
+    order, _, (room,) = makeOrder("AAAA", rooms=[items["room"]])
+    with scopes_disabled():
+        readPositions = lockTransferredQuotasAndSeats(
+            event, [order.code], [items["card"].pk]
+        )
+        verifyTransferredPositions(readPositions, order)
+
+        room.item = items["card"]
+        room.save()
+        with pytest.raises(FzException) as e:
+            verifyTransferredPositions(readPositions, order)
+        assert e.value.code == 409
+
+
+# The refund log entries are inserted in bulk: same entries as one log_action() per entry, with the same
+# notifications and webhooks dispatched
+@pytest.mark.django_db
+def test_transfer_refund_log_entries(
+    event, items, questions, quota, makeOrder, apiClient, apiUrl, monkeypatch
+):
+    dispatched = {"notification": set(), "webhook": set()}
+
+    def dispatcher(kind):
+        def apply_async(args, priority=None):
+            ids = args[0] if isinstance(args[0], list) else [args[0]]
+            dispatched[kind].update(ids)
+
+        return apply_async
+
+    monkeypatch.setattr(notify, "apply_async", dispatcher("notification"))
+    monkeypatch.setattr(notify_webhooks, "apply_async", dispatcher("webhook"))
+    order, _, _ = makeOrder("AAAA", rooms=[items["room"]])
+    with scopes_disabled():
+        payment = order.payments.get()
+        payment.amount = Decimal("100.00")
+        payment.save()
+        order.payments.create(
+            amount=Decimal("50.00"),
+            state=OrderPayment.PAYMENT_STATE_CONFIRMED,
+            provider="manual",
+            payment_date=now(),
+        )
+
+    response = apiClient.post(
+        apiUrl("transfer-order"), transferSpec(items, questions, "AAAA"), format="json"
+    )
+
+    assert response.status_code == 200
+    with scopes_disabled():
+        entries = [
+            e
+            for e in LogEntry.objects.filter(object_id=order.pk).order_by("pk")
+            if e.action_type.startswith(
+                ("pretix.event.order.payment.refunded", "pretix.event.order.refund.")
+            )
+        ]
+        assert [(e.action_type, e.parsed_data) for e in entries] == [
+            (
+                "pretix.event.order.payment.refunded",
+                {"local_id": 1, "provider": "manual"},
+            ),
+            (
+                "pretix.event.order.payment.refunded",
+                {"local_id": 2, "provider": "manual"},
+            ),
+            (
+                "pretix.event.order.refund.created",
+                {"local_id": 1, "provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER},
+            ),
+            (
+                "pretix.event.order.refund.done",
+                {"local_id": 1, "provider": FZ_MANUAL_PAYMENT_PROVIDER_IDENTIFIER},
+            ),
+        ]
+        assert all(
+            e.api_token_id is not None and e.event_id == event.pk for e in entries
+        )
+        bulkIds = {e.pk for e in entries}
+        assert dispatched["notification"] & bulkIds == {
+            e.pk for e in entries if e.notification_type
+        }
+        assert dispatched["webhook"] & bulkIds == {
+            e.pk for e in entries if e.webhook_type
+        }
+        assert {e.action_type for e in entries if e.pk in dispatched["webhook"]} == {
+            "pretix.event.order.refund.created",
+            "pretix.event.order.refund.done",
+        }
+
+
+# pretix's debug flag makes every lock_objects() call fail, like a real transfer does below
+FAIL_LOCKING = "?_debug_flag=fail-locking"
+
+
+@pytest.mark.django_db
+def test_transfer_dry_run(event, items, questions, quota, makeOrder, apiClient, apiUrl):
+    order, _, _ = makeOrder("AAAA", rooms=[items["room"]])
+    url = apiUrl("transfer-order") + FAIL_LOCKING
+    with scopes_disabled():
+        settingsCount = Event_SettingsStore.objects.filter(object=event).count()
+
+    with CaptureQueriesContext(connection) as ctx:
+        response = apiClient.post(
+            url, transferSpec(items, questions, "AAAA", dryRun=True), format="json"
+        )
+    assert response.status_code == 200
+    assert response.json()["valid"] and response.json()["errors"] == []
+    # No row locks, no advisory locks, and the default settings stored by the payment providers are rolled back
+    assert not any("FOR UPDATE" in q["sql"] for q in ctx.captured_queries)
+    with scopes_disabled():
+        assert Event_SettingsStore.objects.filter(object=event).count() == settingsCount
+    assert (
+        apiClient.post(
+            url, transferSpec(items, questions, "AAAA"), format="json"
+        ).status_code
+        == 409
+    )
+
+    # Same validation errors as a real run
+    badEmail = transferSpec(items, questions, "AAAA", newEmail="not an email")
+    realResponse = apiClient.post(apiUrl("transfer-order"), badEmail, format="json")
+    dryResponse = apiClient.post(url, {**badEmail, "dryRun": True}, format="json")
+    assert realResponse.status_code == 400
+    assert dryResponse.json()["errors"] == [realResponse.json()]
+
+    with scopes_disabled():
+        order.payments.create(
+            amount=Decimal("1.00"),
+            state=OrderPayment.PAYMENT_STATE_PENDING,
+            provider="manual",
+        )
+    realResponse = apiClient.post(
+        apiUrl("transfer-order"), transferSpec(items, questions, "AAAA"), format="json"
+    )
+    dryResponse = apiClient.post(
+        url, transferSpec(items, questions, "AAAA", dryRun=True), format="json"
+    )
+    assert realResponse.status_code == STATUS_CODE_PAYMENT_INVALID
+    assert dryResponse.json()["errors"] == [realResponse.json()]
+    assert not dryResponse.json()["valid"]
+    with scopes_disabled():
+        assert Order.objects.count() == 1
@@ -0,0 +1,52 @@
+import pytest
+from django.db import connection
+from django.http import Http404
+from django.test.utils import CaptureQueriesContext
+from pretix.base.settings import GlobalSettingsObject
+
+from pretix_fzbackend_utils.fz_utilites.fzAsyncJob import FzTaskRequest
+from pretix_fzbackend_utils.fz_utilites.fzSettings import (
+    ENDPOINT_TOKENS_SCOPE,
+    GLOBAL_SETTINGS_SCOPE,
+    SETTINGS_CACHE,
+)
+from pretix_fzbackend_utils.utils import TOKEN_HEADER, verifyToken
+
+
+class FakeRequest:
+    def __init__(self, token=None):
+        self.headers = {TOKEN_HEADER: token} if token is not None else {}
+
+
+@pytest.fixture
+def tokens():
+    def clear():
+        SETTINGS_CACHE.invalidate(GLOBAL_SETTINGS_SCOPE)
+        SETTINGS_CACHE.invalidate(ENDPOINT_TOKENS_SCOPE)
+
+    clear()
+    yield GlobalSettingsObject().settings
+    clear()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_verify_token(event, tokens):
+    # No token configured
+    verifyToken(FakeRequest())
+
+    tokens.set("fzbackendutils_internal_endpoint_token", "old-token, new-token")
+    verifyToken(FakeRequest("old-token"))
+    with CaptureQueriesContext(connection) as ctx:
+        verifyToken(FakeRequest("new-token"))
+    assert len(ctx.captured_queries) == 0
+    for token in (None, "", "new", "old-token, new-token"):
+        with pytest.raises(Http404):
+            verifyToken(FakeRequest(token))
+    # Already verified when received
+    verifyToken(FzTaskRequest(event, {}))
+
+    # Rotation: the old token is removed from the setting
+    tokens.set("fzbackendutils_internal_endpoint_token", "new-token")
+    verifyToken(FakeRequest("new-token"))
+    with pytest.raises(Http404):
+        verifyToken(FakeRequest("old-token"))